@@ -0,0 +1,313 @@
+# ============================================================
+# AGENDADOR – MODO DAEMON COM INTERVALO POR CAMADA
+# ============================================================
+#
+# Em vez de uma auditoria completa por dia (rodar.bat), cada camada roda
+# no seu próprio intervalo:
+#
+#   config.json -> jobs[].interval_minutes     intervalo da camada
+#   config.json -> daemon                      padrões e limites (abaixo)
+#
+# O intervalo se adapta ao histórico observado: execução com mudança
+# divide o fator da camada por 2, execução sem mudança multiplica por 1.5
+# (fator entre 1/4 e 4, intervalo entre min e max_interval_minutes).
+# Cada agendamento leva um jitter de ±jitter para as camadas não
+# sincronizarem. Falha não derruba o daemon: a camada volta em
+# retry_minutes (dobrando a cada falha seguida, até o intervalo normal).
+#
+# Uma camada nunca roda duas vezes ao mesmo tempo; no máximo
+# max_concurrent camadas rodam juntas (além do limite por host dos
+# downloads). Estado (próxima execução, fator, último resultado) em
+# downloads/agendador.json, mantido entre reinícios.
+#
+# Teams: um card por camada que mudou, pela caixa de saída (entregue em
+# segundo plano; o que estiver pendente ao parar sai no próximo início).
+# Catálogo (catalogo.py): revalidado a cada catalog.max_age_minutes;
+# mudança de esquema ou de camadas publicadas vira um card próprio e
+# refaz a lista de camadas.
+# Métricas: um arquivo por rodada
+# (gravado quando nenhuma camada está em execução).
+#
+# Uso:
+#   python agendador.py
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import baixar_geoserver as bg
+
+DAEMON = {
+    "interval_minutes": 1440,
+    "min_interval_minutes": 15,
+    "max_interval_minutes": 7 * 1440,
+    "max_concurrent": 2,
+    "jitter": 0.1,
+    "adaptive": True,
+    "retry_minutes": 15,
+    "tick_seconds": 30,
+    **bg.CONFIG.get("daemon", {}),
+}
+
+FATOR_MIN = 0.25
+FATOR_MAX = 4.0
+
+ESTADO_PATH = bg.DOWNLOAD_DIR/"agendador.json"
+
+
+class Agendador:
+
+    def __init__(self, camadas, estado_path=ESTADO_PATH, config=DAEMON):
+        self.camadas = list(camadas)
+        self.estado_path = estado_path
+        self.config = config
+        self.estado = self._carregar()
+        self.em_execucao = set()
+        self.concluidas = 0
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+
+    # ========================================================
+    # ESTADO
+    # ========================================================
+
+    def _carregar(self):
+        if not self.estado_path.exists():
+            return {}
+        try:
+            with open(self.estado_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            bg.log(f"agendador: estado ilegível ({e}), recomeçando")
+            return {}
+
+    def _salvar(self):
+        with self._lock:
+            dados = json.dumps(self.estado, ensure_ascii=False, indent=1)
+        tmp = self.estado_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(dados)
+        os.replace(tmp, self.estado_path)
+
+    # ========================================================
+    # INTERVALOS
+    # ========================================================
+
+    def intervalo_base(self, layer):
+        """Minutos: jobs[].interval_minutes ou daemon.interval_minutes."""
+        return bg.JOBS.get(layer, {}).get("interval_minutes", self.config["interval_minutes"])
+
+    def intervalo(self, layer):
+        """Intervalo atual (minutos), já com o fator adaptativo."""
+
+        base = self.intervalo_base(layer)
+        minutos = base
+
+        if self.config["adaptive"]:
+            minutos *= self.estado.get(layer, {}).get("fator", 1.0)
+
+        # o intervalo configurado do job sempre cabe nos limites
+        return min(
+            max(minutos, min(base, self.config["min_interval_minutes"])),
+            max(base, self.config["max_interval_minutes"])
+        )
+
+    def _agendar(self, minutos, agora):
+        jitter = self.config["jitter"]
+        return agora + minutos * 60 * (1 + random.uniform(-jitter, jitter))
+
+    def registrar(self, layer, resultado, agora):
+        """
+        Atualiza fator e próxima execução da camada.
+        resultado: "mudou", "inalterada", "inicial" ou "erro".
+        """
+
+        with self._lock:
+
+            e = self.estado.setdefault(layer, {"fator": 1.0, "falhas": 0})
+            e["ultima"] = agora
+            e["resultado"] = resultado
+
+            if resultado == "erro":
+                e["falhas"] += 1
+                minutos = min(
+                    self.config["retry_minutes"] * 2 ** (e["falhas"] - 1),
+                    self.intervalo(layer)
+                )
+            else:
+                e["falhas"] = 0
+                if resultado == "mudou":
+                    e["fator"] = max(FATOR_MIN, e["fator"] / 2)
+                elif resultado == "inalterada":
+                    e["fator"] = min(FATOR_MAX, e["fator"] * 1.5)
+                minutos = self.intervalo(layer)
+
+            e["proxima"] = self._agendar(minutos, agora)
+
+        bg.log(
+            f"{layer}: {resultado}, próxima em {(e['proxima'] - agora) / 60:.0f} min "
+            f"({datetime.fromtimestamp(e['proxima']):%d/%m %H:%M})"
+        )
+
+    def vencidas(self, agora):
+        """Camadas com execução vencida e que não estão rodando, da mais atrasada."""
+
+        with self._lock:
+            prontas = [
+                layer for layer in self.camadas
+                if layer not in self.em_execucao
+                and self.estado.get(layer, {}).get("proxima", 0) <= agora
+            ]
+
+        return sorted(prontas, key=lambda layer: self.estado.get(layer, {}).get("proxima", 0))
+
+    # ========================================================
+    # EXECUÇÃO
+    # ========================================================
+
+    def executar(self, layer):
+        """Roda uma camada; qualquer falha vira resultado "erro"."""
+
+        try:
+            situacao = self._processar(layer)
+            self.registrar(layer, situacao, time.time())
+            self._salvar()
+
+        except Exception as e:
+            bg.log(f"agendador: {layer}: {e}")
+
+        finally:
+            # só depois de reagendada: o laço não a pega de novo no meio
+            with self._lock:
+                self.em_execucao.discard(layer)
+                self.concluidas += 1
+
+    def _processar(self, layer):
+
+        try:
+            resultado = bg.processar_camada(layer)
+        except Exception as e:
+            bg.log(f"{layer}: ERRO {e}")
+            bg.METRICAS.resultado(layer, resultado="erro", erro=str(e))
+            return "erro"
+
+        if resultado is None:
+            return "inicial"
+
+        # INALTERADA ou diff só com ruído de normalização
+        if not isinstance(resultado, bg.Agregador) or not resultado:
+            return "inalterada"
+
+        try:
+            bg.enviar_teams(bg.montar_mensagem(resultado), resultado)
+        except Exception as e:
+            bg.log(f"{layer}: falha ao notificar: {e}")
+
+        return "mudou"
+
+    def _revisar_catalogo(self):
+        """Revalida o catálogo vencido; eventos de esquema -> card e nova lista de camadas."""
+
+        if not bg.CATALOGO.vencido():
+            return
+
+        eventos = bg.atualizar_catalogo()
+
+        if not eventos:
+            return
+
+        camadas = bg.camadas_ativas()
+        with self._lock:
+            self.camadas = camadas
+
+        vazio = bg.Agregador(bg.AUDIT_RULES)
+        bg.enviar_teams(bg.montar_mensagem(vazio, eventos=eventos), vazio, eventos)
+
+    def _fechar_rodada(self):
+        """Métricas das camadas concluídas desde a última rodada."""
+
+        with self._lock:
+            if self.em_execucao or not self.concluidas:
+                return
+            self.concluidas = 0
+
+        if bg.METRICS["enabled"]:
+            try:
+                bg.log(f"Métricas: {bg.METRICAS.gravar()}")
+            except OSError as e:
+                bg.log(f"Falha ao gravar métricas: {e}")
+
+        bg.METRICAS.iniciar()
+        bg.RELATORIO.iniciar()
+
+    def parar(self):
+        self._parar.set()
+
+    def rodar(self):
+
+        bg.log(
+            f"Agendador: {len(self.camadas)} camadas, "
+            f"até {self.config['max_concurrent']} simultâneas"
+        )
+
+        bg.METRICAS.iniciar()
+        bg.CAIXA_SAIDA.iniciar()
+
+        # Ctrl-C (ou qualquer erro) em qualquer ponto do laço: o with
+        # espera as camadas em execução e o encerramento roda mesmo assim
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.config["max_concurrent"])) as pool:
+
+                while not self._parar.is_set():
+
+                    try:
+                        self._revisar_catalogo()
+
+                        with self._lock:
+                            livres = self.config["max_concurrent"] - len(self.em_execucao)
+
+                        for layer in self.vencidas(time.time())[:max(0, livres)]:
+                            with self._lock:
+                                self.em_execucao.add(layer)
+                            pool.submit(self.executar, layer)
+
+                        self._fechar_rodada()
+
+                    except KeyboardInterrupt:
+                        self.parar()
+
+                    except Exception as e:
+                        bg.log(f"agendador: {e}")
+
+                    try:
+                        self._parar.wait(self.config["tick_seconds"])
+                    except KeyboardInterrupt:
+                        self.parar()
+
+                bg.log("Agendador: aguardando camadas em execução")
+
+        finally:
+            # o with já esperou as camadas submetidas: o que sobrou em
+            # em_execucao (Ctrl-C entre o add e o submit) não vai rodar
+            with self._lock:
+                self.em_execucao.clear()
+            bg.encerrar_pool_hash()
+            self._fechar_rodada()
+            bg.CAIXA_SAIDA.aguardar(bg.NOTIFICATIONS["flush_seconds"])
+            bg.CAIXA_SAIDA.parar()
+            bg.log("Agendador encerrado")
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+if __name__ == "__main__":
+
+    bg.inicializar()
+    bg.atualizar_catalogo()
+    Agendador(bg.camadas_ativas()).rodar()
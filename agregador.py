@@ -0,0 +1,135 @@
+# ============================================================
+# AGREGADOR DE MUDANÇAS (RESUMO HUMANO)
+# ============================================================
+#
+# Conta inclusões/remoções/modificações por camada e por chave de grupo,
+# a partir de audit_rules (config.json):
+#
+#   "group_by": "operadora" | ["nm_operadora", "cd_linha"] | ausente
+#   "summary": {
+#       "title": "🕒 Horários das Linhas",
+#       "unit": "viagens",
+#       "labels": {"cd_linha": "Linha"},
+#       "net": false,               (true: só o saldo inclusões − remoções)
+#       "critical_at": 50,          (inclusões + remoções que tornam o card CRITICO)
+#       "impact_removed_at": 10     (remoções num grupo -> impacto operacional)
+#   }
+#
+# Cada worker agrega a sua camada num Agregador próprio; main() junta os
+# parciais com mesclar(), sem estado global compartilhado.
+
+SEM_VALOR = "DESCONHECIDA"
+
+
+class Agregador:
+
+    def __init__(self, regras):
+        self.regras = regras
+        # layer -> {chave (tupla dos campos de group_by): {"add", "rem", "mod"}}
+        self.contagens = {}
+
+    # ========================================================
+    # CONFIGURAÇÃO
+    # ========================================================
+
+    def campos(self, layer):
+        group_by = self.regras.get(layer, {}).get("group_by") or []
+        return [group_by] if isinstance(group_by, str) else list(group_by)
+
+    def resumo(self, layer):
+        """summary de audit_rules com os padrões preenchidos."""
+
+        return {
+            "title": f"📦 {layer.split(':', 1)[-1]}",
+            "unit": "registros",
+            "labels": {},
+            "net": False,
+            "critical_at": None,
+            "impact_removed_at": None,
+            **self.regras.get(layer, {}).get("summary", {}),
+        }
+
+    # ========================================================
+    # CONTAGEM
+    # ========================================================
+
+    def _chave(self, feature, campos):
+        props = feature.get("properties") or {}
+        return tuple(
+            SEM_VALOR if props.get(c) is None else str(props.get(c))
+            for c in campos
+        )
+
+    def _somar(self, layer, chave, campo, n=1):
+        grupos = self.contagens.setdefault(layer, {})
+        grupos.setdefault(chave, {"add": 0, "rem": 0, "mod": 0})[campo] += n
+
+    def adicionar(self, layer, diff):
+        """
+        diff: saída de audit_utils.diff_by_identity.
+        Modificação que troca a chave de grupo (ex.: veículo que mudou de
+        operadora) conta como remoção no grupo antigo e inclusão no novo.
+        """
+
+        campos = self.campos(layer)
+
+        for f in diff["added"]:
+            self._somar(layer, self._chave(f, campos), "add")
+
+        for f in diff["removed"]:
+            self._somar(layer, self._chave(f, campos), "rem")
+
+        for m in diff["modified"]:
+            antiga = self._chave(m["old"], campos)
+            nova = self._chave(m["new"], campos)
+            if antiga == nova:
+                self._somar(layer, nova, "mod")
+            else:
+                self._somar(layer, antiga, "rem")
+                self._somar(layer, nova, "add")
+
+        return self
+
+    def mesclar(self, outro):
+        """Soma as contagens de outro Agregador (na ordem em que chegam)."""
+
+        for layer, grupos in outro.contagens.items():
+            for chave, info in grupos.items():
+                for campo, n in info.items():
+                    if n:
+                        self._somar(layer, chave, campo, n)
+
+        return self
+
+    # ========================================================
+    # CONSULTA
+    # ========================================================
+
+    def camadas(self):
+        return list(self.contagens)
+
+    def grupos(self, layer):
+        """[(chave, {"add", "rem", "mod"})] na ordem de chegada."""
+        return list(self.contagens.get(layer, {}).items())
+
+    def volume(self, layer):
+        """
+        Inclusões + remoções da camada (|saldo| por grupo quando net): o
+        que summary.critical_at mede. Modificações ficam de fora.
+        """
+
+        if self.resumo(layer)["net"]:
+            return sum(abs(i["add"] - i["rem"]) for _, i in self.grupos(layer))
+
+        return sum(i["add"] + i["rem"] for _, i in self.grupos(layer))
+
+    def total(self, layer):
+        """Volume de mudança da camada, com as modificações."""
+
+        if self.resumo(layer)["net"]:
+            return self.volume(layer)
+
+        return self.volume(layer) + sum(i["mod"] for _, i in self.grupos(layer))
+
+    def __bool__(self):
+        return any(self.total(layer) for layer in self.contagens)
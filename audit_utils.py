@@ -1,5 +1,10 @@
+import hashlib
 import json
-from typing import Dict, Any, List, Tuple, Optional
+from collections import deque
+from typing import Dict, Any, Iterable, Iterator, List, Tuple, Optional, Union
+
+import numpy as np
+import shapely
 from shapely.geometry import shape
 
 
@@ -7,10 +12,14 @@ from shapely.geometry import shape
 # Normalização
 # --------------------------------------------------
 
+# casas decimais de floats e coordenadas (mesma política em diff e hash)
+FLOAT_DECIMALS = 6
+
+
 def normalize_value(v: Any) -> Any:
     """Evita falsos positivos por tipo."""
     if isinstance(v, float):
-        return round(v, 6)
+        return round(v, FLOAT_DECIMALS)
     return v
 
 
@@ -22,6 +31,130 @@ def normalize_properties(props: Dict[str, Any], ignore_fields: List[str]) -> Dic
     }
 
 
+# --------------------------------------------------
+# Hash canônico
+# --------------------------------------------------
+
+_QUANT = 10 ** FLOAT_DECIMALS
+
+# profundidade do array "coordinates" até chegar numa lista de posições
+_COORD_DEPTH = {
+    "MultiPoint": 1,
+    "LineString": 1,
+    "Polygon": 2,
+    "MultiLineString": 2,
+    "MultiPolygon": 3,
+}
+
+
+def _canonical_value(v: Any) -> Any:
+    if type(v) is float:
+        return round(v, FLOAT_DECIMALS)
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, sort_keys=True, ensure_ascii=False)
+    return v
+
+
+def _hash_coords(coords: Any, depth: int, h, parts: Optional[List] = None) -> None:
+    if depth <= 1:
+        q = np.rint(np.asarray(coords, dtype=float) * _QUANT).astype(np.int64)
+        h.update(repr(q.shape).encode())
+        h.update(q.tobytes())
+        if parts is not None:
+            parts.append(q)
+        return
+    for part in coords:
+        _hash_coords(part, depth - 1, h, parts)
+    h.update(b")")
+
+
+def canonical_hash(
+    props: Optional[Dict[str, Any]],
+    geometry: Optional[Dict[str, Any]],
+    ignore_fields: Iterable[str] = (),
+) -> str:
+    """
+    BLAKE2b-128 da feature sem passar por json.dumps(sort_keys=True).
+
+    Propriedades entram como repr() dos pares ordenados (floats já
+    arredondados); coordenadas são quantizadas em 10^-FLOAT_DECIMALS e
+    entram como inteiros de 64 bits, então ruído abaixo disso não muda
+    o hash.
+    """
+
+    ignore = set(ignore_fields)
+
+    pairs = sorted([
+        (k, _canonical_value(v))
+        for k, v in (props or {}).items()
+        if k not in ignore
+    ])
+
+    h = hashlib.blake2b(repr(pairs).encode(), digest_size=16)
+
+    if geometry:
+        gtype = geometry.get("type")
+        coords = geometry.get("coordinates")
+        h.update(f"|{gtype}|".encode())
+
+        try:
+            if gtype == "Point":
+                h.update(repr([round(c * _QUANT) for c in coords]).encode())
+            elif gtype in _COORD_DEPTH:
+                _hash_coords(coords, _COORD_DEPTH[gtype], h)
+            else:
+                raise ValueError(gtype)
+        except (TypeError, ValueError):
+            # GeometryCollection ou coordenadas irregulares
+            h.update(json.dumps(geometry, sort_keys=True).encode())
+
+    return h.hexdigest()
+
+
+# --------------------------------------------------
+# Impressão digital da geometria
+# --------------------------------------------------
+
+def geometry_fingerprint(geometry: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+    """
+    [digest, nº de vértices, bbox] da geometria, sem shapely.
+
+    Coordenadas quantizadas como em canonical_hash: mesmo digest = mesma
+    geometria. bbox = [minx, miny, maxx, maxy] em inteiros quantizados;
+    bbox diferente = geometria certamente diferente. Lista simples para
+    ir direto para o .geo da camada. None sem geometria.
+    """
+
+    if not geometry:
+        return None
+
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates")
+    h = hashlib.blake2b(f"{gtype}|".encode(), digest_size=16)
+    parts: List[np.ndarray] = []
+
+    try:
+        if gtype == "Point":
+            _hash_coords([coords], 1, h, parts)
+        elif gtype in _COORD_DEPTH:
+            _hash_coords(coords, _COORD_DEPTH[gtype], h, parts)
+        else:
+            raise ValueError(gtype)
+    except (TypeError, ValueError):
+        h.update(json.dumps(geometry, sort_keys=True).encode())
+        return [h.hexdigest(), None, None]
+
+    parts = [q[:, :2] for q in parts if q.ndim == 2 and len(q) and q.shape[1] >= 2]
+
+    if not parts:
+        return [h.hexdigest(), 0, None]
+
+    xy = np.concatenate(parts) if len(parts) > 1 else parts[0]
+    bbox = [int(v) for v in (*xy.min(axis=0), *xy.max(axis=0))]
+
+    return [h.hexdigest(), len(xy), bbox]
+
+
 # --------------------------------------------------
 # Comparação de atributos
 # --------------------------------------------------
@@ -57,6 +190,33 @@ def diff_properties(
 # Comparação geométrica REAL
 # --------------------------------------------------
 
+# Geometria "bruta": dict GeoJSON, texto GeoJSON ou WKB (bytes). Features
+# em Registro compacto (registros.py) entregam a forma guardada, e só os
+# pares que chegam ao shapely são decodificados.
+
+def _geometria(feat: Any) -> Any:
+    if hasattr(feat, "geometria_bruta"):
+        return feat.geometria_bruta
+    return feat.get("geometry")
+
+
+def _geometria_dict(g: Any) -> Optional[Dict]:
+    if isinstance(g, bytes):
+        return json.loads(shapely.to_geojson(shapely.from_wkb(g)))
+    if isinstance(g, str):
+        return json.loads(g)
+    return g
+
+
+def _para_shapely(geoms: List[Any]) -> np.ndarray:
+    if all(isinstance(g, bytes) for g in geoms):
+        return shapely.from_wkb(geoms)
+    return shapely.from_geojson([
+        g if isinstance(g, str) else json.dumps(_geometria_dict(g))
+        for g in geoms
+    ])
+
+
 def geometry_diff(old_geom: Optional[Dict], new_geom: Optional[Dict]) -> Optional[Dict]:
     """
     Detecta mudança geométrica real.
@@ -81,13 +241,22 @@ def geometry_diff(old_geom: Optional[Dict], new_geom: Optional[Dict]) -> Optiona
 
         distance = g1.hausdorff_distance(g2)
 
-        return {
+        result = {
             "changed": True,
             "hausdorff_distance": round(distance, 3),
             "geom_type_old": g1.geom_type,
             "geom_type_new": g2.geom_type,
         }
 
+        # mesmos campos do caminho em lote (nº de vértices da impressão)
+        vertices_old = geometry_fingerprint(old_geom)[1]
+        vertices_new = geometry_fingerprint(new_geom)[1]
+        if vertices_old != vertices_new:
+            result["vertices_old"] = vertices_old
+            result["vertices_new"] = vertices_new
+
+        return result
+
     except Exception as e:
         return {
             "changed": True,
@@ -95,6 +264,104 @@ def geometry_diff(old_geom: Optional[Dict], new_geom: Optional[Dict]) -> Optiona
         }
 
 
+def geometry_diff_batch(
+    old_geoms: List[Optional[Dict]],
+    new_geoms: List[Optional[Dict]],
+    old_fps: Optional[List[Optional[List[Any]]]] = None,
+    new_fps: Optional[List[Optional[List[Any]]]] = None,
+    tolerance: float = 0.0,
+) -> List[Optional[Dict]]:
+    """
+    Versão em lote de geometry_diff (mesmos dicts por par). Aceita
+    também a geometria bruta (texto GeoJSON ou WKB).
+
+    Filtros antes do shapely, pela geometry_fingerprint de cada lado
+    (old_fps/new_fps: as guardadas no .geo da camada; None = calcular):
+      1. mesmo digest -> inalterada, sem shapely;
+      2. bbox diferente -> certamente alterada, sem equals().
+    Só os pares restantes passam por shapely.equals vetorizado, e só os
+    realmente diferentes pagam hausdorff_distance.
+
+    tolerance > 0: a distância é medida entre as geometrias simplificadas
+    (shapely.simplify(tolerance)); pares até a tolerância contam como
+    inalterados (republicação com ruído), e a distância informada é a
+    aproximada.
+    """
+
+    results: List[Optional[Dict]] = [None] * len(old_geoms)
+    pending = []
+    fps = []
+
+    for i, (old_geom, new_geom) in enumerate(zip(old_geoms, new_geoms)):
+
+        if not old_geom and not new_geom:
+            continue
+
+        if not old_geom or not new_geom:
+            results[i] = {
+                "changed": True,
+                "reason": "geometry_added_or_removed"
+            }
+            continue
+
+        fp_old = (old_fps[i] if old_fps else None) or geometry_fingerprint(_geometria_dict(old_geom))
+        fp_new = (new_fps[i] if new_fps else None) or geometry_fingerprint(_geometria_dict(new_geom))
+
+        if fp_old[0] == fp_new[0]:
+            continue
+
+        pending.append(i)
+        fps.append((fp_old, fp_new))
+
+    if not pending:
+        return results
+
+    try:
+        g1 = _para_shapely([old_geoms[i] for i in pending])
+        g2 = _para_shapely([new_geoms[i] for i in pending])
+    except Exception:
+        # lote com geometria inválida: cai para o caminho par a par
+        for i in pending:
+            results[i] = geometry_diff(_geometria_dict(old_geoms[i]), _geometria_dict(new_geoms[i]))
+        return results
+
+    # bbox ausente (geometria irregular/vazia): fica para o equals()
+    same_bbox = np.array([
+        a[2] is None or b[2] is None or a[2] == b[2] for a, b in fps
+    ])
+
+    equal = np.zeros(len(pending), dtype=bool)
+    if same_bbox.any():
+        equal[same_bbox] = shapely.equals(g1[same_bbox], g2[same_bbox])
+
+    changed = ~equal
+    distances = np.full(len(pending), np.nan)
+    if changed.any():
+        if tolerance > 0:
+            distances[changed] = shapely.hausdorff_distance(
+                shapely.simplify(g1[changed], tolerance),
+                shapely.simplify(g2[changed], tolerance),
+            )
+            changed &= ~(distances <= tolerance)
+        else:
+            distances[changed] = shapely.hausdorff_distance(g1[changed], g2[changed])
+
+    for j, i in enumerate(pending):
+        if not changed[j]:
+            continue
+        results[i] = {
+            "changed": True,
+            "hausdorff_distance": round(float(distances[j]), 3),
+            "geom_type_old": g1[j].geom_type,
+            "geom_type_new": g2[j].geom_type,
+        }
+        if fps[j][0][1] != fps[j][1][1]:
+            results[i]["vertices_old"] = fps[j][0][1]
+            results[i]["vertices_new"] = fps[j][1][1]
+
+    return results
+
+
 # --------------------------------------------------
 # Auditoria completa de feature
 # --------------------------------------------------
@@ -122,28 +389,157 @@ def audit_feature(
     }
 
 
+def audit_features_batch(
+    pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ignore_fields: List[str],
+    fingerprints: Optional[List[Tuple[Optional[List], Optional[List]]]] = None,
+    tolerance: float = 0.0,
+) -> List[Dict[str, Any]]:
+    """
+    audit_feature para vários pares, com a geometria em lote.
+    fingerprints: (antiga, nova) por par, já conhecidas (ver
+    geometry_diff_batch).
+    """
+
+    geom_changes = geometry_diff_batch(
+        [_geometria(old) for old, _ in pairs],
+        [_geometria(new) for _, new in pairs],
+        [a for a, _ in fingerprints] if fingerprints else None,
+        [b for _, b in fingerprints] if fingerprints else None,
+        tolerance,
+    )
+
+    return [
+        {
+            "property_changes": diff_properties(
+                old.get("properties", {}),
+                new.get("properties", {}),
+                ignore_fields,
+            ),
+            "geometry_change": geom_change,
+        }
+        for (old, new), geom_change in zip(pairs, geom_changes)
+    ]
+
+
+# --------------------------------------------------
+# Diff por identidade (hash-join)
+# --------------------------------------------------
+
+def identity_key(props: Dict[str, Any], identity: List[str]) -> Tuple:
+    return tuple(normalize_value(props.get(k)) for k in identity)
+
+
+def diff_by_identity(
+    old_feats: List[Dict[str, Any]],
+    new_feats: List[Dict[str, Any]],
+    identity: Union[List[str], str, None],
+    ignore_fields: List[str],
+    old_fps: Optional[List[Optional[List[Any]]]] = None,
+    new_fps: Optional[List[Optional[List[Any]]]] = None,
+    tolerance: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Pareia features antigas e novas pela tupla de identidade (tempo linear).
+
+    Recebe só as features cujo hash mudou. Pares com a mesma identidade
+    viram "modified" (com o audit_feature do par); o resto continua
+    "added"/"removed". Pares que só diferem por ruído de normalização
+    contam como "unchanged". identity "ALL_FIELDS" (ou ausente) não
+    pareia nada: a feature inteira é a identidade.
+
+    old_fps/new_fps (alinhadas às listas) e tolerance seguem para
+    geometry_diff_batch.
+    """
+
+    if isinstance(identity, str) and identity != "ALL_FIELDS":
+        identity = [identity]
+
+    if not identity or identity == "ALL_FIELDS":
+        return {
+            "added": list(new_feats),
+            "removed": list(old_feats),
+            "modified": [],
+            "unchanged": 0,
+        }
+
+    # identidade -> posições em old_feats
+    old_by_key: Dict[Tuple, deque] = {}
+
+    for i, feat in enumerate(old_feats):
+        key = identity_key(feat.get("properties", {}), identity)
+        # sem nenhum campo de identidade preenchido não há como parear
+        if any(v is not None for v in key):
+            old_by_key.setdefault(key, deque()).append(i)
+
+    added = []
+    pairs = []
+    fps = []
+    keys = []
+
+    for j, feat in enumerate(new_feats):
+        key = identity_key(feat.get("properties", {}), identity)
+        candidates = old_by_key.get(key)
+
+        if not candidates:
+            added.append(feat)
+            continue
+
+        i = candidates.popleft()
+        pairs.append((old_feats[i], feat))
+        fps.append((old_fps[i] if old_fps else None, new_fps[j] if new_fps else None))
+        keys.append(key)
+
+    modified = []
+    unchanged = 0
+
+    audits = audit_features_batch(pairs, ignore_fields, fps, tolerance)
+
+    for key, (old, new), audit in zip(keys, pairs, audits):
+
+        if not audit["property_changes"] and not audit["geometry_change"]:
+            unchanged += 1
+            continue
+
+        modified.append({
+            "identity": key,
+            "old": old,
+            "new": new,
+            "audit": audit,
+        })
+
+    removed = [old_feats[i] for pos in old_by_key.values() for i in pos]
+    removed += [
+        f for f in old_feats
+        if all(v is None for v in identity_key(f.get("properties", {}), identity))
+    ]
+
+    return {
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+        "unchanged": unchanged,
+    }
+
+
 # --------------------------------------------------
 # Funções de log humano
 # --------------------------------------------------
 
-def format_feature_audit(fid: str, audit: Dict[str, Any]) -> List[str]:
-    lines = []
+def format_feature_audit(fid: str, audit: Dict[str, Any]) -> Iterator[str]:
+    """Linhas legíveis do audit de uma feature (log e relatório HTML), sob demanda."""
 
     if audit["property_changes"]:
-        lines.append(f"Registro {fid}")
+        yield f"Registro {fid}"
         for ch in audit["property_changes"]:
-            lines.append(
-                f"  {ch['field']}: {ch['old']} → {ch['new']}"
-            )
+            yield f"  {ch['field']}: {ch['old']} → {ch['new']}"
 
     if audit["geometry_change"]:
         g = audit["geometry_change"]
-        lines.append(f"Registro {fid} (GEOMETRIA ALTERADA)")
+        yield f"Registro {fid} (GEOMETRIA ALTERADA)"
         if "hausdorff_distance" in g:
-            lines.append(
-                f"  deslocamento máximo ≈ {g['hausdorff_distance']} m"
-            )
+            yield f"  deslocamento máximo ≈ {g['hausdorff_distance']} m"
+        if "vertices_old" in g:
+            yield f"  vértices: {g['vertices_old']} → {g['vertices_new']}"
         if "reason" in g:
-            lines.append(f"  motivo: {g['reason']}")
-
-    return lines
+            yield f"  motivo: {g['reason']}"
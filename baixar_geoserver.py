@@ -3,26 +3,190 @@
 # ============================================================
 
 import requests
+import html
 import json
-import hashlib
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime
+
+from audit_utils import (
+    canonical_hash,
+    diff_by_identity,
+    format_feature_audit,
+)
+from geojson_stream import (
+    CHUNK_SIZE,
+    SnapshotWriter,
+    concat_snapshots,
+    iter_features,
+    read_feature_at,
+    read_snapshot,
+)
+from agregador import Agregador
+from catalogo import Catalogo, descrever
+from diff_disco import (
+    OrdenadorExterno,
+    OrdenadorLinhas,
+    Particoes,
+    agrupar,
+    empacotar,
+    gravar_linhas,
+    gravar_registros,
+    hash_repetido,
+    hashes_por_loc,
+    impressoes_de,
+    juntar,
+    juntar_impressoes,
+    juntar_indices,
+    ler_impressoes,
+    ler_linhas,
+    loc_de,
+    ler_por_loc,
+    ler_registros,
+    linha_impressao,
+    n_particoes,
+    ordenar,
+    por_loc,
+    remapear,
+)
+from hash_paralelo import LOTE, HashEmLotes, impressao, indexar_paralelo
+from registros import Registros
+from historico import Historico
+from metricas import Metricas
+from notificacao import CaixaSaida, montar_cards
+from relatorio import Relatorio
+from snapshot_store import criar_store
 
 BASE_URL = "https://geoserver.semob.df.gov.br/geoserver/semob/ows"
 
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+CONFIG_PATH = Path(__file__).with_name("config.json")
+CONFIG = (
+    json.load(open(CONFIG_PATH, encoding="utf-8"))
+    if CONFIG_PATH.exists() else {}
+)
+
+# geojson: uma feature por linha | colunar: .colz comprimido (snapshot_store)
+STORE = criar_store(CONFIG.get("snapshot_format", "geojson"), DOWNLOAD_DIR)
+
+# base completa a cada base_every_days + deltas diários (historico.py)
+HISTORY = {"enabled": True, "base_every_days": 7, **CONFIG.get("history", {})}
+
+HISTORICO = (
+    Historico(DOWNLOAD_DIR/"historico", HISTORY["base_every_days"])
+    if HISTORY["enabled"] else None
+)
+
+# tempo/bytes/features por etapa -> downloads/metricas (metricas.py)
+METRICS = {
+    "enabled": True,
+    "prometheus_textfile": None,
+    "profile_layers": [],
+    "profile": "cprofile",
+    **CONFIG.get("metrics", {})
+}
+
+METRICAS = Metricas(
+    DOWNLOAD_DIR/"metricas",
+    METRICS["prometheus_textfile"],
+    METRICS["profile_layers"],
+    METRICS["profile"],
+)
+
 # ============================================================
-# HUMAN SUMMARY (estrutura única)
+# CONCORRÊNCIA
 # ============================================================
 
-HUMAN_SUMMARY = {
-    "frota": {},
-    "horarios": {},
-    "itinerario": {},
-    "generic": {}
-}
+# max_workers: camadas processadas ao mesmo tempo (1 = sequencial)
+# max_per_host: downloads simultâneos contra o mesmo servidor
+CONCURRENCY = {"max_workers": 4, "max_per_host": 2, **CONFIG.get("concurrency", {})}
+
+# hash em processos (hash_paralelo) para camadas com min_features ou
+# mais: no download (gravar_spool) e no build_index; workers 0 = um por CPU
+PARALLEL_HASH = {"min_features": 200_000, "workers": 0, **CONFIG.get("parallel_hash", {})}
+
+# diff em disco (diff_disco) para camadas com min_features ou mais
+# (0 = nunca); memory_mb = orçamento de índices, ordenação e pareamento
+OUT_OF_CORE = {"min_features": 1_000_000, "memory_mb": 256, **CONFIG.get("out_of_core", {})}
+
+
+# impressão digital (audit_utils.geometry_fingerprint) guardada ao lado
+# do snapshot (geometrias_path) para geometrias com min_vertices ou mais
+# (0 = desligado)
+GEOMETRY_FP = {"min_vertices": 64, **CONFIG.get("geometry_fingerprint", {})}
+
+
+def em_disco(total):
+    return bool(OUT_OF_CORE["min_features"]) and total is not None and total >= OUT_OF_CORE["min_features"]
+
+
+def workers_hash():
+    return PARALLEL_HASH["workers"] or os.cpu_count() or 1
+
+
+def hash_em_processos(total):
+    return workers_hash() > 1 and total is not None and total >= PARALLEL_HASH["min_features"]
+
+
+_POOL_HASH = None
+_POOL_HASH_LOCK = threading.Lock()
+
+
+def pool_hash():
+    """Pool de processos do hash no download: criado no primeiro uso, compartilhado pelos spools."""
+
+    global _POOL_HASH
+
+    with _POOL_HASH_LOCK:
+        if _POOL_HASH is None:
+            _POOL_HASH = ProcessPoolExecutor(max_workers=workers_hash())
+        return _POOL_HASH
+
+
+def encerrar_pool_hash():
+    """Encerra o pool (fim da execução ou pool quebrado; o próximo uso cria outro)."""
+
+    global _POOL_HASH
+
+    with _POOL_HASH_LOCK:
+        pool, _POOL_HASH = _POOL_HASH, None
+
+    if pool is not None:
+        pool.shutdown()
+
+
+def orcamento_bytes(partes=1):
+    return OUT_OF_CORE["memory_mb"] * 2**20 // max(1, partes)
+
+_HOST_SLOTS = {}
+_HOST_SLOTS_LOCK = threading.Lock()
+
+
+@contextmanager
+def slot_host(url):
+    """Limita downloads simultâneos por host (semáforo por netloc)."""
+
+    host = urlsplit(url).netloc
+
+    with _HOST_SLOTS_LOCK:
+        sem = _HOST_SLOTS.setdefault(
+            host, threading.BoundedSemaphore(CONCURRENCY["max_per_host"])
+        )
+
+    with sem:
+        yield
 
 # ============================================================
 # TEAMS WEBHOOK
@@ -30,42 +194,63 @@ HUMAN_SUMMARY = {
 
 TEAMS_WEBHOOK = "https://urbimobilidade.webhook.office.com/webhookb2/cb40e1b8-96c0-43da-b152-c6b3d14e17b1@dc1693df-d65a-491e-bced-e17803feaf5e/IncomingWebhook/ce4abed999cc4e0caea27b24af384458/d258e1f9-33a4-4a37-8492-3fa227388e4e/V2tUfmwhLr7y9YxuLLcyHWGbbE5h1xQAT-cl0pCz2j9-U1"
 
+# caixa de saída em disco + entrega em segundo plano (notificacao.py);
+# max_card_bytes: acima disso o resumo vira vários cards; flush_seconds:
+# quanto o fim da execução espera a caixa esvaziar
+NOTIFICATIONS = {
+    "timeout": 30,
+    "retries": 20,
+    "backoff_base": 30.0,
+    "backoff_max": 3600.0,
+    "max_card_bytes": 24_000,
+    "flush_seconds": 120,
+    **CONFIG.get("notifications", {})
+}
+
 # ============================================================
 # LOG
 # ============================================================
 
+_LOG_LOCK = threading.Lock()
+
+
 def log(msg):
-    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {msg}")
+    with _LOG_LOCK:
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {msg}", flush=True)
+
+
+CAIXA_SAIDA = CaixaSaida(
+    DOWNLOAD_DIR/"notificacoes",
+    NOTIFICATIONS["timeout"],
+    NOTIFICATIONS["retries"],
+    NOTIFICATIONS["backoff_base"],
+    NOTIFICATIONS["backoff_max"],
+    log,
+    METRICAS,
+)
 
 # ============================================================
 # TEAMS
 # ============================================================
 
-def enviar_teams(resumo_humano):
+def enviar_teams(resumo_humano, agregado, eventos=()):
+    """
+    Enfileira o resumo (um ou mais cards) na caixa de saída.
+    eventos: mudanças de esquema do catálogo (no mínimo ATENCAO).
+    """
 
     agora = datetime.now().strftime("%d/%m/%Y %H:%M")
 
-    total_frota = sum(abs(v) for v in HUMAN_SUMMARY["frota"].values())
-
-    total_viagens = sum(
-        abs(v["add"]) + abs(v["rem"])
-        for op in HUMAN_SUMMARY["horarios"].values()
-        for v in op.values()
-    )
-
-    total_itinerario = sum(
-        abs(v["add"]) + abs(v["rem"])
-        for op in HUMAN_SUMMARY["itinerario"].values()
-        for v in op.values()
+    # summary.critical_at de cada camada (audit_rules)
+    critico = any(
+        agregado.resumo(layer)["critical_at"] is not None
+        and agregado.volume(layer) >= agregado.resumo(layer)["critical_at"]
+        for layer in agregado.camadas()
     )
 
-    houve_mudanca = any([
-        total_frota,
-        total_viagens,
-        total_itinerario
-    ])
+    houve_mudanca = bool(agregado) or bool(eventos)
 
-    if total_viagens >= 50 or total_frota >= 20:
+    if critico:
         nivel, cor, emoji = "CRITICO", "attention", "🔴"
     elif houve_mudanca:
         nivel, cor, emoji = "ATENCAO", "warning", "🟡"
@@ -77,134 +262,1097 @@ def enviar_teams(resumo_humano):
         "Sistema funcionando normalmente."
     )
 
-    payload = {
-        "type": "message",
-        "attachments": [{
-            "contentType": "application/vnd.microsoft.card.adaptive",
-            "content": {
-                "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
-                "type": "AdaptiveCard",
-                "version": "1.4",
-                "body": [
-                    {
-                        "type": "TextBlock",
-                        "text": f"{emoji} Auditoria GeoServer SEMOB-DF — {nivel}",
-                        "weight": "Bolder",
-                        "size": "Large",
-                        "color": cor
-                    },
-                    {
-                        "type": "TextBlock",
-                        "text": f"Execução: {agora}",
-                        "isSubtle": True
-                    },
-                    {
-                        "type": "TextBlock",
-                        "text": corpo,
-                        "wrap": True
-                    }
-                ]
-            }
-        }]
-    }
+    cards = montar_cards(
+        f"{emoji} Auditoria GeoServer SEMOB-DF — {nivel}",
+        f"Execução: {agora}",
+        corpo,
+        cor,
+        NOTIFICATIONS["max_card_bytes"],
+        RELATORIO.link(agregado.camadas()),
+    )
 
-    try:
-        r = requests.post(TEAMS_WEBHOOK, json=payload, timeout=30)
-        log(f"Teams enviado | status={r.status_code} | nível={nivel}")
-    except Exception as e:
-        log(f"Falha Teams: {e}")
+    # não bloqueia: a thread da caixa de saída entrega (e repete)
+    CAIXA_SAIDA.enfileirar(TEAMS_WEBHOOK, cards, nivel)
+    log(f"Teams: {len(cards)} card(s) na caixa de saída | nível={nivel}")
 
 # ============================================================
-# CAMADAS
+# JOBS (config.json)
 # ============================================================
 
-LAYERS = {
-    "semob:Frota por Operadora": {"ignore_fields": ["data_referencia","fid"]},
-    "semob:Horários das Linhas": {"ignore_fields": ["fid"]},
-    "semob:Itinerário Espacial das Linhas": {"ignore_fields": ["fid"]},
+# chave = nome técnico do catálogo (aplicar_catalogo); ignore_fields do
+# job entram no hash junto com os de audit_rules
+JOBS = {job["typeNames"]: job for job in CONFIG.get("jobs", [])}
+
+
+def incremental_de(layer):
+    """
+    Modo incremental do job ("incremental" no config.json), com os
+    padrões preenchidos; None = camada sempre baixada inteira.
+    column: coluna crescente (id) ou de data; type: "key" (> marca) ou
+    "date" (>= marca); full_every_days: reconciliação completa;
+    syntax: "cql" (CQL_FILTER) ou "fes" (FILTER do WFS 2.0).
+    """
+
+    inc = JOBS.get(layer, {}).get("incremental")
 
-    # -------- nomes técnicos corretos (GeoServer) --------
-    "semob:estacoes_metro": {},
-    "semob:faixas_exclusivas": {},
-    "semob:linha_metro": {},
+    if not inc:
+        return None
 
-    "semob:Paradas de onibus": {"ignore_fields": ["fid"]},
-    "semob:Ponto de paradas 2025": {"ignore_fields": ["fid"]},
+    return {"type": "key", "full_every_days": 7, "syntax": "cql", **inc}
+
+AUDIT_RULES = CONFIG.get("audit_rules", {})
+
+# ============================================================
+# CATÁLOGO (GetCapabilities + DescribeFeatureType em cache)
+# ============================================================
 
-    "semob:terminais_onibus": {"ignore_fields": ["fid"]},
+# catalogo.py: nomes, extensões e esquemas de todas as camadas numa
+# passada, em downloads/catalogo.json; revalidado (condicional) só depois
+# de max_age_minutes
+CATALOG = {"max_age_minutes": 60, **CONFIG.get("catalog", {})}
 
-    "semob:Viagens Programadas por Linha": {"ignore_fields": ["fid"]},
+CATALOGO = Catalogo(DOWNLOAD_DIR/"catalogo.json", log, CATALOG["max_age_minutes"])
+
+
+_CATALOGO_LOCK = threading.Lock()
+
+
+def aplicar_catalogo():
+    """
+    Troca as chaves de JOBS e AUDIT_RULES pelo nome técnico resolvido no
+    catálogo ("semob:Terminais de ônibus" -> "semob:terminais_onibus"),
+    na ordem do config.json. Os dicts renomeados são montados à parte e
+    trocados de uma vez, nunca alterados no lugar: camada em execução
+    noutra thread (agendador) lê o dict antigo ou o novo, sempre
+    completo. Sem nome novo no catálogo nada é trocado. RELATORIO passa
+    a usar o dict novo; Agregadores já criados ficam com o antigo.
+    """
+
+    global JOBS, AUDIT_RULES
+
+    with _CATALOGO_LOCK:
+        jobs, regras = (
+            {CATALOGO.resolver(nome) or nome: valor for nome, valor in d.items()}
+            for d in (JOBS, AUDIT_RULES)
+        )
 
-    # ignorado
-    "semob:Última posição da frota": {"ignore": True}
+        if list(jobs) == list(JOBS) and list(regras) == list(AUDIT_RULES):
+            return
+
+        JOBS, AUDIT_RULES = jobs, regras
+
+        if RELATORIO is not None:
+            RELATORIO.regras = AUDIT_RULES
+
+# relatório por feature de cada execução (relatorio.py); base_url: onde
+# downloads/relatorios é publicado (link no card do Teams)
+REPORTS = {
+    "enabled": True,
+    "formats": ["jsonl", "csv", "html"],
+    "page_size": 500,
+    "keep_days": 30,
+    "base_url": None,
+    **CONFIG.get("reports", {})
+}
+
+# criado em inicializar(): o Relatorio apaga as pastas além de keep_days
+RELATORIO = None
+
+
+def inicializar():
+    """
+    O que não roda no import: nomes técnicos do catálogo em cache
+    (aplicar_catalogo, sem rede) e o relatório. main() e o agendador
+    chamam antes da primeira camada; chamadas seguintes não refazem o
+    relatório.
+    """
+
+    global RELATORIO
+
+    aplicar_catalogo()
+
+    if RELATORIO is None:
+        RELATORIO = Relatorio(
+            DOWNLOAD_DIR/"relatorios",
+            AUDIT_RULES,
+            REPORTS["formats"] if REPORTS["enabled"] else (),
+            REPORTS["page_size"],
+            REPORTS["base_url"],
+            REPORTS["keep_days"],
+        )
+
+PAGE_SIZE = CONFIG.get("page_size", 0)
+
+# paging "tiles": extensão do GetCapabilities dividida em grid x grid
+# caixas (BBOX); caixa com mais de max_features é dividida em 4, até
+# max_depth níveis. crs: como o BBOX é enviado (lon/lat no GeoServer)
+TILES = {
+    "grid": 4,
+    "max_features": 5000,
+    "max_depth": 6,
+    "crs": "EPSG:4326",
+    **CONFIG.get("tiles", {})
 }
 
 # ============================================================
-# DOWNLOAD
+# HTTP (sessão compartilhada + retry)
 # ============================================================
 
-def request_layer(layer):
+# retries: tentativas extras em falha transitória (rede, 429, 5xx)
+# backoff_base/backoff_max: espera exponencial em segundos, com jitter
+HTTP = {"retries": 3, "backoff_base": 1.0, "backoff_max": 30.0, **CONFIG.get("http", {})}
+
+STATUS_TRANSITORIOS = {429, 500, 502, 503, 504}
+
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_maxsize=max(CONCURRENCY["max_workers"], CONCURRENCY["max_per_host"])))
+SESSION.mount("http://", HTTPAdapter(pool_maxsize=max(CONCURRENCY["max_workers"], CONCURRENCY["max_per_host"])))
+
+
+class ErroTransitorio(requests.RequestException):
+    """Resposta 429/5xx: vale tentar de novo."""
+
+
+def backoff(tentativa):
+    """Exponencial com 'full jitter': uniforme em [0, min(max, base*2^n)]."""
+    teto = min(HTTP["backoff_max"], HTTP["backoff_base"] * 2 ** (tentativa - 1))
+    return random.uniform(0, teto)
+
+
+def com_retry(descricao, tentativa_fn):
+    """
+    Executa tentativa_fn() repetindo falhas transitórias com backoff.
+    O slot por host é pego dentro de cada tentativa, nunca durante a espera.
+    Corpo truncado (ValueError do parser) também é repetido.
+    """
+
+    for tentativa in range(1, HTTP["retries"] + 2):
+
+        try:
+            return tentativa_fn()
+
+        except (requests.RequestException, ValueError) as e:
+
+            if tentativa > HTTP["retries"]:
+                raise
+
+            espera = backoff(tentativa)
+            log(f"{descricao}: {e} — tentativa {tentativa}/{HTTP['retries']}, nova em {espera:.1f}s")
+            time.sleep(espera)
+
+# ============================================================
+# SORTBY DESCOBERTO (persistido)
+# ============================================================
 
-    base_params = dict(
+SORTBY_PATH = DOWNLOAD_DIR/"sortby.json"
+
+_SORTBY_LOCK = threading.Lock()
+
+
+def sortby_conhecido(layer):
+    """
+    Chave de ordenação estável da camada, nesta ordem: sortBy do job,
+    id_col do job, campos de identity (audit_rules) e, sem nenhum deles,
+    o campo descoberto numa execução anterior (descobrir_sortby).
+    """
+
+    job = JOBS.get(layer, {})
+
+    if job.get("sortBy"):
+        return job["sortBy"]
+
+    if job.get("id_col"):
+        return f"{job['id_col']} A"
+
+    identidade = AUDIT_RULES.get(layer, {}).get("identity")
+
+    if isinstance(identidade, str) and identidade != "ALL_FIELDS":
+        identidade = [identidade]
+
+    if identidade and identidade != "ALL_FIELDS":
+        return ",".join(f"{campo} A" for campo in identidade)
+
+    with _SORTBY_LOCK:
+        if SORTBY_PATH.exists():
+            return json.load(open(SORTBY_PATH, encoding="utf-8")).get(layer)
+
+    return None
+
+
+def salvar_sortby(layer, sort_by):
+
+    with _SORTBY_LOCK:
+        dados = json.load(open(SORTBY_PATH, encoding="utf-8")) if SORTBY_PATH.exists() else {}
+        dados[layer] = sort_by
+        tmp = SORTBY_PATH.with_suffix(".tmp")
+        json.dump(dados, open(tmp, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+        os.replace(tmp, SORTBY_PATH)
+
+# ============================================================
+# DOWNLOAD
+# ============================================================
+
+def _wfs_params(layer, **extra):
+    return dict(
         service="WFS",
         version="2.0.0",
-        request="GetFeature",
         typeNames=layer,
-        outputFormat="application/json"
+        **extra
+    )
+
+
+def _get(params, timeout, headers=None):
+
+    def tentativa():
+        with slot_host(BASE_URL):
+            r = SESSION.get(BASE_URL, params=params, timeout=timeout, headers=headers)
+        if r.status_code in STATUS_TRANSITORIOS:
+            raise ErroTransitorio(f"{r.status_code} Server Error")
+        return r
+
+    return com_retry(params.get("typeNames", "WFS"), tentativa)
+
+
+def snapshot_path(layer, sufixo=""):
+    return DOWNLOAD_DIR/f"{layer.replace(':','__')}.geojson{sufixo}"
+
+
+def ignore_fields_de(layer):
+    """ignore_fields do job somados aos de audit_rules (config.json)."""
+
+    campos = list(JOBS.get(layer,{}).get("ignore_fields",[]))
+    campos += AUDIT_RULES.get(layer,{}).get("ignore_fields",[])
+
+    return sorted(set(campos))
+
+
+def gravar_spool(layer, features, destino, disco=False, anteriores=(), paralelo=False):
+    """
+    Normaliza, calcula o hash e grava cada feature à medida que chega.
+    paralelo=True: o hash sai do pool de processos (hash_paralelo), em
+    lotes das features já serializadas, com o mesmo resultado.
+    Retorna {"arquivo", "indice" (hash -> offsets), "total", "digest",
+    "geometrias" (hash -> impressão digital das geometrias grandes)}.
+    disco=True: em vez de "indice", "indice_arquivo" com os registros
+    (hash, offset) ordenados em disco (diff_disco) e, em vez de
+    "geometrias", "geometrias_arquivo" (.geo ordenado por hash).
+    anteriores: (hash, feature, impressão) das features mantidas do
+    snapshot na busca incremental, gravadas depois das baixadas sem
+    recalcular o hash. Job incremental: "marca" = maior valor da coluna
+    entre as features baixadas.
+    """
+
+    ignore_fields = ignore_fields_de(layer)
+    coluna = (incremental_de(layer) or {}).get("column")
+    indice = {}
+    geometrias = {}
+    digest = 0
+    marca = None
+    t_gravacao = t_hash = 0.0
+
+    # páginas baixam em paralelo: cada spool fica com uma parte do
+    # orçamento, dividida entre índice e impressões
+    if disco:
+        orcamento = orcamento_bytes(CONCURRENCY["max_per_host"]) // 2
+        ordenador = OrdenadorExterno(destino.parent, orcamento)
+        impressoes = OrdenadorLinhas(destino.parent, orcamento)
+
+    def indexar(h, offset):
+        if disco:
+            ordenador.adicionar(empacotar(h, offset))
+        else:
+            indice.setdefault(h, []).append(offset)
+
+    def guardar(h, fp):
+        if disco:
+            impressoes.adicionar(linha_impressao(h, fp))
+        elif h not in geometrias:
+            geometrias[h] = fp
+
+    lotes = HashEmLotes(pool_hash(), workers_hash(), ignore_fields, GEOMETRY_FP["min_vertices"]) if paralelo else None
+    lote, offsets = [], []
+
+    def consumir(prontos):
+        # lotes voltam na ordem de envio: mesmo índice do loop serial
+        nonlocal digest
+        for offs, resultados in prontos:
+            for offset, (h, fp) in zip(offs, resultados):
+                if fp:
+                    guardar(h, fp)
+                indexar(h, offset)
+                digest = somar_digest(digest, h)
+
+    try:
+        with SnapshotWriter(destino) as w:
+            for feat in features:
+                t0 = time.perf_counter()
+                if lotes:
+                    # o JSON gravado é o que vai para os processos
+                    dados = json.dumps(feat, ensure_ascii=False).encode("utf-8")
+                    offset = w.write_raw(dados)
+                    t1 = time.perf_counter()
+                    lote.append(dados)
+                    offsets.append(offset)
+                    if len(lote) >= LOTE:
+                        consumir(lotes.enviar(lote, offsets))
+                        lote, offsets = [], []
+                else:
+                    offset = w.write(feat)
+                    t1 = time.perf_counter()
+                    h = feature_hash(feat, ignore_fields)
+                    if h not in geometrias:
+                        fp = impressao_geometria(feat)
+                        if fp:
+                            guardar(h, fp)
+                    indexar(h, offset)
+                    digest = somar_digest(digest, h)
+                t_hash += time.perf_counter() - t1
+                t_gravacao += t1 - t0
+                if coluna:
+                    marca = maior(marca, (feat.get("properties") or {}).get(coluna))
+
+            if lotes:
+                t1 = time.perf_counter()
+                if lote:
+                    consumir(lotes.enviar(lote, offsets))
+                consumir(lotes.finalizar())
+                t_hash += time.perf_counter() - t1
+
+            for h, feat, fp in anteriores:
+                t0 = time.perf_counter()
+                offset = w.write(feat)
+                t_gravacao += time.perf_counter() - t0
+                if fp:
+                    guardar(h, fp)
+                indexar(h, offset)
+                digest = somar_digest(digest, h)
+    except BaseException:
+        if disco:
+            ordenador.descartar()
+            impressoes.descartar()
+        raise
+
+    finally:
+        if lotes and lotes.falhou:
+            encerrar_pool_hash()
+
+    METRICAS.somar(layer, "hash", t_hash, features=w.total)
+    METRICAS.somar(layer, "gravacao", t_gravacao, bytes=destino.stat().st_size)
+
+    spool = {
+        "arquivo": destino,
+        "total": w.total,
+        "digest": formatar_digest(digest),
+        "validadores": {}
+    }
+
+    if coluna:
+        spool["marca"] = marca
+
+    if disco:
+        with METRICAS.etapa(layer, "ordenar_indice") as m:
+            spool["indice_arquivo"] = Path(f"{destino}.idx")
+            m["features"] = ordenador.finalizar(spool["indice_arquivo"])
+            spool["geometrias_arquivo"] = Path(f"{destino}.geo")
+            impressoes.finalizar(spool["geometrias_arquivo"])
+    else:
+        spool["indice"] = indice
+        spool["geometrias"] = geometrias
+
+    return spool
+
+
+def maior(a, b):
+    """Maior valor ignorando None; tipos que não se comparam mantêm a."""
+
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    try:
+        return b if b > a else a
+    except TypeError:
+        return a
+
+
+def _medir_iter(iteravel, medida):
+    """Repassa os itens somando em medida o tempo gasto em next(), itens e bytes."""
+
+    it = iter(iteravel)
+
+    while True:
+        t = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            medida["segundos"] += time.perf_counter() - t
+        medida["itens"] += 1
+        if isinstance(item, bytes):
+            medida["bytes"] += len(item)
+        yield item
+
+
+def _get_spool(layer, params, destino, timeout=120, headers=None, disco=False, anteriores=None, paralelo=False):
+    """
+    GetFeature em streaming direto para o spool.
+    Retorna (status, spool); spool é None quando status != 200.
+    Falhas transitórias e corpo truncado refazem só esta requisição.
+    anteriores: função que devolve as features mantidas do snapshot
+    (gravar_spool), chamada de novo a cada tentativa. paralelo: hash
+    em processos (hash_em_processos).
+    """
+
+    def tentativa():
+
+        with slot_host(BASE_URL):
+
+            r = SESSION.get(
+                BASE_URL, params=params, timeout=timeout, stream=True, headers=headers
+            )
+
+            try:
+                if r.status_code in STATUS_TRANSITORIOS:
+                    raise ErroTransitorio(f"{r.status_code} Server Error")
+
+                if r.status_code != 200:
+                    return r.status_code, None
+
+                # rede = espera pelos blocos; parse = iter_features sem a rede
+                rede = {"segundos": 0.0, "itens": 0, "bytes": 0}
+                leitura = {"segundos": 0.0, "itens": 0, "bytes": 0}
+
+                try:
+                    chunks = _medir_iter(r.iter_content(CHUNK_SIZE), rede)
+                    features = _medir_iter(iter_features(chunks), leitura)
+
+                    spool = gravar_spool(
+                        layer, features, destino, disco, anteriores() if anteriores else (), paralelo
+                    )
+
+                finally:
+                    METRICAS.somar(layer, "rede", rede["segundos"], bytes=rede["bytes"])
+                    METRICAS.somar(
+                        layer, "parse", leitura["segundos"] - rede["segundos"],
+                        features=leitura["itens"]
+                    )
+
+                spool["validadores"] = {
+                    k: r.headers[k] for k in ("ETag", "Last-Modified") if r.headers.get(k)
+                }
+
+                return 200, spool
+
+            finally:
+                r.close()
+
+    return com_retry(layer, tentativa)
+
+
+def descobrir_sortby(layer):
+    """
+    Primeiro campo simples do DescribeFeatureType, no formato do sortBy.
+    Vem do catálogo; DescribeFeatureType próprio só se a camada não tem
+    esquema lá.
+    """
+
+    if CATALOGO.sortby(layer):
+        return CATALOGO.sortby(layer)
+
+    desc = _get(_wfs_params(layer, request="DescribeFeatureType"), 60)
+
+    text = desc.text
+
+    # tenta achar primeiro campo simples
+    # (o GeoServer põe nillable/minOccurs entre name e type)
+    campos = re.findall(r'<(?:\w+:)?element\b[^>]*?\bname="([^"]+)"[^>]*?\btype="([^"]+)"', text)
+
+    # ignora geometria
+    candidatos = [
+        c for c, tipo in campos
+        if c.lower() not in ["geom", "geometry", "the_geom"]
+        and not tipo.startswith("gml:")
+    ]
+
+    if not candidatos:
+        raise RuntimeError("nenhum campo elegível para sortBy")
+
+    return f"{candidatos[0]} A"
+
+
+def contar_features(layer, **extra):
+    """
+    resultType=hits -> numberMatched (extra: filtro, ex.: BBOX).
+    Retorna None se o servidor não informar a contagem.
+    """
+
+    try:
+        with METRICAS.etapa(layer, "contagem"):
+            r = _get(_wfs_params(layer, request="GetFeature", resultType="hits", **extra), 60)
+    except requests.RequestException:
+        return None
+
+    if r.status_code != 200:
+        return None
+
+    m = re.search(r'numberMatched="(\d+)"', r.text)
+
+    return int(m.group(1)) if m else None
+
+
+def baixar_pagina(layer, params, inicio, disco=False, paralelo=False):
+    """Uma página do GetFeature; falha transitória repete só esta página."""
+
+    destino = snapshot_path(layer, f".p{inicio}.tmp")
+
+    try:
+        status, spool = _get_spool(
+            layer, {**params, "startIndex": inicio}, destino, disco=disco, paralelo=paralelo
+        )
+    except (requests.RequestException, ValueError) as e:
+        raise RuntimeError(f"página {inicio}: {e}")
+
+    if status != 200:
+        raise RuntimeError(f"página {inicio}: {status} Client Error")
+
+    return spool
+
+
+def verificar_paginas(paginas, sort_by, disco):
+    """
+    startIndex/count só é confiável se nenhuma feature pode cair em duas
+    páginas. RuntimeError quando a chave de ordenação empata na divisa
+    de duas páginas (o servidor pode repetir uma feature do empate e
+    pular outra, com a mesma soma) ou quando o mesmo hash vem em mais de
+    uma página.
+    """
+
+    campos = [c.split()[0] for c in sort_by.split(",")]
+
+    def chave(feat):
+        props = feat.get("properties") or {}
+        return tuple(props.get(c) for c in campos)
+
+    anterior = None
+
+    for i, pagina in enumerate(paginas):
+        if not pagina["total"]:
+            continue
+        if disco:
+            locs = [loc_de(r) for r in ler_registros(pagina["indice_arquivo"])]
+        else:
+            locs = [o for offsets in pagina["indice"].values() for o in offsets]
+        extremos = ler_spool_em(pagina["arquivo"], [min(locs), max(locs)])
+        if anterior is not None and chave(extremos[min(locs)]) == anterior:
+            raise RuntimeError(f"sortBy {sort_by} empata na divisa da página {i}")
+        anterior = chave(extremos[max(locs)])
+
+    if disco:
+        fontes = [(h for h, _ in agrupar(ler_registros(p["indice_arquivo"]))) for p in paginas]
+    else:
+        fontes = [sorted(p["indice"]) for p in paginas]
+
+    if hash_repetido(fontes):
+        raise RuntimeError("a mesma feature veio em mais de uma página")
+
+
+def request_paginado(layer, job, total):
+    """
+    Pagina com startIndex/count e a chave de ordenação estável do job
+    (sortby_conhecido). Páginas em paralelo, limitadas pelo slot por
+    host. Se a soma das páginas não fechar com o hits, ou se alguma
+    feature puder ter caído em duas páginas (verificar_paginas),
+    RuntimeError e quem chama faz a requisição única.
+    """
+
+    sort_by = sortby_conhecido(layer)
+
+    if not sort_by:
+        sort_by = descobrir_sortby(layer)
+        salvar_sortby(layer, sort_by)
+
+    params = _wfs_params(
+        layer,
+        request="GetFeature",
+        outputFormat="application/json",
+        count=PAGE_SIZE,
+        sortBy=sort_by
+    )
+
+    inicios = range(0, total, PAGE_SIZE)
+    disco = em_disco(total)
+
+    log(f"{layer}: {total} features em {len(inicios)} páginas (sortBy={sort_by})")
+
+    with ThreadPoolExecutor(max_workers=max(1, CONCURRENCY["max_per_host"])) as pool:
+        futuros = [
+            pool.submit(baixar_pagina, layer, params, i, disco, hash_em_processos(total))
+            for i in inicios
+        ]
+
+    paginas = []
+
+    try:
+        for futuro in futuros:
+            paginas.append(futuro.result())
+
+        verificar_paginas(paginas, sort_by, disco)
+
+        # junta as páginas em ordem, sem reparsear, deslocando os offsets
+        destino = snapshot_path(layer, ".tmp")
+        with METRICAS.etapa(layer, "concatenar") as m:
+            deslocamentos = concat_snapshots([p["arquivo"] for p in paginas], destino)
+            m["bytes"] = destino.stat().st_size
+
+        spool = {"arquivo": destino, "validadores": {}}
+
+        if disco:
+            # índices das páginas já ordenados: k-way merge com os offsets deslocados
+            spool["indice_arquivo"] = Path(f"{destino}.idx")
+            with METRICAS.etapa(layer, "ordenar_indice") as m:
+                m["features"] = juntar_indices(
+                    [(p["indice_arquivo"], d) for p, d in zip(paginas, deslocamentos)],
+                    spool["indice_arquivo"]
+                )
+                spool["geometrias_arquivo"] = Path(f"{destino}.geo")
+                juntar_impressoes(
+                    [ler_linhas(p["geometrias_arquivo"]) for p in paginas],
+                    spool["geometrias_arquivo"]
+                )
+
+    finally:
+        for i in inicios:
+            for sufixo in (".tmp", ".tmp.idx", ".tmp.geo"):
+                snapshot_path(layer, f".p{i}{sufixo}").unlink(missing_ok=True)
+
+    baixados = sum(p["total"] for p in paginas)
+
+    # camada mudou entre as páginas: o snapshot viria com features
+    # faltando ou repetidas -> adições/remoções falsas (ordenação
+    # instável com a mesma soma: verificar_paginas)
+    if baixados != total:
+        descartar_spool(spool)
+        raise RuntimeError(f"paginação retornou {baixados} de {total} features")
+
+    digest = 0
+
+    if not disco:
+        spool["indice"] = {}
+        spool["geometrias"] = {}
+        for pagina, desloc in zip(paginas, deslocamentos):
+            for h, offsets in pagina["indice"].items():
+                spool["indice"].setdefault(h, []).extend(o + desloc for o in offsets)
+            spool["geometrias"].update(pagina["geometrias"])
+
+    for pagina in paginas:
+        digest = somar_digest(digest, pagina["digest"])
+
+    spool["total"] = baixados
+    spool["digest"] = formatar_digest(digest)
+
+    if any("marca" in p for p in paginas):
+        spool["marca"] = None
+        for pagina in paginas:
+            spool["marca"] = maior(spool["marca"], pagina["marca"])
+
+    return spool
+
+
+# ============================================================
+# DOWNLOAD EM TILES (paging "tiles")
+# ============================================================
+
+def dividir_caixa(caixa, n):
+    """n x n caixas cobrindo a caixa (bordas compartilhadas, sem frestas)."""
+
+    minx, miny, maxx, maxy = caixa
+    xs = [minx + (maxx - minx) * i / n for i in range(n)] + [maxx]
+    ys = [miny + (maxy - miny) * j / n for j in range(n)] + [maxy]
+
+    return [[xs[i], ys[j], xs[i + 1], ys[j + 1]] for j in range(n) for i in range(n)]
+
+
+def bbox_param(caixa):
+    return ",".join(map(repr, caixa)) + f",{TILES['crs']}"
+
+
+def planejar_tiles(layer, extensao):
+    """
+    Caixas a baixar: hits de cada caixa (em paralelo, nível a nível);
+    vazia sai, cheia (> max_features) vira 4, até max_depth.
+    """
+
+    pendentes = [(caixa, 0) for caixa in dividir_caixa(extensao, TILES["grid"])]
+    folhas = []
+
+    with ThreadPoolExecutor(max_workers=max(1, CONCURRENCY["max_per_host"])) as pool:
+
+        while pendentes:
+
+            contagens = pool.map(
+                lambda item: contar_features(layer, BBOX=bbox_param(item[0])), pendentes
+            )
+            proximos = []
+
+            for (caixa, nivel), n in zip(pendentes, list(contagens)):
+                if n == 0:
+                    continue
+                if n is not None and n > TILES["max_features"] and nivel < TILES["max_depth"]:
+                    proximos += [(c, nivel + 1) for c in dividir_caixa(caixa, 2)]
+                else:
+                    folhas.append(caixa)
+
+            pendentes = proximos
+
+    return folhas
+
+
+def baixar_tile(layer, params, i, caixa, paralelo=False):
+    """GetFeature de uma caixa; falha transitória repete só este tile."""
+
+    destino = snapshot_path(layer, f".t{i}.tmp")
+
+    try:
+        status, spool = _get_spool(
+            layer, {**params, "BBOX": bbox_param(caixa)}, destino, paralelo=paralelo
+        )
+    except (requests.RequestException, ValueError) as e:
+        raise RuntimeError(f"tile {i}: {e}")
+
+    if status != 200:
+        raise RuntimeError(f"tile {i}: {status} Client Error")
+
+    return spool
+
+
+def request_em_tiles(layer, total):
+    """
+    Baixa a camada por BBOX, tiles em paralelo, limitados pelo slot por
+    host. Feature na borda vem em mais de um tile: cópias iguais têm o
+    mesmo hash e a mesma geometria, logo caem nos mesmos tiles, e a
+    multiplicidade real de um hash é o maior número de cópias dele num
+    único tile. O resultado tem de fechar com o hits da camada (feature
+    sem geometria, por exemplo, não entra em BBOX nenhum); se não fechar,
+    RuntimeError e quem chama faz a requisição única.
+    """
+
+    extensao = CATALOGO.extensao(layer)
+
+    if not extensao:
+        raise RuntimeError("camada sem WGS84BoundingBox no catálogo")
+
+    minx, miny, maxx, maxy = extensao
+
+    # folga: a caixa anunciada pode vir arredondada (ou reprojetada)
+    folga = max(maxx - minx, maxy - miny, 1e-6) * 1e-4
+    folhas = planejar_tiles(layer, [minx - folga, miny - folga, maxx + folga, maxy + folga])
+
+    log(f"{layer}: {total} features em {len(folhas)} tiles (BBOX)")
+
+    params = _wfs_params(layer, request="GetFeature", outputFormat="application/json")
+
+    if sortby_conhecido(layer):
+        params["sortBy"] = sortby_conhecido(layer)
+
+    with ThreadPoolExecutor(max_workers=max(1, CONCURRENCY["max_per_host"])) as pool:
+        futuros = [
+            pool.submit(baixar_tile, layer, params, i, c, hash_em_processos(total))
+            for i, c in enumerate(folhas)
+        ]
+
+    try:
+        tiles = [futuro.result() for futuro in futuros]
+
+        def unicas():
+            copias = {}
+            for tile in tiles:
+                # offsets das cópias além das já gravadas por tiles anteriores
+                novas = {}
+                for h, offsets in tile["indice"].items():
+                    for offset in offsets[copias.get(h, 0):]:
+                        novas[offset] = h
+                    copias[h] = max(copias.get(h, 0), len(offsets))
+                for offset, feat in read_snapshot(tile["arquivo"]):
+                    if offset in novas:
+                        h = novas[offset]
+                        yield h, feat, tile["geometrias"].get(h)
+
+        destino = snapshot_path(layer, ".tmp")
+
+        with METRICAS.etapa(layer, "juntar_tiles") as m:
+            spool = gravar_spool(layer, (), destino, em_disco(total), unicas())
+            m["features"] = sum(t["total"] for t in tiles)
+            m["tiles"] = len(tiles)
+
+    finally:
+        for i in range(len(folhas)):
+            snapshot_path(layer, f".t{i}.tmp").unlink(missing_ok=True)
+
+    if any("marca" in t for t in tiles):
+        spool["marca"] = None
+        for tile in tiles:
+            spool["marca"] = maior(spool["marca"], tile["marca"])
+
+    if spool["total"] != total:
+        descartar_spool(spool)
+        raise RuntimeError(f"tiles somaram {spool['total']} de {total} features")
+
+    log(f"{layer}: {sum(t['total'] for t in tiles) - total} cópias de borda descartadas")
+
+    return spool
+
+
+def request_layer(layer):
+    """
+    Baixa a camada em streaming para downloads/<camada>.geojson.tmp.
+    Retorna o spool de gravar_spool (arquivo + índice de hashes), ou
+    {"inalterada": True} quando o servidor responde 304 ao GET condicional.
+
+    Job com "incremental" e marca d'água no manifesto: só as features
+    além da marca vêm do servidor (request_incremental). A camada inteira
+    vem sem marca, a cada full_every_days (pega as remoções) e quando a
+    busca incremental falha ou não fecha com o total do servidor.
+    """
+
+    total = contar_features(layer)
+
+    manifest = carregar_manifest(layer, ignore_fields_de(layer))
+
+    inc = incremental_de(layer)
+    estado = estado_incremental(layer, inc, manifest)
+
+    if estado:
+        try:
+            spool = request_incremental(layer, inc, estado, manifest)
+        except Exception as e:
+            log(f"{layer}: busca incremental falhou ({e}), baixando a camada inteira")
+        else:
+            if total is None or spool["total"] == total:
+                return spool
+            log(
+                f"{layer}: incremental fechou com {spool['total']} de {total} features, "
+                "baixando a camada inteira"
+            )
+            descartar_spool(spool)
+
+    spool = request_completo(layer, total, manifest)
+
+    if inc:
+        # 304: nada mudou, a marca é a do manifesto
+        marca = spool.pop("marca", ((manifest or {}).get("incremental") or {}).get("marca"))
+        spool["incremental"] = {
+            "coluna": inc["column"],
+            "marca": marca,
+            "completa": date.today().isoformat(),
+        }
+
+    return spool
+
+
+def estado_incremental(layer, inc, manifest):
+    """
+    Marca d'água do manifesto ({"coluna", "marca", "completa"}) quando a
+    próxima busca pode ser incremental; None = camada inteira.
+    """
+
+    estado = (manifest or {}).get("incremental")
+
+    if not inc or not estado or estado.get("coluna") != inc["column"] or estado.get("marca") is None:
+        return None
+
+    if (date.today() - date.fromisoformat(estado["completa"])).days >= inc["full_every_days"]:
+        log(f"{layer}: reconciliação completa (última em {estado['completa']})")
+        return None
+
+    return estado
+
+
+def filtro_incremental(inc, marca):
+    """Parâmetro do GetFeature com as features além da marca."""
+
+    coluna = inc["column"]
+    data = inc["type"] == "date"
+
+    if inc["syntax"] == "fes":
+        comparacao = "PropertyIsGreaterThanOrEqualTo" if data else "PropertyIsGreaterThan"
+        return {"FILTER": (
+            '<fes:Filter xmlns:fes="http://www.opengis.net/fes/2.0">'
+            f"<fes:{comparacao}>"
+            f"<fes:ValueReference>{html.escape(coluna)}</fes:ValueReference>"
+            f"<fes:Literal>{html.escape(str(marca))}</fes:Literal>"
+            f"</fes:{comparacao}></fes:Filter>"
+        )}
+
+    if isinstance(marca, (int, float)) and not isinstance(marca, bool):
+        literal = repr(marca)
+    else:
+        literal = "'" + str(marca).replace("'", "''") + "'"
+
+    return {"CQL_FILTER": f'"{coluna}" {">=" if data else ">"} {literal}'}
+
+
+def na_faixa(valor, marca, inc):
+    """A feature entra na busca incremental (o servidor a devolve)?"""
+
+    if valor is None:
+        return False
+
+    try:
+        return valor >= marca if inc["type"] == "date" else valor > marca
+    except TypeError:
+        return False
+
+
+def request_incremental(layer, inc, estado, manifest):
+    """
+    GetFeature só das features além da marca d'água (CQL_FILTER/FILTER);
+    as demais vêm do snapshot atual, com o hash do manifesto (e, em
+    memória, a impressão do .geo; no diff em disco gravar_manifest a
+    herda do .geo anterior). O spool é
+    a camada inteira, como o de request_completo: diff, manifesto e
+    histórico seguem iguais. Remoções e edições abaixo da marca só
+    aparecem na reconciliação completa (ou quando o total não fecha).
+    """
+
+    marca = estado["marca"]
+    filtro = filtro_incremental(inc, marca)
+
+    params = _wfs_params(layer, request="GetFeature", outputFormat="application/json", **filtro)
+
+    if sortby_conhecido(layer):
+        params["sortBy"] = sortby_conhecido(layer)
+
+    index = (
+        DOWNLOAD_DIR/manifest["indice"]["arquivo"] if "indice" in manifest
+        else indice_do_manifest(manifest)
     )
+    disco = em_disco(manifest["total"])
+    geometrias = {} if disco else impressoes_do_manifest(manifest)
+    medida = {"segundos": 0.0, "itens": 0, "bytes": 0}
+
+    def mantidas():
+        for h, feat in hashes_do_snapshot(layer, index):
+            if not na_faixa((feat.get("properties") or {}).get(inc["column"]), marca, inc):
+                yield h, feat, geometrias.get(h)
+
+    def anteriores():
+        medida.update(segundos=0.0, itens=0)
+        return _medir_iter(mantidas(), medida)
+
+    status, spool = _get_spool(
+        layer, params, snapshot_path(layer, ".tmp"),
+        disco=disco, anteriores=anteriores
+    )
+
+    if status != 200:
+        raise RuntimeError(f"{status} Client Error")
+
+    METRICAS.somar(layer, "reaproveitar", medida["segundos"], features=medida["itens"])
+
+    # validadores do GET filtrado não servem para o GET condicional
+    spool["validadores"] = {}
+    spool["incremental"] = {**estado, "marca": maior(marca, spool.pop("marca", None))}
+
+    log(
+        f"{layer}: incremental ({inc['column']} além de {marca}): "
+        f"{spool['total'] - medida['itens']} baixadas, {medida['itens']} do snapshot"
+    )
+
+    return spool
+
 
-    r = requests.get(BASE_URL, params=base_params, timeout=120)
+def descartar_spool(spool):
+    for chave in ("arquivo", "indice_arquivo", "geometrias_arquivo"):
+        if spool.get(chave):
+            Path(spool[chave]).unlink(missing_ok=True)
+
+
+def request_completo(layer, total, manifest):
+    """A camada inteira: paginada, GET único ou 304 do GET condicional."""
+
+    job = JOBS.get(layer, {})
 
     # -------------------------
-    # SUCESSO DIRETO
+    # PRÉ-CHECAGEM (hits + ETag/Last-Modified)
     # -------------------------
-    if r.status_code == 200:
-        return r.json()
+    headers = {}
+
+    if manifest and total is not None and total == manifest.get("total"):
+        validadores = manifest.get("validadores", {})
+        if validadores.get("ETag"):
+            headers["If-None-Match"] = validadores["ETag"]
+        if validadores.get("Last-Modified"):
+            headers["If-Modified-Since"] = validadores["Last-Modified"]
 
     # -------------------------
-    # TENTATIVA COM SORTBY
+    # TILES (paging=tiles)
     # -------------------------
-    log(f"{layer}: tentando resolver erro 400 automaticamente...")
+    if job.get("paging") == "tiles" and total:
+        try:
+            return request_em_tiles(layer, total)
+        except Exception as e:
+            log(f"{layer}: download em tiles falhou ({e}), tentando requisição única")
 
-    try:
+    # -------------------------
+    # PAGINAÇÃO (paging=auto)
+    # -------------------------
+    if PAGE_SIZE and job.get("paging", "auto") not in ("never", "tiles"):
 
-        desc_params = dict(
-            service="WFS",
-            version="2.0.0",
-            request="DescribeFeatureType",
-            typeNames=layer
-        )
+        if total is not None and total > PAGE_SIZE:
+            try:
+                return request_paginado(layer, job, total)
+            except Exception as e:
+                log(f"{layer}: paginação falhou ({e}), tentando requisição única")
 
-        desc = requests.get(BASE_URL, params=desc_params, timeout=60)
+    base_params = _wfs_params(
+        layer,
+        request="GetFeature",
+        outputFormat="application/json"
+    )
 
-        text = desc.text
+    # sortBy já conhecido vai na primeira requisição (evita o 400)
+    if sortby_conhecido(layer):
+        base_params["sortBy"] = sortby_conhecido(layer)
 
-        # tenta achar primeiro campo simples
-        import re
+    destino = snapshot_path(layer, ".tmp")
 
-        campos = re.findall(r'name="([^"]+)" type=', text)
+    # sem hits, o tamanho conhecido é o do último snapshot
+    disco = em_disco(total if total is not None else (manifest or {}).get("total"))
 
-        # ignora geometria
-        candidatos = [
-            c for c in campos
-            if c.lower() not in ["geom", "geometry", "the_geom"]
-        ]
+    paralelo = hash_em_processos(total if total is not None else (manifest or {}).get("total"))
 
-        if not candidatos:
-            raise RuntimeError("nenhum campo elegível para sortBy")
+    status, spool = _get_spool(layer, base_params, destino, headers=headers, disco=disco, paralelo=paralelo)
 
-        campo_sort = candidatos[0]
+    # -------------------------
+    # SUCESSO DIRETO
+    # -------------------------
+    if status == 200:
+        return spool
 
-        log(f"{layer}: usando sortBy automático -> {campo_sort}")
+    if status == 304:
+        return {"inalterada": True}
 
-        base_params["sortBy"] = f"{campo_sort} A"
+    # -------------------------
+    # TENTATIVA COM SORTBY
+    # -------------------------
+    log(f"{layer}: tentando resolver erro 400 automaticamente...")
+
+    try:
+
+        base_params["sortBy"] = descobrir_sortby(layer)
 
-        r2 = requests.get(BASE_URL, params=base_params, timeout=120)
+        log(f"{layer}: usando sortBy automático -> {base_params['sortBy']}")
 
-        if r2.status_code != 200:
-            raise RuntimeError(f"{r2.status_code} Client Error")
+        status, spool = _get_spool(layer, base_params, destino, disco=disco, paralelo=paralelo)
 
-        return r2.json()
+        if status != 200:
+            raise RuntimeError(f"{status} Client Error")
+
+        salvar_sortby(layer, base_params["sortBy"])
+
+        return spool
 
     except Exception as e:
         raise RuntimeError(f"400 Client Error (auto-sort falhou): {e}")
@@ -224,116 +1372,316 @@ def normalize_feature(feature, ignore_fields):
     return {"properties": props, "geometry": feature.get("geometry")}
 
 
-def feature_hash(feature):
-    txt = json.dumps(feature, sort_keys=True, ensure_ascii=False)
-    return hashlib.sha256(txt.encode()).hexdigest()
+# muda sempre que o cálculo do hash mudar (invalida manifestos antigos)
+# 1: sha256(json.dumps(sort_keys=True))
+# 2: audit_utils.canonical_hash (BLAKE2b + floats/coordenadas quantizados)
+HASH_SCHEME = 2
+
+
+def feature_hash(feature, ignore_fields=()):
+    return canonical_hash(
+        feature.get("properties"),
+        feature.get("geometry"),
+        ignore_fields
+    )
+
+
+def impressao_geometria(feature):
+    """
+    Impressão digital da geometria quando ela tem GEOMETRY_FP["min_vertices"]
+    ou mais vértices; None para pontos e geometrias pequenas (o diff
+    calcula na hora, é barato).
+    """
+
+    return impressao(feature.get("geometry"), GEOMETRY_FP["min_vertices"])
+
+
+def somar_digest(digest, h):
+    """
+    Digest da camada independente da ordem: soma dos hashes mod 2^128
+    (soma, e não XOR, para que features duplicadas não se anulem).
+    """
+    return (digest + int(h, 16)) % (1 << 128)
+
+
+def formatar_digest(digest):
+    return f"{digest:032x}"
 
 
-def build_index(fc, ignore_fields):
+def build_index(layer, ignore_fields):
+    """hash -> locators das features do snapshot, lido em streaming."""
 
-    index = {}
+    index = None
 
-    for feat in fc.get("features", []):
-        norm = normalize_feature(feat, ignore_fields)
-        h = feature_hash(norm)
-        index.setdefault(h, []).append(norm)
+    with METRICAS.etapa(layer, "build_index") as m:
+
+        workers = workers_hash()
+
+        if hash_em_processos(STORE.contar(layer)):
+            try:
+                index = indexar_paralelo(STORE, layer, ignore_fields, workers)
+                if index is not None:
+                    m["processos"] = workers
+            except (OSError, BrokenProcessPool) as e:
+                log(f"{layer}: hash em paralelo falhou ({e}), seguindo em série")
+
+        if index is None:
+            index = {}
+            for loc, feat in STORE.ler(layer):
+                h = feature_hash(feat, ignore_fields)
+                index.setdefault(h, []).append(loc)
+
+        m["features"] = sum(map(len, index.values()))
 
     return index
 
-# ============================================================
-# HELPERS
-# ============================================================
 
-def _add_operadora_linha(container, operadora, linha, campo):
+def carregar_features(layer, hashes, index, ignore_fields, registros=None):
+    """
+    Relê do store só as features dos hashes pedidos.
+    Retorna hash -> [feature] (como publicada; quem compara recebe os
+    ignore_fields). Com registros (registros.Registros), as features
+    vêm como Registro compacto.
+    """
+
+    saida = {}
 
-    container.setdefault(operadora, {})
-    container[operadora].setdefault(linha, {"add":0,"rem":0})
-    container[operadora][linha][campo] += 1
+    pos = [(loc, h) for h in hashes for loc in index[h]]
+
+    if all(loc is not None for loc, _ in pos):
+        feats = STORE.ler_em(layer, [loc for loc, _ in pos], registros)
+        for loc, h in sorted(pos):
+            saida.setdefault(h, []).append(feats[loc])
+        return saida
+
+    # snapshot no formato antigo (sem offsets): nova passada em streaming
+    for _, feat in STORE.ler(layer):
+        h = feature_hash(feat, ignore_fields)
+        if h in hashes:
+            saida.setdefault(h, []).append(registros.de_feature(feat) if registros else feat)
+
+    return saida
 
 # ============================================================
-# HUMAN SUMMARY UPDATE
+# MANIFESTO (sidecar do snapshot)
 # ============================================================
 
-def update_human_summary(layer, added, removed, new_index, old_index):
+# 2: assinatura do snapshot inclui o formato do store
+# 3: impressões das geometrias saem do manifesto para o .geo (geometrias_path)
+MANIFEST_VERSION = 3
 
-    # ---------------- FROTA ----------------
-    if layer == "semob:Frota por Operadora":
 
-        for h in added:
-            for f in new_index[h]:
-                op = f["properties"].get("operadora","DESCONHECIDA")
-                HUMAN_SUMMARY["frota"][op] = HUMAN_SUMMARY["frota"].get(op,0)+1
+def manifest_path(layer):
+    return DOWNLOAD_DIR/f"{layer.replace(':','__')}.manifest.json"
 
-        for h in removed:
-            for f in old_index[h]:
-                op = f["properties"].get("operadora","DESCONHECIDA")
-                HUMAN_SUMMARY["frota"][op] = HUMAN_SUMMARY["frota"].get(op,0)-1
 
-        return
+def indice_path(layer):
+    """Índice em disco do snapshot (diff_disco), quando a camada é grande."""
+    return DOWNLOAD_DIR/f"{layer.replace(':','__')}.idx"
 
-    # ---------------- HORÁRIOS ----------------
-    if layer == "semob:Horários das Linhas":
-
-        for h in added:
-            for f in new_index[h]:
-                p=f["properties"]
-                _add_operadora_linha(
-                    HUMAN_SUMMARY["horarios"],
-                    p.get("nm_operadora","DESCONHECIDA"),
-                    p.get("cd_linha","??"),
-                    "add"
-                )
 
-        for h in removed:
-            for f in old_index[h]:
-                p=f["properties"]
-                _add_operadora_linha(
-                    HUMAN_SUMMARY["horarios"],
-                    p.get("nm_operadora","DESCONHECIDA"),
-                    p.get("cd_linha","??"),
-                    "rem"
-                )
-        return
+def geometrias_path(layer):
+    """Impressões das geometrias grandes do snapshot (.geo, ordenado por hash)."""
+    return DOWNLOAD_DIR/f"{layer.replace(':','__')}.geo"
 
-    # ---------------- ITINERÁRIO ----------------
-    if layer == "semob:Itinerário Espacial das Linhas":
-
-        for h in added:
-            for f in new_index[h]:
-                p=f["properties"]
-                _add_operadora_linha(
-                    HUMAN_SUMMARY["itinerario"],
-                    p.get("nm_operadora","DESCONHECIDA"),
-                    p.get("cd_linha","??"),
-                    "add"
-                )
 
-        for h in removed:
-            for f in old_index[h]:
-                p=f["properties"]
-                _add_operadora_linha(
-                    HUMAN_SUMMARY["itinerario"],
-                    p.get("nm_operadora","DESCONHECIDA"),
-                    p.get("cd_linha","??"),
-                    "rem"
-                )
-        return
+def gravar_manifest(layer, spool, ignore_fields):
+    """
+    Grava hashes ordenados + locators (multiplicidade = nº de locators)
+    do snapshot atual, amarrados à assinatura do store (formato, tamanho,
+    mtime), junto com total, digest e validadores HTTP do fast path.
+    No diff em disco os hashes ficam no índice ordenado ao lado
+    (indice_path), referenciado pelo manifesto com o seu tamanho; as
+    impressões digitais das geometrias grandes ficam sempre fora do
+    manifesto, em geometrias_path, referenciado do mesmo jeito.
+    """
+
+    manifest = {
+        "versao": MANIFEST_VERSION,
+        "hash_scheme": HASH_SCHEME,
+        "ignore_fields": sorted(ignore_fields),
+        "snapshot": STORE.assinatura(layer),
+        "total": spool["total"],
+        "digest": spool["digest"],
+        "validadores": spool.get("validadores", {}),
+    }
+
+    if spool.get("incremental"):
+        manifest["incremental"] = spool["incremental"]
+
+    if "indice_arquivo" in spool:
+        os.replace(spool["indice_arquivo"], indice_path(layer))
+        spool["indice_arquivo"] = indice_path(layer)
+        manifest["indice"] = {
+            "arquivo": indice_path(layer).name,
+            "bytes": indice_path(layer).stat().st_size,
+        }
+    else:
+        index = spool["indice"]
+        manifest["hashes"] = [[h, index[h]] for h in sorted(index)]
+        indice_path(layer).unlink(missing_ok=True)
+
+    geo = geometrias_path(layer)
+
+    if "geometrias_arquivo" in spool:
+        if spool.get("incremental") and geo.exists():
+            # features mantidas do snapshot vêm sem impressão: a do .geo
+            # anterior vale para o mesmo hash
+            tmp = Path(f"{geo}.tmp")
+            juntar_impressoes(
+                [ler_linhas(spool["geometrias_arquivo"]), impressoes_de(geo, spool["indice_arquivo"])],
+                tmp
+            )
+            os.replace(tmp, geo)
+            Path(spool["geometrias_arquivo"]).unlink()
+        else:
+            os.replace(spool["geometrias_arquivo"], geo)
+        spool["geometrias_arquivo"] = geo
+    else:
+        geometrias = spool.get("geometrias", {})
+        gravar_linhas(geo, (linha_impressao(h, geometrias[h]) for h in sorted(geometrias)))
+
+    manifest["geometrias"] = {"arquivo": geo.name, "bytes": geo.stat().st_size}
+
+    regravar_manifest(layer, manifest)
+
+
+def regravar_manifest(layer, manifest):
+
+    tmp = manifest_path(layer).with_suffix(".tmp")
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+
+    os.replace(tmp, manifest_path(layer))
+
+
+def carregar_manifest(layer, ignore_fields):
+    """
+    Manifesto do snapshot atual, ou None se estiver ausente, em outra
+    versão ou não corresponder mais ao snapshot.
+    """
+
+    path = manifest_path(layer)
+
+    if not path.exists() or not STORE.existe(layer):
+        return None
+
+    try:
+        manifest = json.load(open(path, encoding="utf-8"))
+    except ValueError:
+        return None
+
+    valido = (
+        manifest.get("versao") == MANIFEST_VERSION
+        and manifest.get("hash_scheme") == HASH_SCHEME
+        and manifest.get("ignore_fields") == sorted(ignore_fields)
+        and manifest.get("snapshot") == STORE.assinatura(layer)
+    )
+
+    for chave in ("indice", "geometrias"):
+        if valido and chave in manifest:
+            arquivo = DOWNLOAD_DIR/manifest[chave]["arquivo"]
+            valido = arquivo.exists() and arquivo.stat().st_size == manifest[chave]["bytes"]
+
+    return manifest if valido else None
+
+
+def indice_do_manifest(manifest):
+    if "indice" in manifest:
+        # camada saiu do modo em disco: o índice volta a caber na memória
+        return dict(agrupar(ler_registros(DOWNLOAD_DIR/manifest["indice"]["arquivo"])))
+    return {h: locators for h, locators in manifest["hashes"]}
+
+
+def impressoes_do_manifest(manifest, hashes=None):
+    """hash -> impressão do .geo do manifesto (com hashes, só desses); {} sem manifesto."""
+
+    if not manifest or "geometrias" not in manifest:
+        return {}
+
+    return dict(ler_impressoes(DOWNLOAD_DIR/manifest["geometrias"]["arquivo"], hashes))
+
+
+def indice_em_disco(layer, manifest, ignore_fields, pasta):
+    """
+    Índice do snapshot atual ordenado por hash, em disco: o do manifesto
+    ou, se ele estava em memória/ausente, regravado/reconstruído em pasta.
+    """
+
+    if manifest and "indice" in manifest:
+        return DOWNLOAD_DIR/manifest["indice"]["arquivo"]
+
+    destino = pasta/"antigo.bin"
+
+    if manifest:
+        # hashes já ordenados e locators crescentes = ordem do índice
+        gravar_registros(destino, (
+            empacotar(h, loc) for h, locs in manifest["hashes"] for loc in locs
+        ))
+        return destino
+
+    log(f"{layer}: manifesto ausente ou desatualizado, reindexando snapshot em disco")
+
+    with METRICAS.etapa(layer, "build_index") as m:
+        m["features"] = ordenar(
+            (empacotar(feature_hash(feat, ignore_fields), loc) for loc, feat in STORE.ler(layer)),
+            destino, pasta, orcamento_bytes()
+        )
+
+    return destino
+
+# ============================================================
+# HELPERS
+# ============================================================
+
+def _rotulo(resumo, campos, chave):
+    """'Linha 0.110' para a chave ("0.110",) com labels {"cd_linha": "Linha"}."""
+
+    return " / ".join(
+        f"{resumo['labels'][c]} {v}" if c in resumo["labels"] else v
+        for c, v in zip(campos, chave)
+    )
+
+
+def _partes(info, unidade):
+    partes=[]
+    if info["add"]: partes.append(f"+{info['add']} {unidade}")
+    if info["rem"]: partes.append(f"-{info['rem']} {unidade}")
+    if info["mod"]: partes.append(f"~{info['mod']} alterações")
+    return " | ".join(partes)
 
 # ============================================================
 # IMPACTO OPERACIONAL
 # ============================================================
 
-def detectar_impacto_operacional():
+def detectar_impacto_operacional(agregado):
+    """Grupos com remoções >= summary.impact_removed_at."""
 
     alertas=[]
 
-    for op,linhas in HUMAN_SUMMARY["horarios"].items():
-        for linha,info in linhas.items():
+    for layer in agregado.camadas():
 
-            if info["rem"]>=10:
-                alertas.append(
-                    f"{op}\n• Linha {linha}: −{info['rem']} viagens"
-                )
+        resumo=agregado.resumo(layer)
+        limite=resumo["impact_removed_at"]
+
+        if limite is None:
+            continue
+
+        campos=agregado.campos(layer)
+
+        for chave,info in agregado.grupos(layer):
+
+            if info["rem"]<limite:
+                continue
+
+            # operadora (primeiro campo) como cabeçalho do alerta
+            if len(chave)>1:
+                cabecalho,grupo=chave[0],_rotulo(resumo,campos[1:],chave[1:])
+            else:
+                cabecalho,grupo=resumo["title"],_rotulo(resumo,campos,chave) or "Total"
+
+            alertas.append(f"{cabecalho}\n• {grupo}: −{info['rem']} {resumo['unit']}")
 
     return "\n\n".join(alertas) if alertas else None
 
@@ -341,41 +1689,57 @@ def detectar_impacto_operacional():
 # RESUMO HUMANO
 # ============================================================
 
-def gerar_resumo_humano():
+def gerar_resumo_humano(agregado):
+    """
+    Um bloco por camada com mudança. Grupos de dois ou mais campos
+    (ex.: nm_operadora + cd_linha) são listados sob o primeiro campo.
+    """
 
     linhas=[]
 
-    if HUMAN_SUMMARY["frota"]:
-        linhas.append("🚌 Frota por Operadora\n")
-        for op,v in HUMAN_SUMMARY["frota"].items():
-            if v:
-                linhas.append(f"• {op}: {v:+} veículos")
-        linhas.append("")
+    for layer in agregado.camadas():
 
-    if HUMAN_SUMMARY["horarios"]:
-        linhas.append("🕒 Horários das Linhas\n")
+        resumo=agregado.resumo(layer)
+        campos=agregado.campos(layer)
+        unidade=resumo["unit"]
 
-        for op,ls in HUMAN_SUMMARY["horarios"].items():
-            linhas.append(f"{op}:")
+        if not agregado.total(layer):
+            continue
 
-            for linha,info in ls.items():
-                partes=[]
-                if info["add"]: partes.append(f"+{info['add']} viagens")
-                if info["rem"]: partes.append(f"-{info['rem']} viagens")
+        linhas.append(f"{resumo['title']}\n")
+
+        # ---------------- SALDO (ex.: frota) ----------------
+        if resumo["net"]:
+            for chave,info in agregado.grupos(layer):
+                saldo=info["add"]-info["rem"]
+                if saldo:
+                    linhas.append(f"• {_rotulo(resumo,campos,chave) or 'Total'}: {saldo:+} {unidade}")
+            linhas.append("")
+            continue
 
-                linhas.append(f"• Linha {linha}: {' | '.join(partes)}")
+        # ---------------- SEM GRUPO ----------------
+        if not campos:
+            for _,info in agregado.grupos(layer):
+                linhas.append(f"• {_partes(info,unidade)}")
+            linhas.append("")
+            continue
 
+        # ---------------- UM NÍVEL ----------------
+        if len(campos)==1:
+            for chave,info in agregado.grupos(layer):
+                linhas.append(f"• {_rotulo(resumo,campos,chave)}: {_partes(info,unidade)}")
             linhas.append("")
+            continue
 
-    if HUMAN_SUMMARY["itinerario"]:
-        linhas.append("📍 Itinerário Espacial\n")
+        # ---------------- DOIS OU MAIS NÍVEIS ----------------
+        por_topo={}
+        for chave,info in agregado.grupos(layer):
+            por_topo.setdefault(chave[0],[]).append((chave[1:],info))
 
-        for op,ls in HUMAN_SUMMARY["itinerario"].items():
-            linhas.append(f"{op}:")
-            for linha,info in ls.items():
-                linhas.append(
-                    f"• Linha {linha}: +{info['add']} | -{info['rem']} alterações"
-                )
+        for topo,grupos in por_topo.items():
+            linhas.append(f"{topo}:")
+            for resto,info in grupos:
+                linhas.append(f"• {_rotulo(resumo,campos[1:],resto)}: {_partes(info,unidade)}")
             linhas.append("")
 
     return "\n".join(linhas) if linhas else None
@@ -384,67 +1748,526 @@ def gerar_resumo_humano():
 # AUDITORIA
 # ============================================================
 
-def audit_layer(layer,new_data):
+INALTERADA = "inalterada (fast path)"
+
+# registros modificados detalhados no log, por camada
+MAX_DETALHES_LOG = 20
+
+
+def audit_layer(layer,novo):
+    """
+    Compara o spool baixado com o snapshot anterior e, com o relatório já
+    gravado, o promove a snapshot.
+
+    O índice anterior vem do manifesto (sem reparsear o snapshot); só as
+    features dos hashes adicionados/removidos são relidas do disco.
+    As features desses hashes são pareadas pela identidade de audit_rules
+    (adicionada / removida / modificada). Camadas com
+    out_of_core.min_features ou mais chegam com o índice em disco e
+    seguem por audit_em_disco.
+    Devolve o diff já agregado (Agregador só desta camada, detalhe por
+    feature no relatório), None no snapshot inicial ou INALTERADA quando
+    a camada não mudou.
+    """
+
+    ignore_fields=ignore_fields_de(layer)
+
+    with METRICAS.etapa(layer,"manifesto"):
+        manifest=carregar_manifest(layer,ignore_fields)
+
+    # ---------------- FAST PATH ----------------
+    # 304 no GET condicional, ou mesmo total + mesmo digest de camada:
+    # sem diff e sem regravar snapshot/manifesto
+    if novo.get("inalterada") or (
+        manifest
+        and manifest.get("total")==novo["total"]
+        and manifest.get("digest")==novo["digest"]
+    ):
+        if novo.get("arquivo"):
+            descartar_spool(novo)
+        # reconciliação completa sem mudança: só a data no manifesto
+        if novo.get("incremental") and manifest and manifest.get("incremental")!=novo["incremental"]:
+            manifest["incremental"]=novo["incremental"]
+            regravar_manifest(layer,manifest)
+        log(f"{layer}: {INALTERADA}")
+        METRICAS.resultado(layer,resultado="inalterada")
+        return INALTERADA
+
+    if not STORE.existe(layer):
+        with METRICAS.etapa(layer,"promover") as m:
+            promover(layer,novo)
+            m["features"]=novo["total"]
+        with METRICAS.etapa(layer,"gravar_manifest"):
+            gravar_manifest(layer,novo,ignore_fields)
+        with METRICAS.etapa(layer,"historico"):
+            registrar_historico(layer,novo.get("indice",novo.get("indice_arquivo")))
+        log(f"{layer}: snapshot inicial criado")
+        METRICAS.resultado(layer,resultado="inicial",total=novo["total"])
+        return None
+
+    auditoria=audit_em_disco if "indice_arquivo" in novo else audit_em_memoria
+
+    # cada parte do diff (a camada inteira, ou uma partição do diff em
+    # disco) vai para o resumo e para o relatório e é descartada
+    agregado=Agregador(AUDIT_RULES)
+    n={"added":0,"removed":0,"modified":0}
+    detalhes=[]
+
+    # a promoção (snapshot, manifesto, histórico) só acontece na saída do
+    # with externo, com o relatório fechado: exceção no diff ou no
+    # relatório deixa snapshot e manifesto anteriores e a próxima
+    # execução encontra a mesma mudança
+    with auditoria(layer,novo,manifest,ignore_fields) as partes:
+        with RELATORIO.camada(layer) as relatorio:
+            for diff in partes:
+                agregado.adicionar(layer,diff)
+                with METRICAS.etapa(layer,"relatorio") as m:
+                    relatorio.registrar(diff)
+                    m["features"]=sum(len(diff[k]) for k in n)
+                for k in n:
+                    n[k]+=len(diff[k])
+                detalhes+=diff["modified"][:MAX_DETALHES_LOG-len(detalhes)]
+
+    METRICAS.resultado(
+        layer,
+        resultado="diff",
+        total=novo["total"],
+        adicionados=n["added"],
+        removidos=n["removed"],
+        modificados=n["modified"]
+    )
 
-    ignore_fields=LAYERS[layer].get("ignore_fields",[])
-    file_path=DOWNLOAD_DIR/f"{layer.replace(':','__')}.geojson"
+    log(
+        f"{layer}: {n['added']} adicionados | "
+        f"{n['removed']} removidos | "
+        f"{n['modified']} modificados"
+    )
 
-    if not file_path.exists():
-        json.dump(new_data,open(file_path,"w",encoding="utf-8"),ensure_ascii=False)
-        log(f"{layer}: snapshot inicial criado")
+    for m in detalhes:
+        for linha in format_feature_audit(" / ".join(map(str,m["identity"])),m["audit"]):
+            log(f"{layer}:   {linha}")
+
+    return agregado
+
+
+@contextmanager
+def audit_em_memoria(layer,novo,manifest,ignore_fields):
+    """
+    Diff com os dois índices (hash -> locators) em memória. Entrega
+    [diff] e, se o bloco de quem usa terminar sem exceção, promove o
+    spool; com exceção o spool é descartado.
+    """
+
+    try:
+        if manifest:
+            old_index=indice_do_manifest(manifest)
+        else:
+            log(f"{layer}: manifesto ausente ou desatualizado, reindexando snapshot")
+            old_index=build_index(layer,ignore_fields)
+
+        with METRICAS.etapa(layer,"diff_hashes") as m:
+            added=set(novo["indice"])-set(old_index)
+            removed=set(old_index)-set(novo["indice"])
+            m["features"]=len(old_index)+len(novo["indice"])
+
+        # features alteradas em Registro compacto, textos compartilhados
+        # entre as duas versões
+        registros=Registros()
+
+        with METRICAS.etapa(layer,"carregar_features") as m:
+            old_feats=carregar_features(layer,removed,old_index,ignore_fields,registros)
+            new_feats=carregar_do_spool(novo,added,registros)
+            m["features"]=sum(map(len,old_feats.values()))+sum(map(len,new_feats.values()))
+            old_geo=impressoes_do_manifest(manifest,removed)
+
+        with METRICAS.etapa(layer,"diff_identidade") as m:
+            diff=diff_by_identity(
+                [f for h in removed for f in old_feats[h]],
+                [f for h in added for f in new_feats[h]],
+                AUDIT_RULES.get(layer,{}).get("identity"),
+                ignore_fields,
+                [old_geo.get(h) for h in removed for _ in old_feats[h]],
+                [novo["geometrias"].get(h) for h in added for _ in new_feats[h]],
+                AUDIT_RULES.get(layer,{}).get("geometry_tolerance",0.0)
+            )
+            m["features"]=sum(map(len,old_feats.values()))+sum(map(len,new_feats.values()))
+
+        yield [diff]
+    except BaseException:
+        descartar_spool(novo)
+        raise
+
+    with METRICAS.etapa(layer,"promover") as m:
+        promover(layer,novo)
+        m["features"]=novo["total"]
+
+    with METRICAS.etapa(layer,"gravar_manifest"):
+        gravar_manifest(layer,novo,ignore_fields)
+
+    with METRICAS.etapa(layer,"historico"):
+        registrar_historico(layer,novo["indice"],{
+            "add":(
+                (h,[f.para_dict() for f in feats]) for h,feats in new_feats.items()
+            ) if new_feats else {},
+            "rem":sorted(removed),
+            "mult":{
+                h:len(locs) for h,locs in novo["indice"].items()
+                if h in old_index and len(old_index[h])!=len(locs)
+            }
+        })
+
+
+def carregar_do_spool(novo,hashes,registros):
+    """hash -> [Registro] das features dos hashes pedidos, lidas do spool (antes de promover)."""
+
+    pos=[(loc,h) for h in hashes for loc in novo["indice"][h]]
+    feats=ler_spool_em(novo["arquivo"],[loc for loc,_ in pos])
+
+    saida={}
+    for loc,h in sorted(pos):
+        saida.setdefault(h,[]).append(registros.de_feature(feats[loc]))
+    return saida
+
+
+@contextmanager
+def audit_em_disco(layer,novo,manifest,ignore_fields):
+    """
+    Diff de camadas grandes (diff_disco), com memória limitada por
+    out_of_core.memory_mb: merge-join em streaming dos índices ordenados
+    por hash; só as features dos hashes alterados são relidas (em ordem
+    de locator) e pareadas partição a partição.
+    Entrega um gerador com um diff (diff_by_identity) por partição e,
+    se o bloco de quem usa terminar sem exceção, promove o spool; com
+    exceção o spool é descartado.
+    """
+
+    orcamento=orcamento_bytes()
+    identidade=AUDIT_RULES.get(layer,{}).get("identity")
+
+    with tempfile.TemporaryDirectory(prefix="diff_",dir=DOWNLOAD_DIR) as tmp:
+
+        pasta=Path(tmp)
+
+        try:
+            old_idx=indice_em_disco(layer,manifest,ignore_fields,pasta)
+
+            with METRICAS.etapa(layer,"diff_hashes") as m:
+                j=juntar(old_idx,novo["indice_arquivo"],pasta)
+                m["features"]=(manifest["total"] if manifest else STORE.contar(layer))+novo["total"]
+
+            bytes_feature=max(1,novo["arquivo"].stat().st_size//max(1,novo["total"]))
+            particoes=Particoes(
+                pasta,
+                n_particoes(j["n_rem"]+j["n_add"],bytes_feature,orcamento),
+                identidade
+            )
+
+            def alterados(registros,ler_em):
+                # em ordem de locator: leitura sequencial do snapshot/spool
+                por_locator=pasta/"por_loc.bin"
+                ordenar(map(por_loc,ler_registros(registros)),por_locator,pasta,orcamento)
+                return ler_por_loc(ler_registros(por_locator),ler_em,max(1,orcamento//(4*bytes_feature)))
+
+            # removidas no snapshot anterior, adicionadas no spool
+            # (locator = offset no .tmp)
+            with METRICAS.etapa(layer,"carregar_features") as m:
+                m["features"]=particoes.gravar("old",alterados(
+                    j["removidos"],lambda locs:STORE.ler_em(layer,locs)
+                ))
+                m["features"]+=particoes.gravar("new",alterados(
+                    j["adicionados"],lambda locs:ler_spool_em(novo["arquivo"],locs)
+                ))
+
+            # impressões só dos hashes alterados; cada partição lê as suas
+            impressoes={"old":pasta/"old.geo","new":pasta/"new.geo"}
+            with METRICAS.etapa(layer,"carregar_features"):
+                gravar_linhas(impressoes["old"],impressoes_de(
+                    DOWNLOAD_DIR/manifest["geometrias"]["arquivo"],j["removidos"]
+                ) if manifest else ())
+                gravar_linhas(impressoes["new"],impressoes_de(novo["geometrias_arquivo"],j["adicionados"]))
+
+            def partes():
+                # uma partição por vez: quem consome (audit_layer) agrega e
+                # grava o relatório antes da próxima
+                for i in range(particoes.n):
+                    with METRICAS.etapa(layer,"diff_identidade") as m:
+                        registros=Registros()
+                        old_part=particoes.ler("old",i,registros)
+                        new_part=particoes.ler("new",i,registros)
+                        old_geo=dict(ler_impressoes(impressoes["old"],{h for h,_ in old_part}))
+                        new_geo=dict(ler_impressoes(impressoes["new"],{h for h,_ in new_part}))
+                        parte=diff_by_identity(
+                            [f for _,f in old_part],
+                            [f for _,f in new_part],
+                            identidade,
+                            ignore_fields,
+                            [old_geo.get(h) for h,_ in old_part],
+                            [new_geo.get(h) for h,_ in new_part],
+                            AUDIT_RULES.get(layer,{}).get("geometry_tolerance",0.0)
+                        )
+                        m["features"]=len(old_part)+len(new_part)
+                        m["particoes"]=1
+                    del old_part,new_part,registros,old_geo,new_geo
+                    yield parte
+
+            yield partes()
+        except BaseException:
+            descartar_spool(novo)
+            raise
+
+        with METRICAS.etapa(layer,"promover") as m:
+            promover(layer,novo)
+            m["features"]=novo["total"]
+
+        with METRICAS.etapa(layer,"gravar_manifest"):
+            gravar_manifest(layer,novo,ignore_fields)
+
+        with METRICAS.etapa(layer,"historico"):
+            registrar_historico(layer,novo["indice_arquivo"],{
+                "add":particoes.agrupado("new") if j["n_add"] else {},
+                "rem":(h for h,_ in agrupar(ler_registros(j["removidos"]))) if j["n_rem"] else [],
+                "mult":j["mult"]
+            })
+
+
+def promover(layer,novo):
+    """
+    Spool -> snapshot. No diff em disco o índice (novo["indice_arquivo"])
+    é regravado com os locators do store quando eles mudam.
+    """
+
+    if "indice_arquivo" not in novo:
+        novo["indice"]=STORE.promover(layer,novo)
         return
 
-    old_data=json.load(open(file_path,encoding="utf-8"))
+    offsets=Path(f"{novo['arquivo']}.offsets")
+    remapeado=Path(f"{novo['indice_arquivo']}.tmp")
+
+    try:
+        if STORE.promover_sem_indice(layer,novo["arquivo"],offsets):
+            remapear(novo["indice_arquivo"],offsets,remapeado)
+            os.replace(remapeado,novo["indice_arquivo"])
+    finally:
+        offsets.unlink(missing_ok=True)
+        remapeado.unlink(missing_ok=True)
+
 
-    old_index=build_index(old_data,ignore_fields)
-    new_index=build_index(new_data,ignore_fields)
+def ler_spool_em(arquivo,locators):
+    """locator (offset no spool) -> feature."""
 
-    added=set(new_index)-set(old_index)
-    removed=set(old_index)-set(new_index)
+    with open(arquivo,"rb") as f:
+        return {loc:read_feature_at(f,loc) for loc in sorted(set(locators))}
 
-    update_human_summary(layer,added,removed,new_index,old_index)
 
-    log(f"{layer}: {len(added)} adicionados | {len(removed)} removidos")
+def hashes_do_snapshot(layer,index):
+    """
+    (hash, feature) do snapshot, em ordem de locator, sem recalcular o
+    hash. index: hash -> locators, ou o caminho do índice em disco.
+    """
+
+    if not isinstance(index,dict):
+        # índice em disco (diff_disco): hashes em ordem de locator
+        # percorridos lado a lado com o store
+        hashes=hashes_por_loc(index,Path(index).parent,orcamento_bytes())
+        for (_,h),(_,feat) in zip(hashes,STORE.ler(layer)):
+            yield h,feat
+        return
+
+    hash_do_loc={loc:h for h,locs in index.items() for loc in locs}
+    for loc,feat in STORE.ler(layer):
+        yield hash_do_loc[loc],feat
 
-    json.dump(new_data,open(file_path,"w",encoding="utf-8"),ensure_ascii=False)
+
+def registrar_historico(layer,index,delta=None):
+    """
+    Delta do dia (e base, quando vence o período) no histórico.
+    index: hash -> locators, ou o caminho do índice em disco.
+    """
+
+    if HISTORICO is None:
+        return
+
+    try:
+        HISTORICO.registrar(layer,date.today(),lambda:hashes_do_snapshot(layer,index),delta)
+    except Exception as e:
+        log(f"{layer}: falha ao gravar histórico: {e}")
+
+
+def processar_camada(layer):
+    """
+    Download + auditoria de uma camada (executado nos workers).
+    O diff já volta agregado num Agregador só desta camada.
+    """
+
+    with METRICAS.perfilar(layer):
+
+        with METRICAS.etapa(layer,"request_layer"):
+            novo=request_layer(layer)
+
+        with METRICAS.etapa(layer,"audit_layer"):
+            return audit_layer(layer,novo)
 
 # ============================================================
 # EXECUÇÃO
 # ============================================================
 
-def main():
+def atualizar_catalogo(forcar=False):
+    """
+    Revalida o catálogo (se vencido ou forcar) e reaplica os nomes em
+    JOBS/AUDIT_RULES (só trocados se algum nome mudou). Retorna os eventos de esquema (catalogo.py).
+    """
+
+    with METRICAS.etapa("_execucao","catalogo") as m:
+        eventos=CATALOGO.atualizar(
+            _get,
+            dict(service="WFS",version="2.0.0"),
+            CONCURRENCY["max_per_host"],
+            forcar
+        )
+        m["camadas"]=len(CATALOGO.camadas())
+        m["eventos"]=len(eventos)
 
-    log("Início da auditoria")
+    aplicar_catalogo()
+
+    for evento in eventos:
+        log(f"Catálogo: {descrever(evento)}")
+        METRICAS.resultado(evento["camada"],esquema=evento)
+
+    return eventos
 
-    for layer,cfg in LAYERS.items():
 
-        if cfg.get("ignore"):
+def camadas_ativas():
+    """
+    Jobs habilitados, na ordem do config.json, que o GetCapabilities
+    publica. Sem catálogo (servidor fora na primeira execução) vão todos.
+    """
+
+    ativos=[]
+
+    for layer,job in JOBS.items():
+
+        if not job.get("enabled",True):
             log(f"{layer}: IGNORADO")
             continue
 
-        try:
-            data=request_layer(layer)
-            audit_layer(layer,data)
+        if CATALOGO and layer not in CATALOGO:
+            log(f"{layer}: fora do GetCapabilities, ignorado")
+            continue
+
+        ativos.append(layer)
+
+    return ativos
 
-        except Exception as e:
-            log(f"{layer}: ERRO {e}")
 
-    resumo=gerar_resumo_humano()
-    impacto=detectar_impacto_operacional()
+def montar_mensagem(agregado,inalteradas=(),ativos=(),eventos=()):
+    """Texto do card do Teams: impacto operacional + esquemas + resumo por grupo."""
+
+    resumo=gerar_resumo_humano(agregado)
+    impacto=detectar_impacto_operacional(agregado)
 
     mensagem=""
 
     if impacto:
         mensagem+="🚨 IMPACTO OPERACIONAL DETECTADO\n\n"+impacto+"\n\n"
 
+    if eventos:
+        mensagem+="🧬 ESQUEMA ALTERADO\n\n"+"\n".join(f"• {descrever(e)}" for e in eventos)+"\n\n"
+
     if resumo:
         mensagem+=resumo
 
-    enviar_teams(mensagem)
+    if inalteradas:
+        mensagem=(
+            (mensagem.rstrip() or "Nenhuma alteração detectada nas camadas monitoradas.")
+            +f"\n\n⚡ Sem alteração (fast path): {len(inalteradas)} de {len(ativos)} camadas"
+        )
+
+    return mensagem
+
+
+def main():
+
+    inicializar()
+
+    log("Início da auditoria")
+
+    METRICAS.iniciar()
+    RELATORIO.iniciar()
+
+    # entrega também o que ficou pendente de execuções anteriores
+    CAIXA_SAIDA.iniciar()
+
+    # uma passada de GetCapabilities + esquemas (ou o cache) antes das camadas
+    eventos=atualizar_catalogo()
+
+    ativos=camadas_ativas()
+    inalteradas=[]
+    agregado=Agregador(AUDIT_RULES)
+
+    # downloads limitados por host; quem já baixou segue para hash/diff
+    # enquanto as próximas camadas ainda estão chegando
+    with ThreadPoolExecutor(max_workers=max(1,CONCURRENCY["max_workers"])) as pool:
+
+        futuros={layer:pool.submit(processar_camada,layer) for layer in ativos}
+
+        # parciais mesclados na ordem dos jobs -> idêntico à execução sequencial
+        for layer in ativos:
+
+            try:
+                resultado=futuros[layer].result()
+
+            except Exception as e:
+                log(f"{layer}: ERRO {e}")
+                METRICAS.resultado(layer,resultado="erro",erro=str(e))
+                continue
+
+            if resultado==INALTERADA:
+                inalteradas.append(layer)
+
+            elif resultado:
+                agregado.mesclar(resultado)
+
+    encerrar_pool_hash()
+
+    if inalteradas:
+        log(f"{len(inalteradas)} camada(s) sem alteração (fast path)")
+
+    # falha na caixa de saída (disco) não tira as métricas da execução
+    try:
+        enviar_teams(montar_mensagem(agregado,inalteradas,ativos,eventos),agregado,eventos)
+    except Exception as e:
+        log(f"Falha ao notificar: {e}")
+
+    if RELATORIO.caminho():
+        log(f"Relatório detalhado: {RELATORIO.caminho()}")
+
+    CAIXA_SAIDA.aguardar(NOTIFICATIONS["flush_seconds"])
+
+    if METRICS["enabled"]:
+        try:
+            log(f"Métricas: {METRICAS.gravar()}")
+        except OSError as e:
+            log(f"Falha ao gravar métricas: {e}")
 
     log("Fim da auditoria")
 
 # ============================================================
 
+def exportar_geojson(layer,destino=None):
+    """Exporta o snapshot atual (qualquer formato de store) para GeoJSON."""
+
+    destino=Path(destino) if destino else DOWNLOAD_DIR/f"{layer.replace(':','__')}.export.geojson"
+    n=STORE.exportar_geojson(layer,destino)
+    log(f"{layer}: {n} features exportadas para {destino}")
+
+# ============================================================
+
 if __name__=="__main__":
-    main()
+
+    import sys
+
+    # python baixar_geoserver.py --exportar "semob:Frota por Operadora" [destino]
+    if len(sys.argv)>2 and sys.argv[1]=="--exportar":
+        exportar_geojson(sys.argv[2],sys.argv[3] if len(sys.argv)>3 else None)
+    else:
+        main()
@@ -0,0 +1,352 @@
+# ============================================================
+# BENCHMARK – PIPELINE DE AUDITORIA
+# ============================================================
+#
+# Uso:
+#   python benchmark.py            (hash, 200k horários / 2k itinerários)
+#   python benchmark.py 1000000    (tamanho da camada de horários)
+#
+#   python benchmark.py pipeline [--arquetipo frota,horarios,itinerario,paradas]
+#       [--n 10000,100000,1000000] [--add 1] [--rem 1] [--edit 2]
+#       [--vertices 200] [--formato geojson|colunar] [--seed 42]
+#       [--sem-memoria] [--saida resultado.json] [--comparar base.json]
+#
+# O modo pipeline gera uma camada sintética e a versão seguinte (ver
+# gerador_sintetico.py) e mede cada etapa da auditoria: throughput e pico
+# de memória (tracemalloc; --sem-memoria mede só tempo, sem o custo do
+# rastreamento). --saida grava os números; --comparar aponta etapas que
+# ficaram mais de 20% piores que um resultado anterior.
+
+import argparse
+import hashlib
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import baixar_geoserver as bg
+from agregador import Agregador
+from audit_utils import diff_by_identity, geometry_diff_batch, geometry_fingerprint
+from baixar_geoserver import feature_hash, normalize_feature
+from gerador_sintetico import (
+    ARQUETIPOS,
+    gerar_camada,
+    gerar_horarios,
+    gerar_itinerarios,
+    gerar_versao,
+    layer_de,
+)
+from registros import Registros
+from snapshot_store import STORES, criar_store
+
+
+# ============================================================
+# HASH
+# ============================================================
+
+def feature_hash_v1(feature, ignore_fields):
+    """Esquema 1 (anterior): sha256 de json.dumps(sort_keys=True)."""
+    norm = normalize_feature(feature, ignore_fields)
+    txt = json.dumps(norm, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(txt.encode()).hexdigest()
+
+
+def medir(nome, fn, feats, ignore_fields):
+    t = time.perf_counter()
+    for f in feats:
+        fn(f, ignore_fields)
+    dt = time.perf_counter() - t
+    print(f"  {nome:<28} {len(feats) / dt:>12,.0f} features/s")
+    return dt
+
+
+def bench_hash(n_horarios, n_itinerarios):
+
+    for titulo, feats in (
+        (f"Horários das Linhas ({n_horarios:,} pontos)", list(gerar_horarios(n_horarios))),
+        (f"Itinerário Espacial ({n_itinerarios:,} linhas)", list(gerar_itinerarios(n_itinerarios))),
+    ):
+        print(titulo)
+        v1 = medir("v1 sha256 + json.dumps", feature_hash_v1, feats, ["fid"])
+        v2 = medir("v2 canonical_hash", feature_hash, feats, ["fid"])
+        print(f"  ganho: {v1 / v2:.1f}x\n")
+
+
+# ============================================================
+# PIPELINE
+# ============================================================
+
+class Etapas:
+    """Cronometra etapas e registra o pico de memória de cada uma."""
+
+    def __init__(self, memoria=True):
+        self.memoria = memoria
+        self.resultados = []
+
+    def medir(self, nome, fn, features=None):
+        if self.memoria:
+            tracemalloc.start()
+        t = time.perf_counter()
+        try:
+            ret = fn()
+        finally:
+            dt = time.perf_counter() - t
+            pico = tracemalloc.get_traced_memory()[1] if self.memoria else None
+            if self.memoria:
+                tracemalloc.stop()
+
+        n = features(ret) if callable(features) else features
+        self.resultados.append({
+            "etapa": nome,
+            "features": n,
+            "segundos": round(dt, 4),
+            "features_s": round(n / dt) if n and dt else None,
+            "pico_mb": round(pico / 2**20, 1) if pico is not None else None,
+        })
+        return ret
+
+
+def _pares_geometria(diff):
+    """
+    Pares (antiga, nova) para geometry_diff_batch: os modificados; em
+    camadas ALL_FIELDS, removido e adicionado com as mesmas propriedades.
+    """
+
+    if diff["modified"]:
+        return [(m["old"].get("geometry"), m["new"].get("geometry")) for m in diff["modified"]]
+
+    por_props = {}
+    for f in diff["removed"]:
+        por_props.setdefault(json.dumps(f["properties"], sort_keys=True), []).append(f)
+
+    pares = []
+    for f in diff["added"]:
+        antigos = por_props.get(json.dumps(f["properties"], sort_keys=True))
+        if antigos:
+            pares.append((antigos.pop().get("geometry"), f.get("geometry")))
+    return pares
+
+
+def bench_pipeline(arquetipo, n, add, rem, edit, vertices, formato, seed, memoria):
+    """Uma auditoria completa (snapshot antigo -> novo) sobre dados sintéticos."""
+
+    layer = layer_de(arquetipo)
+    regras = bg.AUDIT_RULES.get(layer, {})
+    ignore_fields = bg.ignore_fields_de(layer)
+    etapas = Etapas(memoria)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        store_original = bg.STORE
+        bg.STORE = criar_store(formato, tmp)
+
+        try:
+            etapas.medir(
+                "gerar (referência)",
+                lambda: sum(1 for _ in gerar_camada(arquetipo, n, seed, vertices)),
+                lambda total: total,
+            )
+
+            antigo = etapas.medir(
+                "spool antigo (hash + gravação)",
+                lambda: bg.gravar_spool(layer, gerar_camada(arquetipo, n, seed, vertices), tmp/"antigo.tmp"),
+                lambda s: s["total"],
+            )
+            etapas.medir("promover antigo", lambda: bg.STORE.promover(layer, antigo), n)
+
+            old_index = etapas.medir(
+                "build_index", lambda: bg.build_index(layer, ignore_fields), n
+            )
+
+            novo = etapas.medir(
+                "spool novo (hash + gravação)",
+                lambda: bg.gravar_spool(
+                    layer,
+                    gerar_versao(arquetipo, n, add, rem, edit, seed, vertices),
+                    tmp/"novo.tmp",
+                ),
+                lambda s: s["total"],
+            )
+
+            added, removed = etapas.medir(
+                "diff de hashes",
+                lambda: (
+                    set(novo["indice"]) - set(old_index),
+                    set(old_index) - set(novo["indice"]),
+                ),
+                len(old_index) + len(novo["indice"]),
+            )
+
+            registros = Registros()
+
+            old_feats = etapas.medir(
+                "carregar removidos",
+                lambda: bg.carregar_features(layer, removed, old_index, ignore_fields, registros),
+                lambda r: sum(map(len, r.values())),
+            )
+
+            novo["indice"] = etapas.medir(
+                "promover novo", lambda: bg.STORE.promover(layer, novo), novo["total"]
+            )
+
+            new_feats = etapas.medir(
+                "carregar adicionados",
+                lambda: bg.carregar_features(layer, added, novo["indice"], ignore_fields, registros),
+                lambda r: sum(map(len, r.values())),
+            )
+
+            old_list = [f for feats in old_feats.values() for f in feats]
+            new_list = [f for feats in new_feats.values() for f in feats]
+
+            diff = etapas.medir(
+                "diff_by_identity",
+                lambda: diff_by_identity(old_list, new_list, regras.get("identity"), ignore_fields),
+                len(old_list) + len(new_list),
+            )
+
+            etapas.medir(
+                "agregador",
+                lambda: Agregador(bg.AUDIT_RULES).adicionar(layer, diff),
+                len(diff["added"]) + len(diff["removed"]) + len(diff["modified"]),
+            )
+
+            pares = _pares_geometria(diff)
+            etapas.medir(
+                "geometry_diff_batch",
+                lambda: geometry_diff_batch([a for a, _ in pares], [b for _, b in pares]),
+                len(pares),
+            )
+
+            # impressões digitais já guardadas (.geo): só o diff conta
+            fps = [(geometry_fingerprint(a), geometry_fingerprint(b)) for a, b in pares]
+            etapas.medir(
+                "geometry_diff_batch (impressões)",
+                lambda: geometry_diff_batch(
+                    [a for a, _ in pares], [b for _, b in pares],
+                    [a for a, _ in fps], [b for _, b in fps],
+                ),
+                len(pares),
+            )
+
+        finally:
+            bg.STORE = store_original
+
+    return {
+        "arquetipo": arquetipo,
+        "layer": layer,
+        "n": n,
+        "taxas": {"add": add, "rem": rem, "edit": edit},
+        "vertices": vertices if arquetipo == "itinerario" else None,
+        "formato": formato,
+        "seed": seed,
+        "diff": {
+            "added": len(diff["added"]),
+            "removed": len(diff["removed"]),
+            "modified": len(diff["modified"]),
+        },
+        "etapas": etapas.resultados,
+    }
+
+
+def imprimir(resultado):
+
+    d = resultado["diff"]
+    print(
+        f"{resultado['arquetipo']} – {resultado['n']:,} features "
+        f"({resultado['formato']}): +{d['added']:,} | -{d['removed']:,} | ~{d['modified']:,}"
+    )
+
+    for e in resultado["etapas"]:
+        fs = f"{e['features_s']:>12,}/s" if e["features_s"] else f"{'':>14}"
+        pico = f"{e['pico_mb']:>9,.1f} MB" if e["pico_mb"] is not None else ""
+        print(f"  {e['etapa']:<32} {e['features'] or 0:>11,} {e['segundos']:>9.3f}s {fs} {pico}")
+
+    print()
+
+
+LIMIAR_REGRESSAO = 1.2
+
+
+def comparar(resultados, base):
+    """Etapas com tempo ou memória > LIMIAR_REGRESSAO x o resultado base."""
+
+    def chave(r):
+        return (r["arquetipo"], r["n"], r["formato"])
+
+    anteriores = {chave(r): r for r in base}
+    regressoes = []
+
+    for r in resultados:
+        anterior = anteriores.get(chave(r))
+        if not anterior:
+            continue
+        etapas = {e["etapa"]: e for e in anterior["etapas"]}
+        for e in r["etapas"]:
+            a = etapas.get(e["etapa"])
+            if not a:
+                continue
+            for campo in ("segundos", "pico_mb"):
+                if e[campo] and a[campo] and e[campo] > a[campo] * LIMIAR_REGRESSAO:
+                    regressoes.append(
+                        f"{r['arquetipo']} n={r['n']:,} {e['etapa']}: "
+                        f"{campo} {a[campo]} -> {e[campo]}"
+                    )
+
+    return regressoes
+
+
+def main_pipeline(argv):
+
+    ap = argparse.ArgumentParser(prog="benchmark.py pipeline")
+    ap.add_argument("--arquetipo", default=",".join(ARQUETIPOS))
+    ap.add_argument("--n", default="10000,100000")
+    ap.add_argument("--add", type=float, default=1.0, help="%% de features adicionadas")
+    ap.add_argument("--rem", type=float, default=1.0, help="%% de features removidas")
+    ap.add_argument("--edit", type=float, default=2.0, help="%% de features editadas")
+    ap.add_argument("--vertices", type=int, default=200)
+    ap.add_argument("--formato", choices=sorted(STORES), default=bg.CONFIG.get("snapshot_format", "geojson"))
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--sem-memoria", action="store_true")
+    ap.add_argument("--saida")
+    ap.add_argument("--comparar")
+    args = ap.parse_args(argv)
+
+    resultados = []
+
+    for arquetipo in args.arquetipo.split(","):
+        for n in (int(x) for x in args.n.split(",")):
+            r = bench_pipeline(
+                arquetipo, n, args.add, args.rem, args.edit,
+                args.vertices, args.formato, args.seed, not args.sem_memoria,
+            )
+            imprimir(r)
+            resultados.append(r)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=1)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regressoes = comparar(resultados, json.load(f))
+        for linha in regressoes:
+            print(f"⚠️ regressão: {linha}")
+        if regressoes:
+            sys.exit(1)
+
+
+# ============================================================
+# EXECUÇÃO
+# ============================================================
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "pipeline":
+        main_pipeline(sys.argv[2:])
+
+    else:
+        n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+        bench_hash(n, max(1, n // 100))
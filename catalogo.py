@@ -0,0 +1,405 @@
+# ============================================================
+# CATÁLOGO DE CAMADAS (GETCAPABILITIES + ESQUEMAS)
+# ============================================================
+#
+# Uma passada por execução descobre o que o GeoServer publica:
+#
+#   GetCapabilities             nome técnico, título e extensão (WGS84)
+#   DescribeFeatureType         campos e tipos de todas as camadas numa
+#                               única requisição (typeNames=a,b,c...);
+#                               camada que faltar na resposta em lote
+#                               vem numa requisição própria
+#
+# Tudo fica em downloads/catalogo.json. Revalidação barata:
+#
+#   - dentro de "max_age_minutes" nada vai ao servidor
+#   - GetCapabilities condicional (ETag/Last-Modified); 304 ou o mesmo
+#     conteúdo (impressão SHA-256) mantém as camadas do cache
+#   - esquemas em lote com a mesma impressão não são reparseados
+#
+# Mudanças em relação ao cache viram eventos de auditoria (tipo
+# "esquema": campos adicionados, removidos ou com tipo trocado; "nova" e
+# "removida": camada que entrou ou saiu do GetCapabilities), gravados em
+# downloads/catalogo_eventos.jsonl e devolvidos a quem chamou (Teams,
+# métricas). O primeiro catálogo só cria a base, sem eventos.
+#
+# Jobs e audit_rules do config.json podem usar o nome técnico
+# (semob:terminais_onibus) ou "workspace:Título" (semob:Terminais de
+# ônibus): resolver() devolve sempre o nome técnico.
+#
+# Uso:
+#   python catalogo.py [downloads/catalogo.json]   -> lista o catálogo
+
+import hashlib
+import json
+import os
+import time
+import unicodedata
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+VERSAO = 1
+
+GEOMETRIAS = {"geom", "geometry", "the_geom"}
+
+
+def _impressao(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def _chave(nome):
+    """Nome comparável: sem acento, caixa e espaços repetidos."""
+    texto = unicodedata.normalize("NFKD", nome).encode("ascii", "ignore").decode()
+    return " ".join(texto.casefold().split())
+
+
+def _local(nome):
+    return nome.split(":", 1)[-1]
+
+
+# ============================================================
+# PARSE
+# ============================================================
+
+def ler_capabilities(conteudo):
+    """{nome: {"titulo", "extensao"}} do GetCapabilities, na ordem do documento."""
+
+    camadas = {}
+
+    for tipo in ET.fromstring(conteudo).iterfind(".//{*}FeatureType"):
+
+        nome = (tipo.findtext("{*}Name") or "").strip()
+        if not nome:
+            continue
+
+        extensao = None
+        caixa = tipo.find("{*}WGS84BoundingBox")
+        if caixa is not None:
+            minx, miny = map(float, caixa.findtext("{*}LowerCorner").split())
+            maxx, maxy = map(float, caixa.findtext("{*}UpperCorner").split())
+            extensao = [minx, miny, maxx, maxy]
+
+        camadas[nome] = {
+            "titulo": (tipo.findtext("{*}Title") or "").strip(),
+            "extensao": extensao,
+        }
+
+    return camadas
+
+
+def ler_esquemas(conteudo):
+    """
+    {nome local do elemento: {campo: tipo}} de um XSD do DescribeFeatureType
+    (uma ou várias camadas), campos na ordem do esquema.
+    """
+
+    raiz = ET.fromstring(conteudo)
+
+    tipos = {}
+    for complexo in raiz.iterfind("{*}complexType"):
+        tipos[complexo.get("name")] = {
+            el.get("name"): el.get("type") or ""
+            for el in complexo.iterfind(".//{*}element")
+            if el.get("name")
+        }
+
+    esquemas = {}
+    for el in raiz.iterfind("{*}element"):
+        tipo = _local(el.get("type") or "")
+        if el.get("name") and tipo in tipos:
+            esquemas[el.get("name")] = tipos[tipo]
+
+    return esquemas
+
+
+def comparar(antigo, novo):
+    """Campos adicionados, removidos e com tipo trocado (vazio = igual)."""
+
+    mudancas = {
+        "adicionados": {c: t for c, t in novo.items() if c not in antigo},
+        "removidos": {c: t for c, t in antigo.items() if c not in novo},
+        "alterados": {
+            c: [antigo[c], t] for c, t in novo.items()
+            if c in antigo and antigo[c] != t
+        },
+    }
+
+    return {k: v for k, v in mudancas.items() if v}
+
+
+def descrever(evento):
+    """Uma linha legível do evento (log e Teams)."""
+
+    if evento["tipo"] == "nova":
+        return f"{evento['camada']}: camada nova no GetCapabilities"
+
+    if evento["tipo"] == "removida":
+        return f"{evento['camada']}: camada saiu do GetCapabilities"
+
+    partes = [f"+{c} ({t})" for c, t in evento.get("adicionados", {}).items()]
+    partes += [f"−{c}" for c in evento.get("removidos", {})]
+    partes += [f"{c}: {de} → {para}" for c, (de, para) in evento.get("alterados", {}).items()]
+
+    return f"{evento['camada']}: " + ", ".join(partes)
+
+
+# ============================================================
+# CATÁLOGO
+# ============================================================
+
+class Catalogo:
+
+    def __init__(self, arquivo, log=print, max_idade_minutos=60):
+        self.arquivo = Path(arquivo)
+        self.eventos_path = self.arquivo.with_name(f"{self.arquivo.stem}_eventos.jsonl")
+        self.log = log
+        self.max_idade = max_idade_minutos * 60
+        self.dados = self._carregar()
+
+    def _carregar(self):
+        if not self.arquivo.exists():
+            return {}
+        try:
+            with open(self.arquivo, encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log(f"Catálogo ilegível ({e}), recriando")
+            return {}
+        return dados if dados.get("versao") == VERSAO else {}
+
+    def _gravar(self):
+        self.arquivo.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.arquivo.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.dados, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.arquivo)
+
+    # ========================================================
+    # CONSULTA
+    # ========================================================
+
+    def __bool__(self):
+        return bool(self.dados.get("camadas"))
+
+    def __contains__(self, layer):
+        return layer in self.dados.get("camadas", {})
+
+    def camadas(self):
+        """Nomes técnicos, na ordem do GetCapabilities."""
+        return list(self.dados.get("camadas", {}))
+
+    def resolver(self, nome):
+        """Nome técnico para o nome ou "workspace:Título" do config (None se não publicada)."""
+
+        camadas = self.dados.get("camadas", {})
+
+        if nome in camadas:
+            return nome
+
+        workspace = nome.split(":", 1)[0] if ":" in nome else None
+        chave = _chave(_local(nome))
+
+        for real, info in camadas.items():
+            if workspace and ":" in real and real.split(":", 1)[0] != workspace:
+                continue
+            if chave in (_chave(_local(real)), _chave(info.get("titulo") or "")):
+                return real
+
+        return None
+
+    def campos(self, layer):
+        """{campo: tipo} do DescribeFeatureType (None se desconhecido)."""
+        return self.dados.get("camadas", {}).get(layer, {}).get("campos")
+
+    def extensao(self, layer):
+        return self.dados.get("camadas", {}).get(layer, {}).get("extensao")
+
+    def sortby(self, layer):
+        """Primeiro campo simples (sem geometria), no formato do sortBy."""
+
+        for campo, tipo in (self.campos(layer) or {}).items():
+            if campo.lower() not in GEOMETRIAS and not tipo.startswith("gml:"):
+                return f"{campo} A"
+
+        return None
+
+    # ========================================================
+    # REVALIDAÇÃO
+    # ========================================================
+
+    def vencido(self):
+        return time.time() - self.dados.get("verificado", 0) >= self.max_idade
+
+    def atualizar(self, get, base_params, workers=2, forcar=False):
+        """
+        Revalida o catálogo se vencido (ou forcar). get(params, timeout,
+        headers) -> requests.Response; base_params: service/version.
+        Retorna os eventos de esquema desta revalidação. Servidor
+        indisponível mantém o cache (e a falha no log).
+        """
+
+        if not forcar and self.dados and not self.vencido():
+            return []
+
+        try:
+            camadas, caps = self._capabilities(get, base_params)
+            esquemas, lote = self._esquemas(get, base_params, camadas, workers)
+        except (requests.RequestException, ET.ParseError, ValueError, RuntimeError) as e:
+            self.log(f"Catálogo: revalidação falhou ({e}), usando o cache")
+            return []
+
+        antigo = self.dados.get("camadas", {})
+
+        for nome, info in camadas.items():
+            info["campos"] = esquemas.get(nome, (antigo.get(nome) or {}).get("campos"))
+
+        eventos = self._eventos(antigo, camadas) if self.dados else []
+
+        self.dados = {
+            "versao": VERSAO,
+            "verificado": time.time(),
+            "capabilities": caps,
+            "esquemas": lote,
+            "camadas": camadas,
+        }
+        self._gravar()
+
+        if eventos:
+            with open(self.eventos_path, "a", encoding="utf-8") as f:
+                for e in eventos:
+                    f.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+        return eventos
+
+    def _capabilities(self, get, base_params):
+        """(camadas, {"impressao", "validadores"}); 304/mesma impressão = camadas do cache."""
+
+        anterior = self.dados.get("capabilities", {})
+        headers = {}
+        if self.dados:
+            validadores = anterior.get("validadores", {})
+            if validadores.get("ETag"):
+                headers["If-None-Match"] = validadores["ETag"]
+            if validadores.get("Last-Modified"):
+                headers["If-Modified-Since"] = validadores["Last-Modified"]
+
+        r = get({**base_params, "request": "GetCapabilities"}, 60, headers)
+
+        copia = lambda: {n: {k: v for k, v in i.items() if k != "campos"} for n, i in self.dados["camadas"].items()}
+
+        if r.status_code == 304:
+            return copia(), anterior
+
+        if r.status_code != 200:
+            raise RuntimeError(f"GetCapabilities: {r.status_code}")
+
+        caps = {
+            "impressao": _impressao(r.content),
+            "validadores": {k: r.headers[k] for k in ("ETag", "Last-Modified") if r.headers.get(k)},
+        }
+
+        if self.dados and caps["impressao"] == anterior.get("impressao"):
+            return copia(), caps
+
+        return ler_capabilities(r.content), caps
+
+    def _esquemas(self, get, base_params, camadas, workers):
+        """
+        ({camada: {campo: tipo}}, {"impressao"}): um DescribeFeatureType
+        para todas; as que faltarem na resposta, uma a uma em paralelo.
+        Mesma impressão do lote anterior = esquemas do cache.
+        """
+
+        nomes = list(camadas)
+        anterior = self.dados.get("esquemas", {})
+
+        if not nomes:
+            return {}, {}
+
+        r = get({**base_params, "request": "DescribeFeatureType", "typeNames": ",".join(nomes)}, 120, None)
+
+        lote = {"impressao": _impressao(r.content) if r.status_code == 200 else None}
+
+        if lote["impressao"] and lote["impressao"] == anterior.get("impressao") and self.dados:
+            cache = self.dados.get("camadas", {})
+            if all((cache.get(n) or {}).get("campos") is not None for n in nomes):
+                return {n: cache[n]["campos"] for n in nomes}, lote
+
+        try:
+            por_local = ler_esquemas(r.content) if r.status_code == 200 else {}
+        except ET.ParseError:
+            por_local = {}
+
+        esquemas = {n: por_local[_local(n)] for n in nomes if _local(n) in por_local}
+
+        faltando = [n for n in nomes if n not in esquemas]
+
+        def uma(nome):
+            resposta = get({**base_params, "request": "DescribeFeatureType", "typeNames": nome}, 60, None)
+            if resposta.status_code != 200:
+                return nome, None
+            try:
+                esquemas = ler_esquemas(resposta.content)
+            except ET.ParseError:
+                return nome, None
+            # elemento com outro nome (ex.: caracteres escapados): o único do XSD
+            if _local(nome) not in esquemas and len(esquemas) == 1:
+                return nome, next(iter(esquemas.values()))
+            return nome, esquemas.get(_local(nome))
+
+        if faltando:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for nome, campos in pool.map(uma, faltando):
+                    if campos is not None:
+                        esquemas[nome] = campos
+            self.log(f"Catálogo: {len(faltando)} esquema(s) fora do lote, {len(esquemas)} de {len(nomes)} obtidos")
+
+        return esquemas, lote
+
+    def _eventos(self, antigo, novo):
+
+        hoje = datetime.now().isoformat(timespec="seconds")
+        eventos = []
+
+        for nome in novo:
+            if nome not in antigo:
+                eventos.append({"tipo": "nova", "camada": nome, "quando": hoje})
+                continue
+            de, para = antigo[nome].get("campos"), novo[nome].get("campos")
+            if de is None or para is None:
+                continue
+            mudancas = comparar(de, para)
+            if mudancas:
+                eventos.append({"tipo": "esquema", "camada": nome, "quando": hoje, **mudancas})
+
+        for nome in antigo:
+            if nome not in novo:
+                eventos.append({"tipo": "removida", "camada": nome, "quando": hoje})
+
+        return eventos
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+if __name__ == "__main__":
+
+    import sys
+
+    catalogo = Catalogo(sys.argv[1] if len(sys.argv) > 1 else "downloads/catalogo.json")
+
+    if not catalogo:
+        sys.exit("catálogo vazio (rode a auditoria uma vez)")
+
+    verificado = datetime.fromtimestamp(catalogo.dados["verificado"])
+    print(f"{len(catalogo.camadas())} camadas, verificado em {verificado:%d/%m/%Y %H:%M}")
+
+    for nome in catalogo.camadas():
+        info = catalogo.dados["camadas"][nome]
+        campos = info.get("campos")
+        print(f"{nome}  [{info.get('titulo')}]  {len(campos) if campos is not None else '?'} campos")
@@ -0,0 +1,452 @@
+# ============================================================
+# DIFF EM DISCO (CAMADAS MAIORES QUE A MEMÓRIA)
+# ============================================================
+#
+# Índice em disco = arquivo de registros fixos de 24 bytes, ordenados:
+#
+#   por hash: digest (16 bytes) | locator (8 bytes, big-endian)
+#   por loc:  locator (8 bytes, big-endian) | digest (16 bytes)
+#
+# Com o locator em big-endian a ordem dos bytes é a ordem numérica, então
+# ordenar registros = ordenar bytes. OrdenadorExterno acumula registros
+# até o orçamento de memória, despeja runs ordenadas em arquivos
+# temporários e junta tudo com heapq.merge no final. juntar() faz o
+# merge-join de dois índices ordenados por hash em streaming.
+#
+# As features alteradas são distribuídas em partições pela chave de
+# identidade (mesma identidade -> mesma partição), com um número de
+# partições que faz cada uma caber no orçamento na hora do pareamento.
+#
+# Impressões digitais das geometrias grandes ficam num arquivo .geo ao
+# lado do índice: uma linha "hash impressão-JSON" por hash, ordenadas
+# (a ordem dos bytes da linha é a ordem do hash, como nos registros).
+
+import heapq
+import json
+import mmap
+import os
+import tempfile
+import zlib
+from bisect import bisect_left
+from pathlib import Path
+
+from audit_utils import identity_key
+
+REGISTRO = 24
+DIGEST = 16
+
+# custo aproximado de um registro num list[bytes] (objeto bytes + ponteiro)
+CUSTO_REGISTRO = 72
+# idem para uma linha do .geo (~100 bytes de texto)
+CUSTO_LINHA = 200
+
+BLOCO = REGISTRO * 4096
+
+
+def empacotar(h, loc):
+    return bytes.fromhex(h) + loc.to_bytes(8, "big")
+
+
+def hash_de(registro):
+    return registro[:DIGEST].hex()
+
+
+def loc_de(registro):
+    return int.from_bytes(registro[DIGEST:], "big")
+
+
+def por_loc(registro):
+    """hash|loc -> loc|hash (para ordenar por locator)."""
+    return registro[DIGEST:] + registro[:DIGEST]
+
+
+# ============================================================
+# ARQUIVOS DE REGISTROS
+# ============================================================
+
+def ler_registros(path):
+    with open(path, "rb") as f:
+        while True:
+            bloco = f.read(BLOCO)
+            if not bloco:
+                return
+            for i in range(0, len(bloco), REGISTRO):
+                yield bloco[i:i + REGISTRO]
+
+
+def gravar_registros(path, registros):
+    n = 0
+    buf = bytearray()
+    with open(path, "wb") as f:
+        for r in registros:
+            buf += r
+            n += 1
+            if len(buf) >= BLOCO:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
+    return n
+
+
+def agrupar(registros):
+    """(hash, [locators]) de registros ordenados por hash."""
+
+    atual = None
+    locs = []
+
+    for r in registros:
+        d = r[:DIGEST]
+        if d != atual:
+            if atual is not None:
+                yield atual.hex(), locs
+            atual, locs = d, []
+        locs.append(loc_de(r))
+
+    if atual is not None:
+        yield atual.hex(), locs
+
+
+def ler_linhas(path):
+    with open(path, "rb") as f:
+        yield from f
+
+
+def gravar_linhas(path, linhas):
+    """Linhas ordenadas; repetidas (mesmo hash, mesma impressão) saem uma vez."""
+
+    n = 0
+    anterior = None
+    with open(path, "wb") as f:
+        for linha in linhas:
+            if linha != anterior:
+                f.write(linha)
+                anterior = linha
+                n += 1
+    return n
+
+
+class OrdenadorExterno:
+    """Ordenação externa de registros de 24 bytes com memória limitada."""
+
+    custo = CUSTO_REGISTRO
+    _gravar = staticmethod(gravar_registros)
+    _ler = staticmethod(ler_registros)
+
+    def __init__(self, pasta, orcamento_bytes):
+        self.pasta = Path(pasta)
+        self.limite = max(1024, orcamento_bytes // self.custo)
+        self.buffer = []
+        self.runs = []
+
+    def adicionar(self, registro):
+        self.buffer.append(registro)
+        if len(self.buffer) >= self.limite:
+            self._despejar()
+
+    def _despejar(self):
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        fd, nome = tempfile.mkstemp(prefix="run_", suffix=".bin", dir=self.pasta)
+        os.close(fd)
+        self._gravar(nome, self.buffer)
+        self.runs.append(Path(nome))
+        self.buffer = []
+
+    def finalizar(self, destino):
+        """Grava o resultado ordenado em destino; retorna o número de registros."""
+
+        if not self.runs:
+            self.buffer.sort()
+            n = self._gravar(destino, self.buffer)
+            self.buffer = []
+            return n
+
+        self._despejar()
+
+        try:
+            return self._gravar(destino, heapq.merge(*map(self._ler, self.runs)))
+        finally:
+            for run in self.runs:
+                run.unlink(missing_ok=True)
+            self.runs = []
+
+    def descartar(self):
+        self.buffer = []
+        for run in self.runs:
+            run.unlink(missing_ok=True)
+        self.runs = []
+
+
+class OrdenadorLinhas(OrdenadorExterno):
+    """OrdenadorExterno para as linhas de um .geo."""
+
+    custo = CUSTO_LINHA
+    _gravar = staticmethod(gravar_linhas)
+    _ler = staticmethod(ler_linhas)
+
+
+def ordenar(registros, destino, pasta, orcamento_bytes):
+    ordenador = OrdenadorExterno(pasta, orcamento_bytes)
+    try:
+        for r in registros:
+            ordenador.adicionar(r)
+        return ordenador.finalizar(destino)
+    except BaseException:
+        ordenador.descartar()
+        raise
+
+
+def hashes_por_loc(idx, pasta, orcamento_bytes):
+    """(locator, hash) de um índice ordenado por hash, em ordem de locator."""
+
+    fd, nome = tempfile.mkstemp(prefix="loc_", suffix=".bin", dir=pasta)
+    os.close(fd)
+
+    try:
+        ordenar(map(por_loc, ler_registros(idx)), nome, pasta, orcamento_bytes)
+        for r in ler_registros(nome):
+            yield int.from_bytes(r[:8], "big"), r[8:].hex()
+    finally:
+        os.unlink(nome)
+
+
+def juntar_indices(partes, destino):
+    """k-way merge de índices ordenados por hash, cada um com deslocamento nos locators."""
+
+    def deslocados(path, desloc):
+        for r in ler_registros(path):
+            yield r[:DIGEST] + (loc_de(r) + desloc).to_bytes(8, "big") if desloc else r
+
+    return gravar_registros(destino, heapq.merge(*(deslocados(p, d) for p, d in partes)))
+
+
+def hash_repetido(fontes):
+    """
+    Primeiro hash presente em mais de uma fonte (iteráveis de hashes
+    distintos e ordenados, ex.: índices de páginas); None se nenhum.
+    """
+
+    anterior = None
+
+    for h in heapq.merge(*fontes):
+        if h == anterior:
+            return h
+        anterior = h
+
+    return None
+
+
+def remapear(idx, offsets_path, destino):
+    """
+    Troca offsets do spool por números de linha: offsets_path é um int64
+    com os offsets em ordem de linha (a posição é o novo locator). A
+    troca é monotônica, então a ordem (hash, locator) se mantém.
+    """
+
+    with open(offsets_path, "rb") as f:
+        if Path(offsets_path).stat().st_size == 0:
+            return gravar_registros(destino, ())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = memoryview(mm).cast("q")
+            try:
+                return gravar_registros(destino, (
+                    r[:DIGEST] + bisect_left(offsets, loc_de(r)).to_bytes(8, "big")
+                    for r in ler_registros(idx)
+                ))
+            finally:
+                offsets.release()
+
+
+# ============================================================
+# IMPRESSÕES DIGITAIS (.geo)
+# ============================================================
+
+def linha_impressao(h, fp):
+    return f"{h} {json.dumps(fp, separators=(',', ':'))}\n".encode("utf-8")
+
+
+def ler_impressoes(path, hashes=None):
+    """(hash, impressão) do .geo; com hashes, só as desses hashes."""
+
+    for linha in ler_linhas(path):
+        h = linha[:2 * DIGEST].decode()
+        if hashes is None or h in hashes:
+            yield h, json.loads(linha[2 * DIGEST + 1:])
+
+
+def impressoes_de(path, registros):
+    """
+    Linhas do .geo cujo hash está em registros (ordenados por hash):
+    merge-join em streaming, sem carregar nenhum dos dois.
+    """
+
+    hashes = (h for h, _ in agrupar(ler_registros(registros)))
+    alvo = next(hashes, None)
+
+    for linha in ler_linhas(path):
+        h = linha[:2 * DIGEST].decode()
+        while alvo is not None and alvo < h:
+            alvo = next(hashes, None)
+        if alvo is None:
+            return
+        if alvo == h:
+            yield linha
+
+
+def juntar_impressoes(fontes, destino):
+    """k-way merge de fontes de linhas do .geo já ordenadas."""
+
+    return gravar_linhas(destino, heapq.merge(*fontes))
+
+
+# ============================================================
+# MERGE-JOIN
+# ============================================================
+
+def juntar(antigo, novo, pasta):
+    """
+    Merge-join de dois índices ordenados por hash.
+    Grava os registros removidos (hash só no antigo) e adicionados (hash
+    só no novo) em arquivos na pasta e devolve
+    {"removidos", "adicionados", "n_rem", "n_add", "mult"}.
+    mult: hash -> nova multiplicidade quando o hash existe dos dois lados
+    com contagem diferente.
+    """
+
+    pasta = Path(pasta)
+    removidos = pasta/"removidos.bin"
+    adicionados = pasta/"adicionados.bin"
+    mult = {}
+    n_rem = n_add = 0
+
+    a = agrupar(ler_registros(antigo))
+    b = agrupar(ler_registros(novo))
+    ga = next(a, None)
+    gb = next(b, None)
+
+    with open(removidos, "wb") as fr, open(adicionados, "wb") as fa:
+        while ga is not None or gb is not None:
+            if gb is None or (ga is not None and ga[0] < gb[0]):
+                for loc in ga[1]:
+                    fr.write(empacotar(ga[0], loc))
+                    n_rem += 1
+                ga = next(a, None)
+            elif ga is None or gb[0] < ga[0]:
+                for loc in gb[1]:
+                    fa.write(empacotar(gb[0], loc))
+                    n_add += 1
+                gb = next(b, None)
+            else:
+                if len(ga[1]) != len(gb[1]):
+                    mult[gb[0]] = len(gb[1])
+                ga = next(a, None)
+                gb = next(b, None)
+
+    return {
+        "removidos": removidos,
+        "adicionados": adicionados,
+        "n_rem": n_rem,
+        "n_add": n_add,
+        "mult": mult,
+    }
+
+
+# ============================================================
+# PARTIÇÕES DE FEATURES ALTERADAS
+# ============================================================
+
+def particao_de(feature, h, identidade, n):
+    """Mesma identidade -> mesma partição (sem identidade: pelo hash)."""
+
+    if n == 1:
+        return 0
+
+    if isinstance(identidade, str) and identidade != "ALL_FIELDS":
+        identidade = [identidade]
+
+    if identidade and identidade != "ALL_FIELDS":
+        chave = identity_key(feature.get("properties") or {}, identidade)
+        if any(v is not None for v in chave):
+            return zlib.crc32(repr(chave).encode("utf-8")) % n
+
+    return int(h[:8], 16) % n
+
+
+class Particoes:
+    """Features alteradas ("old"/"new") em n arquivos JSON lines."""
+
+    def __init__(self, pasta, n, identidade):
+        self.pasta = Path(pasta)
+        self.n = n
+        self.identidade = identidade
+
+    def _arquivo(self, lado, i):
+        return self.pasta/f"{lado}_{i}.jsonl"
+
+    def gravar(self, lado, itens):
+        """itens: (hash, feature). Retorna quantas features foram gravadas."""
+
+        saidas = [open(self._arquivo(lado, i), "w", encoding="utf-8") for i in range(self.n)]
+        n = 0
+
+        try:
+            for h, feat in itens:
+                i = particao_de(feat, h, self.identidade, self.n)
+                saidas[i].write(json.dumps({"h": h, "f": feat}, ensure_ascii=False))
+                saidas[i].write("\n")
+                n += 1
+        finally:
+            for f in saidas:
+                f.close()
+
+        return n
+
+    def ler(self, lado, i, registros=None):
+        """[(hash, feature)] da partição i; com registros, feature = Registro."""
+
+        converter = registros.de_feature if registros else (lambda feat: feat)
+
+        with open(self._arquivo(lado, i), encoding="utf-8") as f:
+            return [(item["h"], converter(item["f"])) for item in map(json.loads, f)]
+
+    def agrupado(self, lado):
+        """(hash, [features]) partição a partição (mesmo hash, mesma partição)."""
+
+        for i in range(self.n):
+            grupos = {}
+            for h, feat in self.ler(lado, i):
+                grupos.setdefault(h, []).append(feat)
+            yield from grupos.items()
+
+
+def n_particoes(n_features, bytes_por_feature, orcamento_bytes):
+    """
+    Partições para que old + new de uma partição caibam no orçamento
+    (objetos Python ~ 4x o JSON em disco).
+    """
+    estimativa = n_features * bytes_por_feature * 4
+    return max(1, -(-estimativa // max(1, orcamento_bytes // 2)))
+
+
+def ler_por_loc(registros, ler_em, lote):
+    """
+    (hash, feature) de registros ordenados por loc, relendo do store em
+    lotes de até `lote` locators (ler_em: locators -> {loc: feature}).
+    """
+
+    pendentes = []
+
+    def despejar():
+        feats = ler_em([loc for _, loc in pendentes])
+        for h, loc in pendentes:
+            yield h, feats[loc]
+        pendentes.clear()
+
+    for r in registros:
+        pendentes.append((r[8:].hex(), int.from_bytes(r[:8], "big")))
+        if len(pendentes) >= lote:
+            yield from despejar()
+
+    if pendentes:
+        yield from despejar()
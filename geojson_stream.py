@@ -0,0 +1,224 @@
+import codecs
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# --------------------------------------------------
+# Formato de snapshot (uma feature por linha)
+# --------------------------------------------------
+
+# Continua sendo um FeatureCollection válido, mas cada feature ocupa uma
+# linha própria: o offset em bytes da linha basta para reler a feature.
+
+SNAPSHOT_HEAD = b'{"type":"FeatureCollection","features":[\n'
+SNAPSHOT_TAIL = b'\n]}\n'
+
+CHUNK_SIZE = 1 << 16
+
+
+class SnapshotWriter:
+    """Grava features uma a uma; write() devolve o offset da linha."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.f = open(self.path, "wb")
+        self.f.write(SNAPSHOT_HEAD)
+        self.total = 0
+
+    def write(self, feature: Dict[str, Any]) -> int:
+        return self.write_raw(json.dumps(feature, ensure_ascii=False).encode("utf-8"))
+
+    def write_raw(self, data: bytes) -> int:
+        """Grava uma feature já serializada (JSON UTF-8, uma linha)."""
+        if self.total:
+            self.f.write(b",\n")
+        offset = self.f.tell()
+        self.f.write(data)
+        self.total += 1
+        return offset
+
+    def close(self) -> None:
+        self.f.write(SNAPSHOT_TAIL)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+def is_line_snapshot(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(SNAPSHOT_HEAD)) == SNAPSHOT_HEAD
+
+
+def read_feature_at(f, offset: int) -> Dict[str, Any]:
+    f.seek(offset)
+    line = f.readline().rstrip(b"\r\n")
+    if line.endswith(b","):
+        line = line[:-1]
+    return json.loads(line)
+
+
+def concat_snapshots(parts: List[Path], dest: Path) -> List[int]:
+    """
+    Concatena snapshots em formato de linha sem reparsear as features.
+    Retorna, para cada parte, o deslocamento a somar aos seus offsets.
+    """
+
+    shifts = []
+
+    with open(dest, "wb") as out:
+        out.write(SNAPSHOT_HEAD)
+        first = True
+
+        for part in parts:
+            size = part.stat().st_size - len(SNAPSHOT_HEAD) - len(SNAPSHOT_TAIL)
+
+            if size <= 0:
+                shifts.append(0)
+                continue
+
+            if not first:
+                out.write(b",\n")
+            first = False
+
+            shifts.append(out.tell() - len(SNAPSHOT_HEAD))
+
+            with open(part, "rb") as src:
+                src.seek(len(SNAPSHOT_HEAD))
+                while size:
+                    buf = src.read(min(CHUNK_SIZE, size))
+                    if not buf:
+                        break
+                    out.write(buf)
+                    size -= len(buf)
+
+        out.write(SNAPSHOT_TAIL)
+
+    return shifts
+
+
+# --------------------------------------------------
+# Parser incremental de FeatureCollection
+# --------------------------------------------------
+
+def iter_features(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """
+    Lê o array "features" de um FeatureCollection a partir de blocos de
+    bytes (corpo HTTP ou arquivo), sem carregar o documento inteiro.
+    A memória fica limitada à maior feature individual.
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    source = iter(chunks)
+
+    buf = ""
+    pos = 0
+    eof = False
+
+    def more(minimum: int = 1) -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        pieces = [buf[pos:]]
+        read = 0
+        while read < minimum:
+            try:
+                chunk = next(source)
+            except StopIteration:
+                pieces.append(utf8.decode(b"", final=True))
+                eof = True
+                break
+            text = utf8.decode(chunk)
+            pieces.append(text)
+            read += len(text)
+        buf = "".join(pieces)
+        pos = 0
+        return read > 0 or bool(pieces[-1])
+
+    # localiza "features": [
+    while True:
+        i = buf.find('"features"', pos)
+        if i >= 0:
+            pos = i + len('"features"')
+            break
+        pos = max(0, len(buf) - len('"features"'))
+        if not more():
+            raise ValueError("GeoJSON sem array 'features'")
+
+    for expected in ":[":
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                break
+            if not more():
+                raise ValueError("GeoJSON truncado")
+        if buf[pos] != expected:
+            raise ValueError("GeoJSON com 'features' inválido")
+        pos += 1
+
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+            pos += 1
+
+        if pos >= len(buf):
+            if not more():
+                raise ValueError("GeoJSON truncado")
+            continue
+
+        if buf[pos] == "]":
+            return
+
+        try:
+            feature, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # feature incompleta: lê ao menos o mesmo tanto que já há no buffer
+            if not more(max(CHUNK_SIZE, len(buf) - pos)):
+                raise ValueError("GeoJSON truncado")
+            continue
+
+        pos = end
+        yield feature
+
+
+def iter_file_chunks(path: Path) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def read_snapshot(path: Path) -> Iterator[Tuple[Optional[int], Dict[str, Any]]]:
+    """
+    Itera (offset, feature) de um snapshot.
+    Snapshots antigos (json.dump de uma linha) não têm offset -> None.
+    """
+
+    if not is_line_snapshot(path):
+        for feature in iter_features(iter_file_chunks(path)):
+            yield None, feature
+        return
+
+    with open(path, "rb") as f:
+        f.seek(len(SNAPSHOT_HEAD))
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                return
+            line = line.rstrip(b"\r\n")
+            if line.endswith(b","):
+                line = line[:-1]
+            if not line or line == b"]}":
+                continue
+            yield offset, json.loads(line)
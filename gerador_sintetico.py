@@ -0,0 +1,211 @@
+# ============================================================
+# GERADOR DE CAMADAS SINTÉTICAS – SEMOB DF
+# ============================================================
+#
+# Camadas de tamanho e taxa de mudança controlados, determinísticas pela
+# seed, para medir o pipeline sem depender do GeoServer.
+#
+# Cada arquétipo gera a feature i a partir de um fluxo aleatório
+# sequencial. A versão "nova" consome o mesmo fluxo da "antiga" e tira
+# remoções/edições de um segundo fluxo, então as duas versões são
+# geradas em streaming, sem manter a camada em memória.
+#
+# Para uma sequência de versões (servidor_wfs_local.py), mutar() aplica
+# um passo de add/rem/edit sobre a versão anterior, com seed própria do
+# passo: cada versão difere da anterior só pelas taxas pedidas.
+
+import random
+
+
+OPERADORAS = [
+    "Viação Piracicabana",
+    "Viação Pioneira",
+    "Urbi Mobilidade Urbana",
+    "Auto Viação Marechal",
+    "São José",
+]
+
+
+# ============================================================
+# ARQUÉTIPOS
+# ============================================================
+
+def _frota(i, rnd, vertices):
+    return {
+        "type": "Feature",
+        "id": f"frota.{i}",
+        "properties": {
+            "FID": i,
+            "id_frota": i,
+            "operadora": rnd.choice(OPERADORAS),
+            "numero_veiculo": str(100000 + i),
+            "placa_veiculo": f"{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}"
+                             f"{chr(65 + i // 676 % 26)}{i % 10000:04d}",
+            "data_referencia": "2026-10-01",
+        },
+        "geometry": None,
+    }
+
+
+def _editar_frota(feat, rnd):
+    p = feat["properties"]
+    p["operadora"] = rnd.choice([o for o in OPERADORAS if o != p["operadora"]])
+
+
+def _horario(i, rnd, vertices):
+    return {
+        "type": "Feature",
+        "id": f"horarios.{i}",
+        "properties": {
+            "fid": i,
+            "nm_operadora": rnd.choice(OPERADORAS),
+            "cd_linha": f"{rnd.randint(0, 999)}.{rnd.randint(1, 9)}",
+            "hr_prevista": f"{rnd.randint(4, 23):02d}:{rnd.randint(0, 59):02d}",
+            "sentido": rnd.choice(["IDA", "VOLTA"]),
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [-47.9 + rnd.random(), -15.8 + rnd.random()],
+        },
+    }
+
+
+def _editar_horario(feat, rnd):
+    p = feat["properties"]
+    h, m = map(int, p["hr_prevista"].split(":"))
+    m += rnd.choice([5, 10, 15])
+    p["hr_prevista"] = f"{(h + m // 60) % 24:02d}:{m % 60:02d}"
+
+
+def _itinerario(i, rnd, vertices):
+    x, y = -47.9 + rnd.random(), -15.8 + rnd.random()
+    coords = []
+    for _ in range(vertices):
+        x += rnd.uniform(-1e-4, 1e-4)
+        y += rnd.uniform(-1e-4, 1e-4)
+        coords.append([x, y])
+    return {
+        "type": "Feature",
+        "properties": {
+            "cd_linha": f"{i}.1",
+            "nm_operadora": rnd.choice(OPERADORAS),
+        },
+        "geometry": {"type": "LineString", "coordinates": coords},
+    }
+
+
+def _editar_itinerario(feat, rnd):
+    # desvio de um trecho: desloca um vértice ~20 m
+    coords = feat["geometry"]["coordinates"]
+    k = rnd.randrange(len(coords))
+    coords[k] = [coords[k][0] + 2e-4, coords[k][1] - 2e-4]
+
+
+def _parada(i, rnd, vertices):
+    return {
+        "type": "Feature",
+        "properties": {
+            "parada": 10000 + i,
+            "descricao": f"Parada {10000 + i} - {rnd.choice(['EPTG', 'EPIA', 'W3 Sul', 'W3 Norte', 'Eixão'])}",
+            "situacao": rnd.choice(["ATIVA", "ATIVA", "ATIVA", "INATIVA"]),
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [-47.9 + rnd.random(), -15.8 + rnd.random()],
+        },
+    }
+
+
+def _editar_parada(feat, rnd):
+    if rnd.random() < 0.5:
+        x, y = feat["geometry"]["coordinates"]
+        feat["geometry"]["coordinates"] = [x + rnd.uniform(-5e-4, 5e-4), y + rnd.uniform(-5e-4, 5e-4)]
+    else:
+        p = feat["properties"]
+        p["situacao"] = "INATIVA" if p["situacao"] == "ATIVA" else "ATIVA"
+
+
+# arquétipo -> (camada de referência em audit_rules, gerador, edição)
+ARQUETIPOS = {
+    "frota": ("semob:Frota por Operadora", _frota, _editar_frota),
+    "horarios": ("semob:Horários das Linhas", _horario, _editar_horario),
+    "itinerario": ("semob:Itinerário Espacial das Linhas", _itinerario, _editar_itinerario),
+    "paradas": ("semob:Paradas de onibus", _parada, _editar_parada),
+}
+
+
+# ============================================================
+# GERAÇÃO
+# ============================================================
+
+def gerar_camada(arquetipo, n, seed=42, vertices=200):
+    """Versão antiga: n features do arquétipo."""
+
+    _, gerar, _ = ARQUETIPOS[arquetipo]
+    rnd = random.Random(seed)
+
+    for i in range(n):
+        yield gerar(i, rnd, vertices)
+
+
+def gerar_versao(arquetipo, n, add=0.0, rem=0.0, edit=0.0, seed=42, vertices=200):
+    """
+    Versão nova da camada de gerar_camada(arquetipo, n, seed): remove
+    rem% das features, edita edit% e acrescenta add% ao final.
+    """
+
+    _, gerar, editar = ARQUETIPOS[arquetipo]
+    rnd = random.Random(seed)
+    mut = random.Random(seed + 1)
+
+    for i in range(n):
+        feat = gerar(i, rnd, vertices)
+        u = mut.random() * 100
+        if u < rem:
+            continue
+        if u < rem + edit:
+            editar(feat, mut)
+        yield feat
+
+    for i in range(n, n + round(n * add / 100)):
+        yield gerar(i, rnd, vertices)
+
+
+def mutar(arquetipo, features, inicio, add=0.0, rem=0.0, edit=0.0, seed=42, passo=1, vertices=200):
+    """
+    Um passo de mutação sobre uma versão qualquer (features, em
+    streaming): remove rem%, edita edit% e acrescenta add% do total
+    recebido, numeradas a partir de `inicio` (índices nunca reaproveitados).
+    Fluxos aleatórios próprios de (seed, passo).
+    """
+
+    _, gerar, editar = ARQUETIPOS[arquetipo]
+    mut = random.Random(f"{seed}:{passo}:mut")
+    rnd = random.Random(f"{seed}:{passo}:add")
+    n = 0
+
+    for feat in features:
+        n += 1
+        u = mut.random() * 100
+        if u < rem:
+            continue
+        if u < rem + edit:
+            editar(feat, mut)
+        yield feat
+
+    for i in range(inicio, inicio + round(n * add / 100)):
+        yield gerar(i, rnd, vertices)
+
+
+def layer_de(arquetipo):
+    return ARQUETIPOS[arquetipo][0]
+
+
+# compatibilidade com benchmark.bench_hash
+
+def gerar_horarios(n, seed=42):
+    return gerar_camada("horarios", n, seed)
+
+
+def gerar_itinerarios(n, vertices=2000, seed=42):
+    return gerar_camada("itinerario", n, seed, vertices)
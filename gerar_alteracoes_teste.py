@@ -4,25 +4,27 @@
 
 import json
 import random
-from pathlib import Path
 
-DOWNLOAD_DIR = Path("downloads")
+from baixar_geoserver import STORE
 
 
 # ============================================================
 # UTIL
 # ============================================================
 
+def _camada(nome):
+    # "semob__Camada.geojson" -> "semob:Camada"
+    return nome.removesuffix(".geojson").replace("__", ":", 1)
+
+
 def carregar(nome):
-    return json.load(open(DOWNLOAD_DIR / nome, encoding="utf-8"))
+    # lê pelo store configurado (geojson ou colunar)
+    feats = [f for _, f in STORE.ler(_camada(nome))]
+    return {"type": "FeatureCollection", "features": feats}
 
 
 def salvar(nome, data):
-    json.dump(
-        data,
-        open(DOWNLOAD_DIR / nome, "w", encoding="utf-8"),
-        ensure_ascii=False
-    )
+    STORE.gravar(_camada(nome), data["features"])
 
 
 # ============================================================
@@ -0,0 +1,169 @@
+# ============================================================
+# HASH EM PARALELO (PROCESSOS) PARA CAMADAS GRANDES
+# ============================================================
+#
+# build_index num único loop Python ocupa só um núcleo. Aqui o snapshot é
+# repartido pelo próprio store (store.fatias): faixas de bytes no
+# geojson, grupos de linhas no colunar. Cada processo recebe só o
+# descritor da fatia, lê e faz o hash do disco e devolve dois blocos de
+# bytes (locators int64 + digests de 16 bytes), sem pickle de features.
+#
+# As fatias voltam em ordem e são juntadas em ordem: o índice resultante
+# é idêntico ao do loop serial (mesmas chaves, mesma ordem, mesmos
+# locators).
+#
+# No download (gravar_spool) o hash também sai dos processos: HashEmLotes
+# manda as features já serializadas pelo SnapshotWriter em lotes, à
+# medida que chegam, e devolve os resultados na ordem de envio (o mesmo
+# índice do loop serial). Lote que falhar no pool é refeito em série.
+#
+# Este módulo só importa audit_utils e snapshot_store, para que os
+# processos filhos (spawn no Windows) subam rápido.
+
+import json
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+from audit_utils import canonical_hash, geometry_fingerprint
+from snapshot_store import criar_store
+
+FATIAS_POR_WORKER = 4
+
+# features por lote no hash do download e lotes em voo por processo
+LOTE = 2000
+EM_VOO_POR_WORKER = 2
+
+
+def impressao(geometria, min_vertices):
+    """
+    Impressão digital da geometria com min_vertices ou mais vértices;
+    None para pontos, geometrias pequenas e min_vertices 0.
+    """
+
+    if not min_vertices or not geometria or geometria.get("type") == "Point":
+        return None
+
+    fp = geometry_fingerprint(geometria)
+
+    return fp if fp[1] is not None and fp[1] >= min_vertices else None
+
+
+def _hash_fatia(formato, base_dir, layer, fatia, ignore_fields):
+    """Executado no processo filho: (locators int64, digests) da fatia."""
+
+    store = criar_store(formato, base_dir)
+    locators = array("q")
+    digests = bytearray()
+
+    for loc, feat in store.ler_fatia(layer, fatia):
+        locators.append(loc)
+        digests += bytes.fromhex(
+            canonical_hash(feat.get("properties"), feat.get("geometry"), ignore_fields)
+        )
+
+    return locators.tobytes(), bytes(digests)
+
+
+def indexar_paralelo(store, layer, ignore_fields, workers):
+    """
+    hash -> locators do snapshot, com o hash distribuído em processos.
+    Retorna None se o store não souber fatiar este snapshot.
+    """
+
+    fatias = store.fatias(layer, workers * FATIAS_POR_WORKER)
+
+    if len(fatias) < 2:
+        return None
+
+    index = {}
+    ignore_fields = list(ignore_fields)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(fatias))) as pool:
+
+        resultados = pool.map(
+            _hash_fatia,
+            repeat(store.formato),
+            repeat(str(store.base_dir)),
+            repeat(layer),
+            fatias,
+            repeat(ignore_fields),
+        )
+
+        for locs_bytes, digests in resultados:
+            locators = array("q")
+            locators.frombytes(locs_bytes)
+            for i, loc in enumerate(locators):
+                h = digests[16 * i:16 * i + 16].hex()
+                index.setdefault(h, []).append(loc)
+
+    return index
+
+
+def _hash_lote(lote, ignore_fields, min_vertices):
+    """Executado no processo filho: [(hash, impressão)] das features serializadas."""
+
+    saida = []
+
+    for dados in lote:
+        feat = json.loads(dados)
+        saida.append((
+            canonical_hash(feat.get("properties"), feat.get("geometry"), ignore_fields),
+            impressao(feat.get("geometry"), min_vertices),
+        ))
+
+    return saida
+
+
+class HashEmLotes:
+    """
+    Hash das features de um spool em lotes no pool de processos. enviar()
+    devolve os lotes já prontos, na ordem de envio, como (contexto,
+    [(hash, impressão)]); finalizar() devolve o resto. Mantém no máximo
+    workers * EM_VOO_POR_WORKER lotes pendentes (memória limitada).
+    """
+
+    def __init__(self, pool, workers, ignore_fields, min_vertices):
+        self.pool = pool
+        self.em_voo = max(1, workers * EM_VOO_POR_WORKER)
+        self.ignore_fields = list(ignore_fields)
+        self.min_vertices = min_vertices
+        self.fila = deque()
+        self.falhou = False
+
+    def _resultado(self):
+        lote, contexto, futuro = self.fila.popleft()
+        try:
+            return contexto, futuro.result()
+        except (OSError, BrokenProcessPool):
+            # processo morto (OOM, kill): o lote ainda está aqui
+            self.falhou = True
+            return contexto, _hash_lote(lote, self.ignore_fields, self.min_vertices)
+
+    def enviar(self, lote, contexto):
+        try:
+            futuro = self.pool.submit(_hash_lote, lote, self.ignore_fields, self.min_vertices)
+        except (RuntimeError, BrokenProcessPool):
+            # pool encerrado ou quebrado: este lote em série
+            self.falhou = True
+            futuro = None
+
+        if futuro is None:
+            prontos = self.finalizar()
+            prontos.append((contexto, _hash_lote(lote, self.ignore_fields, self.min_vertices)))
+            return prontos
+
+        self.fila.append((lote, contexto, futuro))
+
+        prontos = []
+        while len(self.fila) > self.em_voo or (self.fila and self.fila[0][2].done()):
+            prontos.append(self._resultado())
+        return prontos
+
+    def finalizar(self):
+        prontos = []
+        while self.fila:
+            prontos.append(self._resultado())
+        return prontos
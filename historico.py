@@ -0,0 +1,327 @@
+# ============================================================
+# HISTÓRICO DE SNAPSHOTS – BASE PERIÓDICA + DELTAS DIÁRIOS
+# ============================================================
+#
+# downloads/historico/<camada>/
+#   base_AAAA-MM-DD.jsonl.gz   estado completo da camada naquele dia
+#                              (uma linha {"h": hash, "f": feature} por feature)
+#   delta_AAAA-MM-DD.json.gz   mudanças do dia, a partir dos conjuntos de
+#                              hashes que a auditoria já calcula:
+#                              {"add": {hash: [features]}, "rem": [hashes],
+#                               "mult": {hash: nova multiplicidade}}
+#
+# Dia sem delta = dia sem mudança. A base de um dia já inclui o delta do
+# mesmo dia. Os deltas continuam sendo gravados mesmo quando há base, então
+# diff entre duas datas só compõe os deltas do intervalo.
+#
+# Uso:
+#   python historico.py reconstruir "semob:Frota por Operadora" 2026-10-13 [destino]
+#   python historico.py diff "semob:Frota por Operadora" 2026-10-13 2026-10-17
+#   python historico.py compactar [--manter-dias 30]
+
+import gzip
+import json
+import os
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+
+def _itens(add):
+    """(hash, features) de add: dict ou iterável de pares."""
+    return add.items() if isinstance(add, dict) else add
+
+
+class Historico:
+
+    def __init__(self, base_dir, base_cada_dias=7):
+        self.base_dir = Path(base_dir)
+        self.base_cada_dias = base_cada_dias
+
+    # ========================================================
+    # ARQUIVOS
+    # ========================================================
+
+    def pasta(self, layer):
+        return self.base_dir/layer.replace(":", "__")
+
+    def _datas(self, layer, tipo):
+        pasta = self.pasta(layer)
+        if not pasta.exists():
+            return []
+        return sorted(
+            date.fromisoformat(p.name[len(tipo)+1:].split(".")[0])
+            for p in pasta.glob(f"{tipo}_*.gz")
+        )
+
+    def bases(self, layer):
+        return self._datas(layer, "base")
+
+    def deltas(self, layer):
+        return self._datas(layer, "delta")
+
+    def _base_path(self, layer, dia):
+        return self.pasta(layer)/f"base_{dia.isoformat()}.jsonl.gz"
+
+    def _delta_path(self, layer, dia):
+        return self.pasta(layer)/f"delta_{dia.isoformat()}.json.gz"
+
+    def _ler_base(self, layer, dia):
+        with gzip.open(self._base_path(layer, dia), "rt", encoding="utf-8") as f:
+            for linha in f:
+                item = json.loads(linha)
+                yield item["h"], item["f"]
+
+    def _gravar_base(self, layer, dia, itens):
+        path = self._base_path(layer, dia)
+        tmp = path.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for h, feat in itens:
+                f.write(json.dumps({"h": h, "f": feat}, ensure_ascii=False))
+                f.write("\n")
+        os.replace(tmp, path)
+
+    def _ler_delta(self, layer, dia):
+        with gzip.open(self._delta_path(layer, dia), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _gravar_delta(self, layer, dia, delta):
+        """Grava em streaming: add/rem podem ser iteráveis (diff em disco)."""
+
+        path = self._delta_path(layer, dia)
+        tmp = path.with_suffix(".tmp")
+
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            f.write('{"add": {')
+            for i, (h, feats) in enumerate(_itens(delta["add"])):
+                f.write(", " if i else "")
+                f.write(f"{json.dumps(h)}: {json.dumps(feats, ensure_ascii=False)}")
+            f.write('}, "rem": [')
+            for i, h in enumerate(delta["rem"]):
+                f.write(", " if i else "")
+                f.write(json.dumps(h))
+            f.write(f'], "mult": {json.dumps(delta.get("mult", {}))}}}')
+
+        os.replace(tmp, path)
+
+    # ========================================================
+    # DELTAS
+    # ========================================================
+
+    @staticmethod
+    def aplicar(estado, delta):
+        """Aplica um delta sobre hash -> [features]."""
+
+        for h in delta["rem"]:
+            estado.pop(h, None)
+
+        for h, feats in delta["add"].items():
+            estado[h] = feats
+
+        for h, n in delta.get("mult", {}).items():
+            if estado.get(h):
+                estado[h] = [estado[h][0]] * n
+
+    @staticmethod
+    def compor(d1, d2):
+        """Delta equivalente a aplicar d1 e depois d2."""
+
+        add = dict(d1["add"])
+        rem = set(d1["rem"])
+        mult = dict(d1.get("mult", {}))
+
+        for h in d2["rem"]:
+            mult.pop(h, None)
+            if h in add:
+                del add[h]
+            else:
+                rem.add(h)
+
+        for h, feats in _itens(d2["add"]):
+            add[h] = feats
+
+        for h, n in d2.get("mult", {}).items():
+            if h in add:
+                add[h] = [add[h][0]] * n
+            else:
+                mult[h] = n
+
+        return {"add": add, "rem": sorted(rem), "mult": mult}
+
+    # ========================================================
+    # GRAVAÇÃO (chamado pela auditoria)
+    # ========================================================
+
+    def registrar(self, layer, dia, snapshot, delta=None):
+        """
+        Registra o estado do dia.
+
+        snapshot: função que devolve um iterável (hash, feature) do
+        snapshot atual; só é chamada quando uma base nova é necessária
+        (primeira execução ou base_cada_dias desde a última).
+        delta: {"add", "rem", "mult"} da auditoria; None no snapshot inicial.
+        add/rem podem vir como iteráveis (gravados em streaming).
+        """
+
+        self.pasta(layer).mkdir(parents=True, exist_ok=True)
+
+        if delta and (delta["add"] or delta["rem"] or delta.get("mult")):
+            if dia in self.deltas(layer):
+                # segunda execução no mesmo dia
+                delta = self.compor(self._ler_delta(layer, dia), delta)
+            self._gravar_delta(layer, dia, delta)
+
+        bases = self.bases(layer)
+
+        if not bases or (dia - bases[-1]).days >= self.base_cada_dias or bases[-1] == dia:
+            self._gravar_base(layer, dia, snapshot())
+
+    # ========================================================
+    # CONSULTA
+    # ========================================================
+
+    def reconstruir(self, layer, dia):
+        """hash -> [features] da camada no dia (base anterior + deltas)."""
+
+        bases = [b for b in self.bases(layer) if b <= dia]
+
+        if not bases:
+            raise ValueError(f"{layer}: sem base até {dia}")
+
+        estado = {}
+        for h, feat in self._ler_base(layer, bases[-1]):
+            estado.setdefault(h, []).append(feat)
+
+        for d in self.deltas(layer):
+            if bases[-1] < d <= dia:
+                self.aplicar(estado, self._ler_delta(layer, d))
+
+        return estado
+
+    def diff(self, layer, dia1, dia2):
+        """
+        Features adicionadas/removidas entre dia1 e dia2, compondo só os
+        deltas do intervalo. Os corpos removidos são buscados na base
+        anterior a dia1 (varredura filtrada, sem reconstruir o estado).
+        ValueError se dia1 é anterior à base mais antiga (compactada): os
+        deltas de antes dela não existem mais.
+        """
+
+        bases = [b for b in self.bases(layer) if b <= dia1]
+
+        if not bases:
+            raise ValueError(f"{layer}: sem base até {dia1}")
+
+        liquido = {"add": {}, "rem": [], "mult": {}}
+
+        for d in self.deltas(layer):
+            if dia1 < d <= dia2:
+                liquido = self.compor(liquido, self._ler_delta(layer, d))
+
+        # removido e readicionado no intervalo = mesmo conteúdo
+        voltaram = set(liquido["rem"]) & set(liquido["add"])
+        rem = set(liquido["rem"]) - voltaram
+        corpos = {}
+
+        if rem:
+            for h, feat in self._ler_base(layer, bases[-1]):
+                if h in rem:
+                    corpos.setdefault(h, []).append(feat)
+
+            for d in self.deltas(layer):
+                if bases[-1] < d <= dia1:
+                    delta = self._ler_delta(layer, d)
+                    for h in rem & set(delta["add"]):
+                        corpos[h] = delta["add"][h]
+
+        return {
+            "added": [
+                f for h, feats in liquido["add"].items() if h not in voltaram
+                for f in feats
+            ],
+            "removed": [f for h in sorted(rem) for f in corpos.get(h, [])],
+        }
+
+    # ========================================================
+    # COMPACTAÇÃO
+    # ========================================================
+
+    def compactar(self, layer, antes):
+        """
+        Funde tudo o que é anterior a `antes` numa base nova: grava a base
+        do último dia registrado antes do corte e apaga bases e deltas
+        mais antigos. Datas anteriores a essa base deixam de ser
+        reconstruíveis.
+        """
+
+        datas = [d for d in self.bases(layer) + self.deltas(layer) if d < antes]
+
+        if not datas:
+            return None
+
+        dia = max(datas)
+
+        if dia not in self.bases(layer):
+            estado = self.reconstruir(layer, dia)
+            self._gravar_base(
+                layer, dia, ((h, f) for h, feats in estado.items() for f in feats)
+            )
+
+        for b in self.bases(layer):
+            if b < dia:
+                self._base_path(layer, b).unlink()
+
+        for d in self.deltas(layer):
+            if d <= dia:
+                self._delta_path(layer, d).unlink()
+
+        return dia
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+if __name__ == "__main__":
+
+    import baixar_geoserver
+    from baixar_geoserver import HISTORICO, aplicar_catalogo, log
+    from geojson_stream import SnapshotWriter
+
+    if HISTORICO is None:
+        sys.exit("histórico desativado (config.json: history.enabled)")
+
+    # camadas pelo nome técnico do catálogo em cache, como no snapshot
+    aplicar_catalogo()
+
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if comando == "reconstruir":
+        layer, dia = sys.argv[2], date.fromisoformat(sys.argv[3])
+        destino = Path(sys.argv[4]) if len(sys.argv) > 4 else Path(
+            f"{layer.replace(':', '__')}_{dia.isoformat()}.geojson"
+        )
+        with SnapshotWriter(destino) as w:
+            for feats in HISTORICO.reconstruir(layer, dia).values():
+                for feat in feats:
+                    w.write(feat)
+        log(f"{layer}: {w.total} features em {dia} -> {destino}")
+
+    elif comando == "diff":
+        layer = sys.argv[2]
+        d1, d2 = date.fromisoformat(sys.argv[3]), date.fromisoformat(sys.argv[4])
+        diff = HISTORICO.diff(layer, d1, d2)
+        log(f"{layer}: {d1} → {d2}: +{len(diff['added'])} | -{len(diff['removed'])}")
+        json.dump(diff, sys.stdout, ensure_ascii=False, indent=1)
+
+    elif comando == "compactar":
+        dias = int(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[2] == "--manter-dias" else 30
+        corte = date.today() - timedelta(days=dias)
+        # JOBS é trocado (não alterado) por aplicar_catalogo
+        for layer in baixar_geoserver.JOBS:
+            dia = HISTORICO.compactar(layer, corte)
+            if dia:
+                log(f"{layer}: histórico anterior a {corte} compactado na base {dia}")
+
+    else:
+        sys.exit("uso: historico.py reconstruir|diff|compactar ... (ver cabeçalho)")
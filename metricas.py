@@ -0,0 +1,231 @@
+# ============================================================
+# MÉTRICAS DE EXECUÇÃO
+# ============================================================
+#
+# Cada etapa instrumentada acumula, por camada:
+#   segundos, chamadas, contadores (bytes, features, ...) e o pico de RSS
+#   do processo ao fim da etapa.
+#
+# Etapas chamadas várias vezes (páginas em paralelo, retentativas) somam
+# no mesmo registro. Ao fim da execução:
+#   downloads/metricas/execucao_AAAAMMDD_HHMMSS.json
+#   + textfile do Prometheus (node_exporter --collector.textfile), se
+#     configurado em config.json -> metrics.prometheus_textfile
+#
+# Perfil opcional por camada (metrics.profile_layers):
+#   "cprofile"    -> <execucao>_<camada>.prof (thread da camada)
+#   "tracemalloc" -> <execucao>_<camada>.tracemalloc.txt (top 25 linhas)
+
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+
+def rss_pico_mb():
+    """Pico de RSS do processo até agora (None se indisponível)."""
+
+    try:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux: KB | macOS: bytes
+        return round(kb / (2**20 if sys.platform == "darwin" else 2**10), 1)
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+class Metricas:
+
+    def __init__(self, pasta, prometheus=None, perfil_camadas=(), perfil="cprofile"):
+        self.pasta = Path(pasta)
+        self.prometheus = Path(prometheus) if prometheus else None
+        self.perfil_camadas = set(perfil_camadas)
+        self.perfil = perfil
+        self._lock = threading.Lock()
+        self._tracemalloc = 0
+        self.iniciar()
+
+    def iniciar(self):
+        with self._lock:
+            self.inicio = datetime.now()
+            self._t0 = time.perf_counter()
+            self.camadas = {}
+
+    # ========================================================
+    # REGISTRO
+    # ========================================================
+
+    def _registro(self, layer, nome):
+        camada = self.camadas.setdefault(layer, {"etapas": {}})
+        return camada["etapas"].setdefault(nome, {"segundos": 0.0, "chamadas": 0})
+
+    def somar(self, layer, nome, segundos=0.0, **contadores):
+        with self._lock:
+            r = self._registro(layer, nome)
+            r["segundos"] += segundos
+            r["chamadas"] += 1
+            for k, v in contadores.items():
+                if v is not None:
+                    r[k] = r.get(k, 0) + v
+
+    @contextmanager
+    def etapa(self, layer, nome):
+        """
+        Cronometra o bloco; o dict devolvido recebe contadores
+        (bytes, features...) que são somados ao registro da etapa.
+        """
+
+        contadores = {}
+        t = time.perf_counter()
+
+        try:
+            yield contadores
+        finally:
+            dt = time.perf_counter() - t
+            rss = rss_pico_mb()
+            with self._lock:
+                r = self._registro(layer, nome)
+                r["segundos"] += dt
+                r["chamadas"] += 1
+                for k, v in contadores.items():
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        r[k] = r.get(k, 0) + v
+                    else:
+                        r[k] = v
+                if rss is not None:
+                    r["rss_pico_mb"] = max(r.get("rss_pico_mb", 0), rss)
+
+    def resultado(self, layer, **campos):
+        with self._lock:
+            self.camadas.setdefault(layer, {"etapas": {}}).update(campos)
+
+    # ========================================================
+    # PERFIL
+    # ========================================================
+
+    def _arquivo(self, layer, sufixo):
+        return self.pasta/f"execucao_{self.inicio:%Y%m%d_%H%M%S}_{layer.replace(':', '__')}{sufixo}"
+
+    @contextmanager
+    def perfilar(self, layer):
+        """cProfile ou tracemalloc em volta da camada, se configurado."""
+
+        if layer not in self.perfil_camadas:
+            yield
+            return
+
+        self.pasta.mkdir(parents=True, exist_ok=True)
+
+        if self.perfil == "tracemalloc":
+            # tracemalloc é global: várias camadas perfiladas dividem a sessão
+            with self._lock:
+                if not self._tracemalloc:
+                    tracemalloc.start(25)
+                self._tracemalloc += 1
+            try:
+                yield
+            finally:
+                snap = tracemalloc.take_snapshot()
+                atual, pico = tracemalloc.get_traced_memory()
+                with self._lock:
+                    self._tracemalloc -= 1
+                    if not self._tracemalloc:
+                        tracemalloc.stop()
+                with open(self._arquivo(layer, ".tracemalloc.txt"), "w", encoding="utf-8") as f:
+                    f.write(f"{layer}: atual {atual / 2**20:.1f} MB | pico {pico / 2**20:.1f} MB\n\n")
+                    for stat in snap.statistics("lineno")[:25]:
+                        f.write(f"{stat}\n")
+            return
+
+        perfil = cProfile.Profile()
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+            perfil.dump_stats(self._arquivo(layer, ".prof"))
+
+    # ========================================================
+    # SAÍDA
+    # ========================================================
+
+    def dados(self):
+        with self._lock:
+            return {
+                "inicio": self.inicio.isoformat(timespec="seconds"),
+                "duracao_s": round(time.perf_counter() - self._t0, 3),
+                "rss_pico_mb": rss_pico_mb(),
+                "camadas": json.loads(json.dumps(self.camadas)),
+            }
+
+    def gravar(self):
+        """Grava o JSON da execução (e o textfile do Prometheus). Retorna o caminho."""
+
+        dados = self.dados()
+
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        destino = self.pasta/f"execucao_{self.inicio:%Y%m%d_%H%M%S}.json"
+
+        with open(destino, "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False, indent=1)
+
+        if self.prometheus:
+            self._gravar_prometheus(dados)
+
+        return destino
+
+    def _gravar_prometheus(self, dados):
+
+        def rotulo(v):
+            return str(v).replace("\\", "\\\\").replace('"', '\\"')
+
+        linhas = [
+            "# HELP geoserver_audit_run_seconds Duração da última auditoria.",
+            "# TYPE geoserver_audit_run_seconds gauge",
+            f"geoserver_audit_run_seconds {dados['duracao_s']}",
+            "# HELP geoserver_audit_run_timestamp_seconds Fim da última auditoria (unix).",
+            "# TYPE geoserver_audit_run_timestamp_seconds gauge",
+            f"geoserver_audit_run_timestamp_seconds {time.time():.0f}",
+        ]
+
+        if dados["rss_pico_mb"] is not None:
+            linhas += [
+                "# HELP geoserver_audit_peak_rss_bytes Pico de RSS do processo.",
+                "# TYPE geoserver_audit_peak_rss_bytes gauge",
+                f"geoserver_audit_peak_rss_bytes {int(dados['rss_pico_mb'] * 2**20)}",
+            ]
+
+        metricas = {
+            "segundos": ("geoserver_audit_stage_seconds", "Tempo por etapa."),
+            "chamadas": ("geoserver_audit_stage_calls", "Chamadas por etapa."),
+            "bytes": ("geoserver_audit_stage_bytes", "Bytes por etapa."),
+            "features": ("geoserver_audit_stage_features", "Features por etapa."),
+        }
+
+        for campo, (nome, ajuda) in metricas.items():
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge"]
+            for layer, camada in dados["camadas"].items():
+                for etapa, r in camada["etapas"].items():
+                    if campo in r:
+                        linhas.append(
+                            f'{nome}{{layer="{rotulo(layer)}",stage="{rotulo(etapa)}"}} {r[campo]}'
+                        )
+
+        # o collector lê o diretório a qualquer momento: troca atômica
+        self.prometheus.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.prometheus.with_name(self.prometheus.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(linhas) + "\n")
+        os.replace(tmp, self.prometheus)
@@ -1,17 +1,400 @@
+# ============================================================
+# NOTIFICAÇÕES – CAIXA DE SAÍDA DO TEAMS
+# ============================================================
+#
+# O card não é mais enviado direto no fim da execução: vai para a caixa
+# de saída em disco (downloads/notificacoes/, um .json por card) e uma
+# thread em segundo plano entrega, em ordem de chegada:
+#
+#   - 2xx                       -> entregue, arquivo removido
+#   - falha de rede, 408, 429,
+#     5xx                       -> nova tentativa com espera exponencial
+#                                  (backoff_base .. backoff_max), até
+#                                  "retries" tentativas
+#   - demais 4xx (400, 413...)  -> rejeitadas/ (repetir não adianta)
+#
+# Enquanto o primeiro card da fila espera nova tentativa, os seguintes
+# esperam também: as partes de um resumo chegam na ordem. O que não foi
+# entregue até o fim da execução continua na caixa e sai na próxima.
+#
+# Resumos grandes viram vários cards (montar_cards): o corpo é quebrado
+# entre blocos (camadas, operadoras) para cada payload ficar abaixo de
+# max_card_bytes (o webhook do Teams recusa mensagens acima de ~28 KB).
+#
+# Cada entrega registra latência e tamanho no log e na etapa "teams" das
+# métricas.
+
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
 import requests
 
+# status HTTP que valem nova tentativa
+REPETIR = {408, 429}
+
 
-def enviar_teams(webhook, titulo, mensagem, link_relatorio=None):
+# ============================================================
+# CARDS
+# ============================================================
 
-    texto = f"{titulo}\n\n{mensagem}"
+def _tamanho(texto):
+    """Bytes do texto dentro do payload (json.dumps, como o requests envia)."""
+    return len(json.dumps(texto)) - 2
 
-    if link_relatorio:
-        texto += f"\n\nRelatório: {link_relatorio}"
 
-    payload = {
-        "text": texto
+def card(titulo, subtitulo, corpo, cor, link=None):
+    """
+    Payload do webhook: Adaptive Card com título, subtítulo e corpo;
+    link = botão "Relatório detalhado".
+    """
+
+    conteudo = {
+        "type": "message",
+        "attachments": [{
+            "contentType": "application/vnd.microsoft.card.adaptive",
+            "content": {
+                "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+                "type": "AdaptiveCard",
+                "version": "1.4",
+                "body": [
+                    {
+                        "type": "TextBlock",
+                        "text": titulo,
+                        "weight": "Bolder",
+                        "size": "Large",
+                        "color": cor
+                    },
+                    {
+                        "type": "TextBlock",
+                        "text": subtitulo,
+                        "isSubtle": True
+                    },
+                    {
+                        "type": "TextBlock",
+                        "text": corpo,
+                        "wrap": True
+                    }
+                ]
+            }
+        }]
     }
 
-    r = requests.post(webhook, json=payload, timeout=30)
+    if link:
+        conteudo["attachments"][0]["content"]["actions"] = [{
+            "type": "Action.OpenUrl",
+            "title": "Relatório detalhado",
+            "url": link
+        }]
+
+    return conteudo
+
+
+def _partir(texto, limite):
+    """Quebra um trecho em pedaços de até `limite` bytes: por linha, e por caractere se preciso."""
+
+    pedacos = []
+    atual = []
+    usado = 0
+
+    for linha in texto.split("\n"):
+
+        while _tamanho(linha) > limite:
+            # linha sozinha maior que o card: corte seco
+            n = len(linha)
+            while _tamanho(linha[:n]) > limite:
+                n = n * 3 // 4
+            if atual:
+                pedacos.append("\n".join(atual))
+                atual, usado = [], 0
+            pedacos.append(linha[:n])
+            linha = linha[n:]
+
+        custo = _tamanho(linha) + (2 if atual else 0)
+        if atual and usado + custo > limite:
+            pedacos.append("\n".join(atual))
+            atual, usado = [], 0
+            custo = _tamanho(linha)
+
+        atual.append(linha)
+        usado += custo
+
+    if atual:
+        pedacos.append("\n".join(atual))
+
+    return pedacos
+
+
+def montar_cards(titulo, subtitulo, corpo, cor, max_bytes, link=None):
+    """
+    Um ou mais cards para o corpo, cada payload com até max_bytes.
+    Quebra entre blocos (linhas em branco); bloco maior que um card é
+    quebrado por linha. Com mais de um card o título leva "(i/n)".
+    link (relatório detalhado) vai em todos os cards.
+    """
+
+    # espaço do título "(i/n)" e dos textos fixos do card
+    fixo = len(json.dumps(card(f"{titulo} (999/999)", subtitulo, "", cor, link)).encode("utf-8"))
+    limite = max(256, max_bytes - fixo)
+
+    partes = []
+    atual = []
+    usado = 0
+
+    for bloco in corpo.split("\n\n"):
+
+        custo = _tamanho(bloco) + (4 if atual else 0)
+
+        if atual and usado + custo > limite:
+            # cabeçalho solto (título de camada) desce junto com o bloco
+            orfao = atual.pop() if len(atual) > 1 and "\n" not in atual[-1] else None
+            partes.append("\n\n".join(atual))
+            atual, usado = ([orfao], _tamanho(orfao)) if orfao else ([], 0)
+            custo = _tamanho(bloco) + (4 if atual else 0)
+
+        if usado + custo <= limite:
+            atual.append(bloco)
+            usado += custo
+            continue
+
+        # bloco maior que um card inteiro
+        if atual:
+            partes.append("\n\n".join(atual))
+        *cheios, resto = _partir(bloco, limite)
+        partes.extend(cheios)
+        atual, usado = [resto], _tamanho(resto)
+
+    if atual:
+        partes.append("\n\n".join(atual))
+
+    if len(partes) == 1:
+        return [card(titulo, subtitulo, partes[0], cor, link)]
+
+    return [
+        card(f"{titulo} ({i}/{len(partes)})", subtitulo, parte, cor, link)
+        for i, parte in enumerate(partes, 1)
+    ]
+
+
+# ============================================================
+# CAIXA DE SAÍDA
+# ============================================================
+
+class CaixaSaida:
+
+    def __init__(self, pasta, timeout=30, retries=20, backoff_base=30.0,
+                 backoff_max=3600.0, log=print, metricas=None):
+        self.pasta = Path(pasta)
+        self.rejeitadas = self.pasta/"rejeitadas"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.log = log
+        self.metricas = metricas
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    # ========================================================
+    # FILA
+    # ========================================================
+
+    def _gravar(self, path, msg):
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(msg, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def enfileirar(self, url, payloads, descricao=""):
+        """
+        Grava os cards na caixa (em ordem) e acorda a entrega.
+        Retorna os arquivos criados.
+        """
+
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        criados = []
+
+        with self._lock:
+            for i, payload in enumerate(payloads, 1):
+                self._seq += 1
+                path = self.pasta/f"{time.time_ns():020d}_{self._seq:04d}.json"
+                self._gravar(path, {
+                    "url": url,
+                    "descricao": f"{descricao} {i}/{len(payloads)}".strip(),
+                    "criado": time.time(),
+                    "tentativas": 0,
+                    "proxima": 0,
+                    "payload": payload,
+                })
+                criados.append(path)
+
+        self._acordar.set()
+        return criados
+
+    def pendentes(self):
+        """Cards na caixa, na ordem de entrega."""
+
+        if not self.pasta.exists():
+            return []
+        return sorted(self.pasta.glob("*.json"))
+
+    def _rejeitar(self, path, motivo):
+        self.rejeitadas.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(path), str(self.rejeitadas/path.name))
+        self.log(f"Teams: {path.name} rejeitada ({motivo}), movida para {self.rejeitadas}")
+
+    # ========================================================
+    # ENTREGA
+    # ========================================================
+
+    def _enviar(self, path, msg):
+        """Uma tentativa. True = entregue ou rejeitada; False = tentar de novo."""
+
+        corpo = json.dumps(msg["payload"]).encode("utf-8")
+        espera = time.time() - msg["criado"]
+        etapa = self.metricas.etapa("_execucao", "teams") if self.metricas else nullcontext({})
+
+        with etapa as m:
+            t = time.perf_counter()
+            try:
+                r = requests.post(
+                    msg["url"], data=corpo, timeout=self.timeout,
+                    headers={"Content-Type": "application/json"},
+                )
+                status, erro = r.status_code, None
+            except requests.RequestException as e:
+                status, erro = None, str(e)
+            latencia = time.perf_counter() - t
+            m["bytes"] = len(corpo)
+            m["status"] = status or erro
+
+        if status is not None and 200 <= status < 300:
+            path.unlink()
+            self.log(
+                f"Teams enviado | {msg['descricao']} | status={status} | "
+                f"{len(corpo):,} bytes | {latencia:.2f}s | na fila {espera:.0f}s"
+            )
+            return True
+
+        if status is not None and 400 <= status < 500 and status not in REPETIR:
+            self._rejeitar(path, f"status={status}")
+            return True
+
+        msg["tentativas"] += 1
+
+        if msg["tentativas"] >= self.retries:
+            self._rejeitar(path, f"{msg['tentativas']} tentativas, último erro: {status or erro}")
+            return True
+
+        atraso = min(self.backoff_max, self.backoff_base * 2 ** (msg["tentativas"] - 1))
+        msg["proxima"] = time.time() + atraso
+        self._gravar(path, msg)
+
+        self.log(
+            f"Falha Teams ({status or erro}) | {msg['descricao']} | "
+            f"tentativa {msg['tentativas']}, próxima em {atraso:.0f}s"
+        )
+        return False
+
+    def entregar(self):
+        """
+        Entrega em ordem os cards vencidos. Retorna os segundos até a
+        próxima tentativa (None = caixa vazia).
+        """
+
+        for path in self.pendentes():
+
+            if self._parar.is_set():
+                return None
+
+            try:
+                with open(path, encoding="utf-8") as f:
+                    msg = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                self._rejeitar(path, f"ilegível: {e}")
+                continue
+
+            espera = msg["proxima"] - time.time()
+
+            # cabeça da fila aguardando: os seguintes esperam, mantendo a ordem
+            if espera > 0 or not self._enviar(path, msg):
+                return max(0.0, msg["proxima"] - time.time())
+
+        return None
+
+    def _laco(self):
+        while not self._parar.is_set():
+            try:
+                espera = self.entregar()
+            except Exception as e:
+                self.log(f"Caixa de saída: {e}")
+                espera = self.backoff_base
+            self._acordar.wait(espera)
+            self._acordar.clear()
+
+    def iniciar(self):
+        """Sobe a thread de entrega (entrega também o que sobrou de execuções anteriores)."""
+
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._laco, name="caixa_saida", daemon=True)
+            self._thread.start()
+
+        self._acordar.set()
+
+    def aguardar(self, segundos):
+        """
+        Espera a caixa esvaziar por até `segundos`. Retorna quantos cards
+        ficaram pendentes (saem na próxima execução).
+        """
+
+        limite = time.monotonic() + segundos
+
+        while self.pendentes() and time.monotonic() < limite:
+            time.sleep(0.1)
+
+        pendentes = len(self.pendentes())
+        if pendentes:
+            self.log(f"Teams: {pendentes} card(s) na caixa de saída, nova tentativa na próxima execução")
+
+        return pendentes
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+        if self._thread:
+            self._thread.join(self.timeout + 5)
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+if __name__ == "__main__":
+
+    import sys
+
+    # python notificacao.py [pasta]  -> lista a caixa de saída
+    pasta = Path(sys.argv[1] if len(sys.argv) > 1 else "downloads/notificacoes")
+    caixa = CaixaSaida(pasta)
+
+    for path in caixa.pendentes():
+        with open(path, encoding="utf-8") as f:
+            msg = json.load(f)
+        proxima = datetime.fromtimestamp(msg["proxima"]) if msg["proxima"] else "agora"
+        print(f"{path.name}  {msg['descricao']:<16} tentativas={msg['tentativas']}  próxima={proxima}")
 
-    print("Teams status:", r.status_code, r.text)
+    if caixa.rejeitadas.exists():
+        print(f"rejeitadas: {len(list(caixa.rejeitadas.glob('*.json')))}")
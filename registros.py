@@ -0,0 +1,157 @@
+# ============================================================
+# REGISTROS COMPACTOS – FEATURES EM MEMÓRIA DURANTE O DIFF
+# ============================================================
+#
+# As features relidas para o diff (hashes alterados) ficam em memória até
+# o fim da auditoria da camada. Como dicts, cada uma carrega um dict de
+# propriedades próprio (chaves repetidas), uma cópia de cada texto
+# (nm_operadora, cd_linha, hr_prevista, operadora...) e a geometria em
+# listas de listas de floats.
+#
+# Registro guarda:
+#   - o esquema (chave -> posição), compartilhado entre os registros com
+#     as mesmas chaves;
+#   - os valores numa tupla, com os textos internados por camada
+#     (Registros: dicionário de textos, um objeto por texto distinto);
+#   - a geometria como veio do store: WKB (colunar) ou texto JSON
+#     (geojson), decodificada só quando alguém a pede.
+#
+# Registro se comporta como a feature (get("properties"), get("geometry"),
+# ["id"]...), então diff_by_identity, audit_utils e o Agregador trabalham
+# direto sobre ele; geometry_diff_batch usa geometria_bruta e só decodifica
+# os pares que chegam ao shapely. para_dict() devolve a feature como dict (histórico,
+# relatórios).
+
+import json
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import shapely
+
+# feature sem "id" (None é um id válido)
+AUSENTE = object()
+
+
+class Propriedades(Mapping):
+    """Visão somente leitura das propriedades de um Registro."""
+
+    __slots__ = ("_esquema", "_valores")
+
+    def __init__(self, esquema: Dict[str, int], valores: Tuple):
+        self._esquema = esquema
+        self._valores = valores
+
+    def __getitem__(self, chave):
+        return self._valores[self._esquema[chave]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._esquema)
+
+    def __len__(self) -> int:
+        return len(self._esquema)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Registro:
+
+    __slots__ = ("_id", "_esquema", "_valores", "_geom")
+
+    def __init__(self, fid: Any, esquema: Dict[str, int], valores: Tuple,
+                 geom: Union[bytes, str, None]):
+        self._id = fid
+        self._esquema = esquema
+        self._valores = valores
+        self._geom = geom
+
+    @property
+    def properties(self) -> Propriedades:
+        return Propriedades(self._esquema, self._valores)
+
+    @property
+    def geometry(self) -> Optional[Dict[str, Any]]:
+        g = self._geom
+        if g is None:
+            return None
+        if isinstance(g, str):
+            return json.loads(g)
+        return json.loads(shapely.to_geojson(shapely.from_wkb(g)))
+
+    @property
+    def geometria_bruta(self) -> Union[bytes, str, None]:
+        """Geometria como veio do store (WKB ou texto GeoJSON), sem decodificar."""
+        return self._geom
+
+    # ---------------- interface de dict (feature GeoJSON) ----------------
+
+    def get(self, chave: str, padrao: Any = None) -> Any:
+        if chave == "properties":
+            return self.properties
+        if chave == "geometry":
+            return self.geometry
+        if chave == "type":
+            return "Feature"
+        if chave == "id" and self._id is not AUSENTE:
+            return self._id
+        return padrao
+
+    def __getitem__(self, chave: str) -> Any:
+        valor = self.get(chave, AUSENTE)
+        if valor is AUSENTE:
+            raise KeyError(chave)
+        return valor
+
+    def __contains__(self, chave: str) -> bool:
+        return self.get(chave, AUSENTE) is not AUSENTE
+
+    def para_dict(self) -> Dict[str, Any]:
+        feat = {"type": "Feature"}
+        if self._id is not AUSENTE:
+            feat["id"] = self._id
+        feat["properties"] = dict(self.properties)
+        feat["geometry"] = self.geometry
+        return feat
+
+
+class Registros:
+    """Fábrica de Registro de uma camada: esquemas e textos compartilhados."""
+
+    def __init__(self):
+        self._esquemas: Dict[Tuple[str, ...], Dict[str, int]] = {}
+        self._textos: Dict[str, str] = {}
+
+    def esquema(self, chaves: Tuple[str, ...]) -> Dict[str, int]:
+        esquema = self._esquemas.get(chaves)
+        if esquema is None:
+            esquema = self._esquemas[chaves] = {c: i for i, c in enumerate(chaves)}
+        return esquema
+
+    def texto(self, valor: Any) -> Any:
+        if type(valor) is str:
+            return self._textos.setdefault(valor, valor)
+        return valor
+
+    def novo(self, fid: Any, props: Dict[str, Any], geom: Union[bytes, str, None]) -> Registro:
+        """
+        props: dict comum (as chaves viram esquema, os textos são
+        internados). fid AUSENTE = feature sem "id".
+        """
+
+        texto = self.texto
+        return Registro(
+            fid,
+            self.esquema(tuple(props)),
+            tuple([texto(v) for v in props.values()]),
+            geom,
+        )
+
+    def de_feature(self, feat: Dict[str, Any]) -> Registro:
+        """Feature GeoJSON (dict) -> Registro; a geometria vira texto JSON."""
+
+        geom = feat.get("geometry")
+        return self.novo(
+            feat.get("id", AUSENTE),
+            feat.get("properties") or {},
+            json.dumps(geom, separators=(",", ":")) if geom else None,
+        )
@@ -0,0 +1,386 @@
+# ============================================================
+# RELATÓRIO DETALHADO DE MUDANÇAS (JSONL / CSV / HTML)
+# ============================================================
+#
+# O card do Teams só tem contagens por grupo. O relatório guarda cada
+# feature alterada, por execução:
+#
+#   downloads/relatorios/AAAAMMDD_HHMMSS/
+#       index.html                    camadas, contagens e links
+#       semob__<camada>.jsonl         um registro por feature
+#       semob__<camada>.csv           uma linha por campo alterado
+#       semob__<camada>_0001.html ... páginas de "page_size" features
+#
+# No agendador a mesma camada pode rodar de novo antes de a rodada (a
+# pasta) fechar: cada execução repetida ganha a hora no nome
+# (semob__<camada>.HHMMSS.jsonl ...), e os links já enviados no card do
+# Teams continuam apontando para os arquivos da execução deles.
+#
+# Registro: tipo (adicionado/removido/modificado), grupo (group_by de
+# audit_rules), identidade, campos antes → depois, mudança de geometria
+# (deslocamento, vértices) e, em adicionados/removidos, as propriedades.
+#
+# Cada parte do diff (a camada inteira no diff em memória, uma partição
+# no diff em disco) é escrita direto nos arquivos e descartada: nada do
+# conjunto de mudanças fica acumulado aqui.
+#
+# config.json -> "reports": formatos, page_size, keep_days e base_url
+# (endereço onde downloads/relatorios é publicado; com ele o card do
+# Teams ganha o botão "Relatório detalhado").
+
+import csv
+import html
+import json
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
+
+from agregador import SEM_VALOR
+from audit_utils import format_feature_audit, identity_key
+
+TIPOS = ("adicionado", "removido", "modificado")
+
+COLUNAS_CSV = [
+    "camada", "tipo", "grupo", "identidade",
+    "campo", "antes", "depois", "deslocamento_m",
+]
+
+_ESTILO = (
+    "body{font-family:Segoe UI,Arial,sans-serif;margin:24px;color:#222}"
+    "table{border-collapse:collapse;width:100%}"
+    "th,td{border:1px solid #ddd;padding:4px 8px;text-align:left;vertical-align:top;font-size:13px}"
+    "th{background:#f3f3f3}.adicionado{color:#107c10}.removido{color:#c50f1f}"
+    ".modificado{color:#8a5a00}nav{margin:12px 0}nav a{margin-right:12px}"
+)
+
+
+def _texto(v):
+    if v is None:
+        return ""
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False)
+    return str(v)
+
+
+def _pagina_html(titulo, corpo):
+    return (
+        f'<!DOCTYPE html><html lang="pt-BR"><head><meta charset="utf-8">'
+        f"<title>{html.escape(titulo)}</title><style>{_ESTILO}</style></head>"
+        f"<body><h2>{html.escape(titulo)}</h2>{corpo}</body></html>\n"
+    )
+
+
+# ============================================================
+# ESCRITOR DE UMA CAMADA
+# ============================================================
+
+class RelatorioCamada:
+    """Arquivos de uma camada, abertos no primeiro registro."""
+
+    def __init__(self, pasta, layer, regras, formatos, por_pagina, nome=None):
+        self.pasta = Path(pasta)
+        self.layer = layer
+        self.nome = nome or layer.replace(":", "__")
+        self.inicio = datetime.now()
+        self.formatos = set(formatos)
+        self.por_pagina = por_pagina
+
+        regra = regras.get(layer, {})
+        group_by = regra.get("group_by") or []
+        self.campos_grupo = [group_by] if isinstance(group_by, str) else list(group_by)
+        identidade = regra.get("identity")
+        if isinstance(identidade, str):
+            identidade = None if identidade == "ALL_FIELDS" else [identidade]
+        self.identidade = identidade
+        self.ignore_fields = set(regra.get("ignore_fields", []))
+
+        self.contagem = dict.fromkeys(TIPOS, 0)
+        self.paginas = 0
+        self._jsonl = self._csv = self._html = None
+        self._aberto = False
+        self._na_pagina = 0
+
+    # ---------------- registro ----------------
+
+    def _grupo(self, feat):
+        props = feat.get("properties") or {}
+        return {
+            c: SEM_VALOR if props.get(c) is None else str(props.get(c))
+            for c in self.campos_grupo
+        }
+
+    def _registros(self, diff):
+        """(registro, audit) de uma parte do diff, um por feature."""
+
+        for tipo, chave in (("adicionado", "added"), ("removido", "removed")):
+            for feat in diff[chave]:
+                props = feat.get("properties") or {}
+                yield {
+                    "tipo": tipo,
+                    "grupo": self._grupo(feat),
+                    "identidade": list(identity_key(props, self.identidade)) if self.identidade else None,
+                    "propriedades": {k: v for k, v in props.items() if k not in self.ignore_fields},
+                }, None
+
+        for m in diff["modified"]:
+            registro = {
+                "tipo": "modificado",
+                "grupo": self._grupo(m["new"]),
+                "identidade": list(m["identity"]),
+                "alteracoes": [
+                    {"campo": ch["field"], "antes": ch["old"], "depois": ch["new"]}
+                    for ch in m["audit"]["property_changes"]
+                ],
+                "geometria": m["audit"]["geometry_change"],
+            }
+            anterior = self._grupo(m["old"])
+            if anterior != registro["grupo"]:
+                registro["grupo_anterior"] = anterior
+            yield registro, m["audit"]
+
+    def registrar(self, diff):
+        """Escreve uma parte do diff (saída de diff_by_identity)."""
+
+        for registro, audit in self._registros(diff):
+            self._abrir()
+            self.contagem[registro["tipo"]] += 1
+            if self._jsonl:
+                self._jsonl.write(json.dumps({"camada": self.layer, **registro}, ensure_ascii=False, default=str))
+                self._jsonl.write("\n")
+            if self._csv:
+                self._csv.writerows(self._linhas_csv(registro))
+            if self._html:
+                self._linha_html(registro, audit)
+
+    # ---------------- CSV ----------------
+
+    def _linhas_csv(self, r):
+        base = [
+            self.layer, r["tipo"],
+            " / ".join(r["grupo"].values()),
+            " / ".join(map(_texto, r["identidade"] or [])),
+        ]
+
+        if r["tipo"] != "modificado":
+            return [base + ["", "", "", ""]]
+
+        linhas = [
+            base + [a["campo"], _texto(a["antes"]), _texto(a["depois"]), ""]
+            for a in r["alteracoes"]
+        ]
+        g = r["geometria"]
+        if g:
+            # antes/depois: nº de vértices (ou o motivo, sem geometria de um lado)
+            linhas.append(base + [
+                "geometria",
+                _texto(g.get("vertices_old")),
+                _texto(g.get("vertices_new", g.get("reason"))),
+                _texto(g.get("hausdorff_distance")),
+            ])
+        return linhas
+
+    # ---------------- HTML ----------------
+
+    def arquivo_pagina(self, i):
+        return f"{self.nome}_{i:04d}.html"
+
+    def _abrir_pagina(self):
+        self.paginas += 1
+        self._na_pagina = 0
+        self._html = open(self.pasta/self.arquivo_pagina(self.paginas), "w", encoding="utf-8")
+        anterior = (
+            f'<a href="{quote(self.arquivo_pagina(self.paginas - 1))}">← anterior</a>'
+            if self.paginas > 1 else ""
+        )
+        self._html.write(
+            f'<!DOCTYPE html><html lang="pt-BR"><head><meta charset="utf-8">'
+            f"<title>{html.escape(self.layer)} – página {self.paginas}</title>"
+            f"<style>{_ESTILO}</style></head><body>"
+            f"<h2>{html.escape(self.layer)} – página {self.paginas}</h2>"
+            f'<nav><a href="index.html">índice</a>{anterior}</nav>'
+            "<table><tr><th>tipo</th><th>grupo</th><th>identidade</th><th>detalhe</th></tr>"
+        )
+
+    def _fechar_pagina(self, proxima):
+        link = f'<a href="{quote(self.arquivo_pagina(self.paginas + 1))}">próxima →</a>' if proxima else ""
+        self._html.write(f'</table><nav><a href="index.html">índice</a>{link}</nav></body></html>\n')
+        self._html.close()
+
+    def _linha_html(self, r, audit):
+        # página cheia só é fechada quando chega a próxima linha
+        if self._na_pagina >= self.por_pagina:
+            self._fechar_pagina(proxima=True)
+            self._abrir_pagina()
+
+        identidade = " / ".join(map(_texto, r["identidade"] or []))
+        if audit:
+            detalhe = format_feature_audit(identidade, audit)
+        else:
+            detalhe = (f"{k}: {_texto(v)}" for k, v in r["propriedades"].items())
+        grupo = " / ".join(r["grupo"].values())
+        if "grupo_anterior" in r:
+            grupo = f"{' / '.join(r['grupo_anterior'].values())} → {grupo}"
+
+        self._html.write(
+            f'<tr><td class="{r["tipo"]}">{r["tipo"]}</td>'
+            f"<td>{html.escape(grupo)}</td><td>{html.escape(identidade)}</td>"
+            f"<td>{'<br>'.join(map(html.escape, detalhe))}</td></tr>"
+        )
+        self._na_pagina += 1
+
+    # ---------------- arquivos ----------------
+
+    def _abrir(self):
+        if self._aberto:
+            return
+
+        self._aberto = True
+        self.pasta.mkdir(parents=True, exist_ok=True)
+
+        if "jsonl" in self.formatos:
+            self._jsonl = open(self.pasta/f"{self.nome}.jsonl", "w", encoding="utf-8")
+        if "csv" in self.formatos:
+            # utf-8-sig: acentos corretos ao abrir no Excel
+            self._arquivo_csv = open(self.pasta/f"{self.nome}.csv", "w", encoding="utf-8-sig", newline="")
+            self._csv = csv.writer(self._arquivo_csv, delimiter=";")
+            self._csv.writerow(COLUNAS_CSV)
+        if "html" in self.formatos:
+            self._abrir_pagina()
+
+    def fechar(self):
+        if self._jsonl:
+            self._jsonl.close()
+        if self._csv:
+            self._arquivo_csv.close()
+        if self._html:
+            self._fechar_pagina(proxima=False)
+        self._jsonl = self._csv = self._html = None
+
+    def __bool__(self):
+        return any(self.contagem.values())
+
+
+# ============================================================
+# RELATÓRIO DA EXECUÇÃO
+# ============================================================
+
+class Relatorio:
+
+    def __init__(self, raiz, regras, formatos=("jsonl", "csv", "html"),
+                 por_pagina=500, base_url=None, manter_dias=30):
+        self.raiz = Path(raiz)
+        self.regras = regras
+        self.formatos = tuple(formatos)
+        self.por_pagina = por_pagina
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.manter_dias = manter_dias
+        self._lock = threading.Lock()
+        self.iniciar()
+
+    def iniciar(self):
+        """Nova execução: pasta com data/hora (criada só se houver mudança)."""
+
+        with self._lock:
+            self.pasta = self.raiz/f"{datetime.now():%Y%m%d_%H%M%S}"
+            # camada -> escritor da última execução (link do card)
+            self.camadas = {}
+            # todas as execuções, na ordem (índice), e os nomes já usados
+            self.execucoes = []
+            self._nomes = set()
+
+        self._limpar()
+
+    def _limpar(self):
+        if not self.manter_dias or not self.raiz.exists():
+            return
+        limite = time.time() - self.manter_dias * 86400
+        for pasta in self.raiz.iterdir():
+            if pasta.is_dir() and pasta.stat().st_mtime < limite:
+                shutil.rmtree(pasta, ignore_errors=True)
+
+    @contextmanager
+    def camada(self, layer):
+        """Escritor da camada; ao sair fecha os arquivos e atualiza o índice."""
+
+        with self._lock:
+            nome = self._nome(layer)
+
+        escritor = RelatorioCamada(self.pasta, layer, self.regras, self.formatos, self.por_pagina, nome)
+
+        try:
+            yield escritor
+        finally:
+            escritor.fechar()
+            if escritor:
+                with self._lock:
+                    self.camadas[layer] = escritor
+                    self.execucoes.append(escritor)
+                    self._gravar_indice()
+
+    def _nome(self, layer):
+        """Nome dos arquivos; camada repetida na pasta ganha a hora (e um contador)."""
+
+        base = layer.replace(":", "__")
+        nome = base
+
+        if nome in self._nomes:
+            base = nome = f"{base}.{datetime.now():%H%M%S}"
+            n = 1
+            while nome in self._nomes:
+                n += 1
+                nome = f"{base}.{n}"
+
+        self._nomes.add(nome)
+        return nome
+
+    def _gravar_indice(self):
+        linhas = []
+        for e in self.execucoes:
+            links = []
+            if e.paginas:
+                links.append(f'<a href="{quote(e.arquivo_pagina(1))}">HTML ({e.paginas} pág.)</a>')
+            for ext in ("jsonl", "csv"):
+                if ext in e.formatos:
+                    links.append(f'<a href="{quote(e.nome)}.{ext}">{ext.upper()}</a>')
+            c = e.contagem
+            linhas.append(
+                f"<tr><td>{html.escape(e.layer)}</td><td>{e.inicio:%H:%M:%S}</td><td>{c['adicionado']}</td>"
+                f"<td>{c['removido']}</td><td>{c['modificado']}</td><td>{' '.join(links)}</td></tr>"
+            )
+
+        corpo = (
+            "<table><tr><th>camada</th><th>hora</th><th>adicionados</th><th>removidos</th>"
+            f"<th>modificados</th><th>arquivos</th></tr>{''.join(linhas)}</table>"
+        )
+        titulo = f"Auditoria GeoServer – {datetime.strptime(self.pasta.name, '%Y%m%d_%H%M%S'):%d/%m/%Y %H:%M}"
+
+        tmp = self.pasta/"index.tmp"
+        tmp.write_text(_pagina_html(titulo, corpo), encoding="utf-8")
+        tmp.replace(self.pasta/"index.html")
+
+    # ---------------- consulta ----------------
+
+    def caminho(self):
+        """index.html da execução, se alguma camada teve mudança."""
+        return self.pasta/"index.html" if self.camadas else None
+
+    def link(self, camadas=()):
+        """
+        URL para o card do Teams (None sem base_url ou sem relatório):
+        a primeira página da camada quando há uma só, senão o índice.
+        """
+
+        if not self.base_url or not self.camadas:
+            return None
+
+        camadas = [c for c in camadas if c in self.camadas]
+        if len(camadas) == 1 and self.camadas[camadas[0]].paginas:
+            arquivo = self.camadas[camadas[0]].arquivo_pagina(1)
+        else:
+            arquivo = "index.html"
+
+        return f"{self.base_url}/{self.pasta.name}/{quote(arquivo)}"
@@ -0,0 +1,669 @@
+# ============================================================
+# GEOSERVER WFS LOCAL (SUBSTITUTO PARA TESTES DE CARGA)
+# ============================================================
+#
+# Serve camadas sintéticas (gerador_sintetico.py) com o subconjunto do WFS
+# 2.0 que baixar_geoserver.py usa:
+#
+#   GetFeature (outputFormat=application/json, startIndex/count, sortBy)
+#   GetFeature resultType=hits  -> numberMatched
+#   CQL_FILTER / FILTER (fes)   -> uma comparação simples (campo op valor)
+#   BBOX=minx,miny,maxx,maxy    -> features cujo envelope cruza a caixa
+#   GetCapabilities             -> FeatureTypeList com WGS84BoundingBox
+#                                  (ETag do conteúdo, 304 para If-None-Match)
+#   DescribeFeatureType         -> XSD com os campos da camada (typeNames=a,b
+#                                  -> um XSD com todas)
+#   ETag por versão             -> 304 para If-None-Match
+#
+# Além de:
+#   POST /webhook      aceita o card do Teams
+#   GET  /__stats      bytes enviados, requisições e status
+#   POST /__versao     passa a servir a próxima versão (add/rem/edit)
+#
+# Falhas injetáveis: latência, limite de banda, 5xx, corpo truncado,
+# conexão travada e 400 sem sortBy (como o GeoServer com paginação).
+# No webhook: 503 aleatório e 413 acima de um tamanho (como o Teams).
+#
+# Uso:
+#   python servidor_wfs_local.py [--porta 8600] [--n 50000]
+#       [--camada "semob:Frota por Operadora=frota:50000"] ...
+#       [--latencia 0.2] [--banda 2048] [--erro-5xx 0.05] [--truncar 0.02]
+#       [--travar 0.01 --travar-s 150] [--exigir-sortby]
+#       [--add 1 --rem 1 --edit 2] [--seed 42]
+#       [--webhook-erro 0.3] [--webhook-limite 28000] [--campo-novo 2]
+#
+# --campo-novo N: a partir da versão N as features ganham o campo
+# "observacao" (mudança de esquema, como um ALTER TABLE no GeoServer).
+
+import argparse
+import hashlib
+import html
+import json
+import operator
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from gerador_sintetico import ARQUETIPOS, gerar_camada, mutar
+
+CHUNK_SIZE = 1 << 16
+
+OPERADORES = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "=": operator.eq}
+
+FES = {
+    "PropertyIsGreaterThan": ">",
+    "PropertyIsGreaterThanOrEqualTo": ">=",
+    "PropertyIsLessThan": "<",
+    "PropertyIsLessThanOrEqualTo": "<=",
+    "PropertyIsEqualTo": "=",
+}
+
+
+# ============================================================
+# FILTROS
+# ============================================================
+
+def ler_filtro(params):
+    """
+    (campo, operador, valor) de CQL_FILTER ou FILTER (fes 2.0) com uma
+    única comparação; None sem filtro. ValueError no que não suporta.
+    """
+
+    if params.get("cql_filter"):
+        m = re.fullmatch(r'\s*"?([^"<>=\s]+)"?\s*(>=|<=|>|<|=)\s*(.+?)\s*', params["cql_filter"])
+        if not m:
+            raise ValueError(f"CQL_FILTER não suportado: {params['cql_filter']}")
+        campo, op, literal = m.groups()
+        if literal.startswith("'"):
+            return campo, op, literal[1:-1].replace("''", "'")
+        return campo, op, json.loads(literal)
+
+    if params.get("filter"):
+        m = re.search(
+            r"<(?:\w+:)?(PropertyIs\w+)>\s*<(?:\w+:)?ValueReference>(.*?)</(?:\w+:)?ValueReference>"
+            r"\s*<(?:\w+:)?Literal>(.*?)</(?:\w+:)?Literal>",
+            params["filter"], re.S,
+        )
+        if not m or m.group(1) not in FES:
+            raise ValueError("FILTER não suportado")
+        return html.unescape(m.group(2)), FES[m.group(1)], html.unescape(m.group(3))
+
+    return None
+
+
+def ler_bbox(params):
+    """[minx, miny, maxx, maxy] do parâmetro BBOX (o CRS, se vier, é ignorado)."""
+
+    if not params.get("bbox"):
+        return None
+
+    partes = params["bbox"].split(",")
+    try:
+        return [float(v) for v in partes[:4]]
+    except ValueError:
+        raise ValueError(f"BBOX inválido: {params['bbox']}")
+
+
+def envelope(geometria):
+    """[minx, miny, maxx, maxy] das coordenadas da geometria; None sem geometria."""
+
+    if not geometria:
+        return None
+
+    xs, ys = [], []
+
+    def visitar(c):
+        if c and isinstance(c[0], (int, float)):
+            xs.append(c[0])
+            ys.append(c[1])
+        else:
+            for item in c:
+                visitar(item)
+
+    if geometria.get("type") == "GeometryCollection":
+        for g in geometria.get("geometries", []):
+            e = envelope(g)
+            if e:
+                visitar([[e[0], e[1]], [e[2], e[3]]])
+    else:
+        visitar(geometria.get("coordinates") or [])
+
+    return [min(xs), min(ys), max(xs), max(ys)] if xs else None
+
+
+def casa(valor, op, literal):
+    if valor is None:
+        return False
+    # literal do fes chega como texto
+    if isinstance(valor, (int, float)) and isinstance(literal, str):
+        try:
+            literal = float(literal)
+        except ValueError:
+            return False
+    try:
+        return OPERADORES[op](valor, literal)
+    except TypeError:
+        return False
+
+
+# ============================================================
+# CAMADAS
+# ============================================================
+
+class Camada:
+    """
+    Features de uma versão gravadas em arquivo, uma após a outra, com o
+    offset de cada uma: páginas saem do disco sem gerar de novo.
+    """
+
+    def __init__(self, nome, arquetipo, n, pasta, opcoes):
+        self.nome = nome
+        self.arquetipo = arquetipo
+        self.n = n
+        self.pasta = pasta
+        self.opcoes = opcoes
+        self.versao = -1
+        # próximo índice de feature nova (os adicionados nunca repetem id)
+        self.proximo = n
+        self.lock = threading.Lock()
+        self.avancar()
+
+    def _ler(self, arquivo, offsets):
+        with open(arquivo, "rb") as f:
+            for i in range(len(offsets) - 1):
+                yield json.loads(f.read(offsets[i + 1] - offsets[i]))
+
+    def _features(self, versao):
+        o = self.opcoes
+        if versao == 0:
+            return gerar_camada(self.arquetipo, self.n, o.seed, o.vertices)
+        # versão v: um passo de add/rem/edit sobre a versão v-1 servida
+        inicio = self.proximo
+        self.proximo += round(self.total * o.add / 100)
+        return mutar(
+            self.arquetipo, self._ler(self.arquivo, self.offsets), inicio,
+            o.add, o.rem, o.edit, o.seed, versao, o.vertices
+        )
+
+    def avancar(self):
+        versao = self.versao + 1
+        arquivo = self.pasta/f"{self.arquetipo}.{id(self)}.v{versao}.jsonl"
+        offsets = array("Q", [0])
+        # envelope de cada feature (NaN sem geometria: nunca cruza um BBOX)
+        envelopes = array("d")
+        campos = {}
+
+        novo = self.opcoes.campo_novo and versao >= self.opcoes.campo_novo
+
+        with open(arquivo, "wb") as f:
+            for feat in self._features(versao):
+                if novo:
+                    feat["properties"]["observacao"] = ""
+                for k, v in feat["properties"].items():
+                    campos.setdefault(k, type(v))
+                envelopes.extend(envelope(feat.get("geometry")) or [float("nan")] * 4)
+                f.write(json.dumps(feat, ensure_ascii=False).encode("utf-8"))
+                offsets.append(f.tell())
+
+        with self.lock:
+            anterior = getattr(self, "arquivo", None)
+            self.arquivo, self.offsets, self.campos = arquivo, offsets, campos
+            self.envelopes = envelopes
+            self.versao = versao
+            self.etag = f'"{self.arquetipo}-{id(self)}-v{versao}"'
+
+        if anterior:
+            anterior.unlink(missing_ok=True)
+
+    @property
+    def total(self):
+        return len(self.offsets) - 1
+
+    def extensao(self):
+        """Envelope de todas as features da versão atual (None se nenhuma tem geometria)."""
+
+        with self.lock:
+            e = self.envelopes
+
+        minx = [e[i] for i in range(0, len(e), 4) if e[i] == e[i]]
+        if not minx:
+            return None
+        return [
+            min(minx),
+            min(e[i] for i in range(1, len(e), 4) if e[i] == e[i]),
+            max(e[i] for i in range(2, len(e), 4) if e[i] == e[i]),
+            max(e[i] for i in range(3, len(e), 4) if e[i] == e[i]),
+        ]
+
+    def filtrar(self, filtro, caixa=None):
+        """Posições das features da versão atual que passam no filtro e cruzam a caixa."""
+
+        with self.lock:
+            arquivo, offsets, e = self.arquivo, self.offsets, self.envelopes
+
+        posicoes = array("Q")
+
+        if caixa:
+            minx, miny, maxx, maxy = caixa
+            candidatas = [
+                i for i in range(len(offsets) - 1)
+                if e[4 * i] <= maxx and e[4 * i + 2] >= minx
+                and e[4 * i + 1] <= maxy and e[4 * i + 3] >= miny
+            ]
+        else:
+            candidatas = range(len(offsets) - 1)
+
+        if not filtro:
+            posicoes.extend(candidatas)
+            return posicoes
+
+        campo, op, literal = filtro
+
+        with open(arquivo, "rb") as f:
+            for i in candidatas:
+                f.seek(offsets[i])
+                feat = json.loads(f.read(offsets[i + 1] - offsets[i]))
+                if casa(feat["properties"].get(campo), op, literal):
+                    posicoes.append(i)
+
+        return posicoes
+
+
+# ============================================================
+# HTTP
+# ============================================================
+
+class Estatisticas:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.requisicoes = 0
+        self.status = {}
+
+    def contar(self, status, n):
+        with self.lock:
+            self.requisicoes += 1
+            self.bytes += n
+            self.status[str(status)] = self.status.get(str(status), 0) + 1
+
+    def dados(self):
+        with self.lock:
+            return {"bytes": self.bytes, "requisicoes": self.requisicoes, "status": dict(self.status)}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.opcoes.verbose:
+            super().log_message(fmt, *args)
+
+    # ---------------- envio ----------------
+
+    def _enviar(self, status, corpo, tipo="application/json", headers=None, contar=True):
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(corpo)
+        if contar:
+            self.server.stats.contar(status, len(corpo))
+
+    def _excecao(self, status, texto):
+        corpo = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1">'
+            f"<ows:Exception><ows:ExceptionText>{texto}</ows:ExceptionText>"
+            "</ows:Exception></ows:ExceptionReport>"
+        ).encode("utf-8")
+        self._enviar(status, corpo, "application/xml")
+
+    def _enviar_stream(self, camada, posicoes, total, falha):
+        """
+        Corpo do GetFeature (features nas posições pedidas) lido do arquivo
+        da camada, com limite de banda.
+        """
+
+        opcoes = self.server.opcoes
+
+        with camada.lock:
+            arquivo, offsets, etag = camada.arquivo, camada.offsets, camada.etag
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("ETag", etag)
+        self.send_header("Transfer-Encoding", "chunked")
+        # truncado: o cliente precisa ver fim de conexão, não de corpo
+        self.send_header("Connection", "close" if falha == "truncar" else "keep-alive")
+        self.end_headers()
+
+        enviados = 0
+        t0 = time.perf_counter()
+
+        def escrever(dados):
+            nonlocal enviados
+            self.wfile.write(f"{len(dados):x}\r\n".encode() + dados + b"\r\n")
+            enviados += len(dados)
+            if opcoes.banda:
+                atraso = enviados / (opcoes.banda * 1024) - (time.perf_counter() - t0)
+                if atraso > 0:
+                    time.sleep(atraso)
+
+        buf = bytearray(
+            b'{"type":"FeatureCollection","numberMatched":%d,"numberReturned":%d,"features":['
+            % (total, len(posicoes))
+        )
+        tamanho = sum(offsets[i + 1] - offsets[i] for i in posicoes)
+        lidos = 0
+
+        with open(arquivo, "rb") as f:
+
+            for n, i in enumerate(posicoes):
+                if n:
+                    buf += b","
+                if f.tell() != offsets[i]:
+                    f.seek(offsets[i])
+                buf += f.read(offsets[i + 1] - offsets[i])
+                lidos += offsets[i + 1] - offsets[i]
+
+                if falha and lidos >= tamanho // 2:
+                    escrever(bytes(buf))
+                    buf.clear()
+                    if falha == "truncar":
+                        self.server.stats.contar("truncado", enviados)
+                        self.close_connection = True
+                        return
+                    time.sleep(opcoes.travar_s)
+                    falha = None
+
+                if len(buf) >= CHUNK_SIZE:
+                    escrever(bytes(buf))
+                    buf.clear()
+
+        buf += b"]}"
+        escrever(bytes(buf))
+        self.wfile.write(b"0\r\n\r\n")
+        self.server.stats.contar(200, enviados)
+
+    # ---------------- rotas ----------------
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        corpo = self.rfile.read(tamanho)
+        caminho = urlsplit(self.path).path
+
+        if caminho == "/webhook":
+            opcoes = self.server.opcoes
+            if opcoes.webhook_limite and tamanho > opcoes.webhook_limite:
+                self.server.webhooks_recusados += 1
+                return self._enviar(413, b"Payload Too Large", "text/plain", contar=False)
+            if opcoes.webhook_erro and self.server.sortear() < opcoes.webhook_erro:
+                self.server.webhooks_recusados += 1
+                return self._enviar(503, b"indisponivel", "text/plain", contar=False)
+            self.server.webhooks.append(json.loads(corpo or b"{}"))
+            return self._enviar(200, b"1", "text/plain", contar=False)
+
+        if caminho == "/__versao":
+            for camada in self.server.camadas.values():
+                camada.avancar()
+            versoes = {c.nome: c.versao for c in self.server.camadas.values()}
+            return self._enviar(200, json.dumps(versoes).encode(), contar=False)
+
+        self._excecao(404, "não encontrado")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+
+        if url.path == "/__stats":
+            dados = {
+                **self.server.stats.dados(),
+                "webhooks": len(self.server.webhooks),
+                "webhooks_recusados": self.server.webhooks_recusados,
+                "webhook_bytes_max": max((len(json.dumps(w)) for w in self.server.webhooks), default=0),
+                "camadas": {
+                    c.nome: {"total": c.total, "versao": c.versao}
+                    for c in self.server.camadas.values()
+                },
+            }
+            return self._enviar(200, json.dumps(dados).encode(), contar=False)
+
+        params = {k.lower(): v[0] for k, v in parse_qs(url.query).items()}
+        pedido = params.get("request", "").lower()
+
+        if pedido == "getcapabilities":
+            return self._capabilities()
+
+        nomes = (params.get("typenames") or params.get("typename") or "").split(",")
+        camadas = [self.server.camadas.get(nome) for nome in nomes]
+
+        if None in camadas:
+            return self._excecao(400, "Feature type desconhecido")
+
+        if len(camadas) > 1 and pedido != "describefeaturetype":
+            return self._excecao(400, "mais de um typeName só no DescribeFeatureType")
+
+        camada = camadas[0]
+
+        opcoes = self.server.opcoes
+        rnd = self.server.sortear
+
+        if opcoes.latencia:
+            time.sleep(opcoes.latencia)
+
+        if rnd() < opcoes.erro_5xx:
+            return self._excecao(503, "Service Unavailable (injetado)")
+
+        if pedido == "describefeaturetype":
+            return self._describe(camadas)
+
+        if pedido != "getfeature":
+            return self._excecao(400, f"request não suportado: {params.get('request')}")
+
+        try:
+            filtro = ler_filtro(params)
+            caixa = ler_bbox(params)
+        except ValueError as e:
+            return self._excecao(400, str(e))
+
+        if filtro and filtro[0] not in camada.campos:
+            return self._excecao(400, f"Illegal property name: {filtro[0]}")
+
+        posicoes = camada.filtrar(filtro, caixa) if filtro or caixa else range(camada.total)
+
+        if params.get("resulttype") == "hits":
+            corpo = (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+                f'numberMatched="{len(posicoes)}" numberReturned="0" '
+                'timeStamp="2026-01-01T00:00:00Z"/>'
+            ).encode("utf-8")
+            return self._enviar(200, corpo, "application/xml")
+
+        sort_by = params.get("sortby")
+        if sort_by:
+            campo = sort_by.split()[0]
+            if campo not in camada.campos:
+                return self._excecao(400, f"sortBy: campo inexistente {campo}")
+        elif opcoes.exigir_sortby:
+            return self._excecao(400, "Cannot do natural order without a primary key, please add it or specify a manual sort over existing attributes")
+
+        etag = camada.etag
+        if self.headers.get("If-None-Match") == etag:
+            return self._enviar(304, b"", headers={"ETag": etag})
+
+        # ordem estável = ordem de geração; sortBy só é validado
+        total = len(posicoes)
+        inicio = min(int(params.get("startindex", 0)), total)
+        count = params.get("count") or params.get("maxfeatures")
+        fim = min(total, inicio + int(count)) if count else total
+
+        u = rnd()
+        falha = (
+            "truncar" if u < opcoes.truncar
+            else "travar" if u < opcoes.truncar + opcoes.travar
+            else None
+        )
+
+        self._enviar_stream(camada, posicoes[inicio:fim], total, falha)
+
+    def _capabilities(self):
+        tipos = []
+        for c in self.server.camadas.values():
+            e = c.extensao()
+            caixa = (
+                "<ows:WGS84BoundingBox>"
+                f"<ows:LowerCorner>{e[0]!r} {e[1]!r}</ows:LowerCorner>"
+                f"<ows:UpperCorner>{e[2]!r} {e[3]!r}</ows:UpperCorner>"
+                "</ows:WGS84BoundingBox>"
+            ) if e else ""
+            tipos.append(
+                f"<wfs:FeatureType><wfs:Name>{html.escape(c.nome)}</wfs:Name>"
+                f"<wfs:Title>{html.escape(c.nome.split(':')[-1])}</wfs:Title>"
+                f"<wfs:DefaultCRS>urn:ogc:def:crs:EPSG::4326</wfs:DefaultCRS>{caixa}</wfs:FeatureType>"
+            )
+        corpo = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<wfs:WFS_Capabilities version="2.0.0" xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+            'xmlns:ows="http://www.opengis.net/ows/1.1">'
+            f"<wfs:FeatureTypeList>{''.join(tipos)}</wfs:FeatureTypeList>"
+            "</wfs:WFS_Capabilities>"
+        ).encode("utf-8")
+        etag = f'"{hashlib.sha1(corpo).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._enviar(304, b"", headers={"ETag": etag})
+        self._enviar(200, corpo, "application/xml", {"ETag": etag})
+
+    def _describe(self, camadas):
+        tipos = {int: "xsd:int", float: "xsd:double", bool: "xsd:boolean"}
+        esquemas = []
+        for camada in camadas:
+            nome = camada.nome.split(":")[-1]
+            elementos = "".join(
+                f'<xsd:element maxOccurs="1" minOccurs="0" name="{c}" nillable="true" '
+                f'type="{tipos.get(t, "xsd:string")}"/>'
+                for c, t in camada.campos.items()
+            )
+            esquemas.append(
+                f'<xsd:complexType name="{nome}Type"><xsd:complexContent>'
+                '<xsd:extension base="gml:AbstractFeatureType"><xsd:sequence>'
+                '<xsd:element maxOccurs="1" minOccurs="0" name="geom" nillable="true" '
+                'type="gml:GeometryPropertyType"/>'
+                f"{elementos}"
+                "</xsd:sequence></xsd:extension></xsd:complexContent></xsd:complexType>"
+                f'<xsd:element name="{nome}" substitutionGroup="gml:AbstractFeature" '
+                f'type="{nome}Type"/>'
+            )
+        corpo = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+            'xmlns:gml="http://www.opengis.net/gml/3.2">'
+            f"{''.join(esquemas)}</xsd:schema>"
+        ).encode("utf-8")
+        self._enviar(200, corpo, "application/xml")
+
+
+def criar_servidor(opcoes, camadas_spec):
+    """
+    camadas_spec: [(typeName, arquetipo, n)].
+    Retorna o ThreadingHTTPServer (serve_forever fica com quem chama).
+    """
+
+    pasta = Path(tempfile.mkdtemp(prefix="wfs_local_"))
+    rnd = random.Random(opcoes.seed)
+    rnd_lock = threading.Lock()
+
+    def sortear():
+        with rnd_lock:
+            return rnd.random()
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", opcoes.porta), Handler)
+    servidor.daemon_threads = True
+    servidor.opcoes = opcoes
+    servidor.stats = Estatisticas()
+    servidor.webhooks = []
+    servidor.webhooks_recusados = 0
+    servidor.sortear = sortear
+    servidor.pasta = pasta
+    servidor.camadas = {
+        nome: Camada(nome, arquetipo, n, pasta, opcoes)
+        for nome, arquetipo, n in camadas_spec
+    }
+    return servidor
+
+
+def fechar(servidor):
+    servidor.server_close()
+    for c in servidor.camadas.values():
+        c.arquivo.unlink(missing_ok=True)
+    servidor.pasta.rmdir()
+
+
+def parse_args(argv=None):
+
+    ap = argparse.ArgumentParser(prog="servidor_wfs_local.py")
+    ap.add_argument("--porta", type=int, default=8600)
+    ap.add_argument("--n", type=int, default=50_000, help="features por camada padrão")
+    ap.add_argument(
+        "--camada", action="append", default=[],
+        help='"typeName=arquetipo:n" (padrão: uma camada por arquétipo)',
+    )
+    ap.add_argument("--vertices", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--add", type=float, default=1.0)
+    ap.add_argument("--rem", type=float, default=1.0)
+    ap.add_argument("--edit", type=float, default=2.0)
+    ap.add_argument("--latencia", type=float, default=0.0, help="segundos antes de cada resposta")
+    ap.add_argument("--banda", type=float, default=0.0, help="KB/s por resposta (0 = sem limite)")
+    ap.add_argument("--erro-5xx", type=float, default=0.0, help="probabilidade de 503")
+    ap.add_argument("--truncar", type=float, default=0.0, help="probabilidade de corpo truncado")
+    ap.add_argument("--travar", type=float, default=0.0, help="probabilidade de travar no meio do corpo")
+    ap.add_argument("--travar-s", type=float, default=150.0, help="duração da trava (> timeout do cliente)")
+    ap.add_argument("--exigir-sortby", action="store_true", help="400 em GetFeature sem sortBy")
+    ap.add_argument("--webhook-erro", type=float, default=0.0, help="probabilidade de 503 no webhook")
+    ap.add_argument("--webhook-limite", type=int, default=0, help="413 para cards acima de N bytes (0 = sem limite)")
+    ap.add_argument("--campo-novo", type=int, default=0, help="versão a partir da qual surge o campo observacao (0 = nunca)")
+    ap.add_argument("--verbose", action="store_true")
+
+    return ap.parse_args(argv)
+
+
+def camadas_de(opcoes):
+
+    if not opcoes.camada:
+        return [(layer, arquetipo, opcoes.n) for arquetipo, (layer, _, _) in ARQUETIPOS.items()]
+
+    spec = []
+    for item in opcoes.camada:
+        m = re.fullmatch(r"(.+)=(\w+)(?::(\d+))?", item)
+        if not m or m.group(2) not in ARQUETIPOS:
+            sys.exit(f"--camada inválida: {item} (arquétipos: {', '.join(ARQUETIPOS)})")
+        spec.append((m.group(1), m.group(2), int(m.group(3) or opcoes.n)))
+    return spec
+
+
+if __name__ == "__main__":
+
+    opcoes = parse_args()
+    servidor = criar_servidor(opcoes, camadas_de(opcoes))
+
+    for c in servidor.camadas.values():
+        print(f"{c.nome}: {c.total:,} features ({c.arquetipo})", flush=True)
+    print(f"WFS local em http://127.0.0.1:{opcoes.porta}/geoserver/semob/ows", flush=True)
+
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fechar(servidor)
@@ -0,0 +1,605 @@
+import json
+import os
+import struct
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import shapely
+
+from geojson_stream import (
+    CHUNK_SIZE,
+    SNAPSHOT_HEAD,
+    SNAPSHOT_TAIL,
+    SnapshotWriter,
+    is_line_snapshot,
+    read_feature_at,
+    read_snapshot,
+)
+from registros import AUSENTE, Registro, Registros
+
+
+# --------------------------------------------------
+# Interface
+# --------------------------------------------------
+#
+# Um store guarda o snapshot atual de cada camada. Cada feature tem um
+# "locator" (int) estável enquanto o snapshot não for regravado:
+#   - geojson: offset em bytes da linha da feature;
+#   - colunar: número da linha.
+# O manifesto guarda hash -> locators e a assinatura() do store.
+
+class SnapshotStore:
+
+    formato = ""
+    sufixo = ""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+
+    def path(self, layer: str) -> Path:
+        return self.base_dir / f"{layer.replace(':', '__')}{self.sufixo}"
+
+    def existe(self, layer: str) -> bool:
+        return self.path(layer).exists()
+
+    def assinatura(self, layer: str) -> Dict[str, Any]:
+        st = self.path(layer).stat()
+        return {"formato": self.formato, "tamanho": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def promover(self, layer: str, spool: Dict[str, Any]) -> Dict[str, List[int]]:
+        """Transforma o spool (.tmp em linhas) no snapshot; retorna hash -> locators."""
+        raise NotImplementedError
+
+    def promover_sem_indice(self, layer: str, arquivo: Path, offsets: Path) -> bool:
+        """
+        Promove o spool sem índice em memória (diff em disco). Se os
+        locators mudam, grava em offsets os offsets do spool em ordem de
+        locator (int64) e retorna True.
+        """
+        raise NotImplementedError
+
+    def ler(self, layer: str) -> Iterator[Tuple[Optional[int], Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def ler_em(self, layer: str, locators: Iterable[int],
+               registros: Optional[Registros] = None) -> Dict[int, Any]:
+        """
+        locator -> feature. Com registros, devolve Registro (compacto)
+        em vez de dict.
+        """
+        raise NotImplementedError
+
+    def gravar(self, layer: str, features: Iterable[Dict[str, Any]]) -> int:
+        """Regrava o snapshot a partir de features quaisquer."""
+        raise NotImplementedError
+
+    def contar(self, layer: str) -> int:
+        return sum(1 for _ in self.ler(layer))
+
+    def fatias(self, layer: str, n: int) -> List[Any]:
+        """
+        Até n fatias do snapshot (descritores pequenos e picklable) que,
+        lidas em ordem por ler_fatia, equivalem a ler(). [] = sem suporte.
+        """
+        return []
+
+    def ler_fatia(self, layer: str, fatia: Any) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def exportar_geojson(self, layer: str, destino: Path) -> int:
+        n = 0
+        with SnapshotWriter(destino) as w:
+            for _, feat in self.ler(layer):
+                w.write(feat)
+                n += 1
+        return n
+
+
+# --------------------------------------------------
+# GeoJSON (uma feature por linha)
+# --------------------------------------------------
+
+class GeoJSONStore(SnapshotStore):
+
+    formato = "geojson"
+    sufixo = ".geojson"
+
+    def promover(self, layer, spool):
+        os.replace(spool["arquivo"], self.path(layer))
+        return spool["indice"]
+
+    def promover_sem_indice(self, layer, arquivo, offsets):
+        os.replace(arquivo, self.path(layer))
+        return False
+
+    def ler(self, layer):
+        return read_snapshot(self.path(layer))
+
+    def ler_em(self, layer, locators, registros=None):
+        saida = {}
+        with open(self.path(layer), "rb") as f:
+            for loc in sorted(set(locators)):
+                feat = read_feature_at(f, loc)
+                saida[loc] = registros.de_feature(feat) if registros else feat
+        return saida
+
+    def gravar(self, layer, features):
+        tmp = self.path(layer).with_suffix(".geojson.w.tmp")
+        with SnapshotWriter(tmp) as w:
+            for feat in features:
+                w.write(feat)
+        os.replace(tmp, self.path(layer))
+        return w.total
+
+    def contar(self, layer):
+        path = self.path(layer)
+        if not is_line_snapshot(path):
+            return super().contar(layer)
+        if path.stat().st_size <= len(SNAPSHOT_HEAD) + len(SNAPSHOT_TAIL):
+            return 0
+        # uma feature por linha: cabeçalho e rodapé ocupam 2 linhas
+        n = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                n += chunk.count(b"\n")
+        return max(0, n - 2)
+
+    def fatias(self, layer, n):
+        """Faixas de bytes [início, fim) alinhadas ao começo das linhas."""
+
+        path = self.path(layer)
+        if not is_line_snapshot(path):
+            return []
+
+        tamanho = path.stat().st_size
+        inicio = len(SNAPSHOT_HEAD)
+        cortes = [inicio]
+
+        with open(path, "rb") as f:
+            for k in range(1, n):
+                alvo = inicio + (tamanho - inicio) * k // n
+                if alvo <= cortes[-1]:
+                    continue
+                f.seek(alvo - 1)
+                f.readline()
+                if f.tell() > cortes[-1] and f.tell() < tamanho:
+                    cortes.append(f.tell())
+
+        cortes.append(tamanho)
+        return list(zip(cortes, cortes[1:]))
+
+    def ler_fatia(self, layer, fatia):
+        inicio, fim = fatia
+        with open(self.path(layer), "rb") as f:
+            f.seek(inicio)
+            while f.tell() < fim:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    return
+                line = line.rstrip(b"\r\n")
+                if line.endswith(b","):
+                    line = line[:-1]
+                if not line or line == b"]}":
+                    continue
+                yield offset, json.loads(line)
+
+
+# --------------------------------------------------
+# Colunar comprimido
+# --------------------------------------------------
+#
+# Arquivo .colz:
+#   MAGIC | blocos zlib das colunas | rodapé zlib(JSON) | <Q tamanho rodapé> | MAGIC
+#
+# As linhas são agrupadas (ROW_GROUP linhas por grupo); cada coluna de
+# cada grupo é um bloco independente, então ler poucas colunas só
+# descomprime essas colunas. Colunas:
+#   "id"           id da feature (GeoServer)
+#   "p:<campo>"    propriedade; só-texto -> dicionário + índices int32
+#   "geom"         WKB (tamanhos int64, -1 = sem geometria)
+
+MAGIC = b"GSCOL\x01"
+ROW_GROUP = 8192
+
+_AUSENTE = object()
+
+
+def _pack(meta: Dict[str, Any], raw: bytes = b"") -> bytes:
+    head = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(struct.pack("<I", len(head)) + head + raw, 6)
+
+
+def _unpack(blob: bytes) -> Tuple[Dict[str, Any], bytes]:
+    data = zlib.decompress(blob)
+    (n,) = struct.unpack_from("<I", data)
+    return json.loads(data[4:4 + n]), data[4 + n:]
+
+
+def _encode_column(values: List[Any]) -> Tuple[str, bytes]:
+    ausentes = [i for i, v in enumerate(values) if v is _AUSENTE]
+
+    presentes = [v for v in values if v is not _AUSENTE]
+
+    if all(v is None or isinstance(v, str) for v in presentes):
+        dicionario: Dict[str, int] = {}
+        idx = array("i")
+        for v in values:
+            if v is _AUSENTE or v is None:
+                idx.append(-1)
+            else:
+                idx.append(dicionario.setdefault(v, len(dicionario)))
+        meta = {"d": list(dicionario), "a": ausentes}
+        return "dict", _pack(meta, idx.tobytes())
+
+    valores = [None if v is _AUSENTE else v for v in values]
+    return "json", _pack({"v": valores, "a": ausentes})
+
+
+def _decode_column(encoding: str, blob: bytes) -> List[Any]:
+    meta, raw = _unpack(blob)
+
+    if encoding == "dict":
+        idx = array("i")
+        idx.frombytes(raw)
+        d = meta["d"]
+        values = [d[i] if i >= 0 else None for i in idx]
+    else:
+        values = meta["v"]
+
+    for i in meta["a"]:
+        values[i] = _AUSENTE
+
+    return values
+
+
+def _encode_geometries(geoms: List[Optional[Dict]]) -> bytes:
+    presentes = [json.dumps(g) for g in geoms if g]
+    wkbs = iter(shapely.to_wkb(shapely.from_geojson(presentes)) if presentes else ())
+
+    tamanhos = array("q")
+    corpo = []
+
+    for g in geoms:
+        if not g:
+            tamanhos.append(-1)
+            continue
+        wkb = next(wkbs)
+        tamanhos.append(len(wkb))
+        corpo.append(wkb)
+
+    return _pack({"n": len(geoms)}, tamanhos.tobytes() + b"".join(corpo))
+
+
+def _split_geometries(blob: bytes) -> List[Optional[bytes]]:
+    """WKB de cada linha do bloco (None = sem geometria), sem decodificar."""
+
+    meta, raw = _unpack(blob)
+
+    tamanhos = array("q")
+    tamanhos.frombytes(raw[:8 * meta["n"]])
+
+    pos = 8 * meta["n"]
+    wkbs = []
+    for t in tamanhos:
+        if t < 0:
+            wkbs.append(None)
+        else:
+            wkbs.append(raw[pos:pos + t])
+            pos += t
+
+    return wkbs
+
+
+def _decode_geometries(blob: bytes) -> List[Optional[Dict]]:
+    geoms = shapely.from_wkb(_split_geometries(blob))
+    textos = shapely.to_geojson(geoms)
+
+    return [json.loads(t) if t is not None else None for t in textos]
+
+
+class ColumnarWriter:
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.f = open(self.path, "wb")
+        self.f.write(MAGIC)
+        self.grupos: List[Dict[str, Any]] = []
+        self.buffer: List[Dict[str, Any]] = []
+        self.total = 0
+
+    def write(self, feature: Dict[str, Any]) -> int:
+        self.buffer.append(feature)
+        self.total += 1
+        if len(self.buffer) >= ROW_GROUP:
+            self._flush()
+        return self.total - 1
+
+    def _bloco(self, blob: bytes) -> List[int]:
+        offset = self.f.tell()
+        self.f.write(blob)
+        return [offset, len(blob)]
+
+    def _flush(self) -> None:
+        if not self.buffer:
+            return
+
+        rows = self.buffer
+        colunas = {}
+
+        encoding, blob = _encode_column([f.get("id", _AUSENTE) for f in rows])
+        colunas["id"] = [encoding] + self._bloco(blob)
+
+        campos: Dict[str, None] = {}
+        for f in rows:
+            campos.update(dict.fromkeys(f.get("properties") or {}))
+
+        for campo in campos:
+            encoding, blob = _encode_column(
+                [(f.get("properties") or {}).get(campo, _AUSENTE) for f in rows]
+            )
+            colunas[f"p:{campo}"] = [encoding] + self._bloco(blob)
+
+        colunas["geom"] = ["wkb"] + self._bloco(
+            _encode_geometries([f.get("geometry") for f in rows])
+        )
+
+        self.grupos.append({"linhas": len(rows), "colunas": colunas})
+        self.buffer = []
+
+    def close(self) -> None:
+        self._flush()
+        rodape = zlib.compress(json.dumps(
+            {"versao": 1, "total": self.total, "grupos": self.grupos},
+            ensure_ascii=False
+        ).encode("utf-8"))
+        self.f.write(rodape)
+        self.f.write(struct.pack("<Q", len(rodape)))
+        self.f.write(MAGIC)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+class ColumnarStore(SnapshotStore):
+
+    formato = "colunar"
+    sufixo = ".colz"
+
+    def __init__(self, base_dir: Path):
+        super().__init__(base_dir)
+        self.geojson = GeoJSONStore(base_dir)
+
+    # ---------------- migração ----------------
+
+    def _migrar(self, layer: str) -> None:
+        """Converte um .geojson existente na primeira leitura."""
+        if self.path(layer).exists() or not self.geojson.existe(layer):
+            return
+        self.gravar(layer, (f for _, f in self.geojson.ler(layer)))
+        self.geojson.path(layer).unlink()
+
+    def existe(self, layer):
+        self._migrar(layer)
+        return self.path(layer).exists()
+
+    def assinatura(self, layer):
+        self._migrar(layer)
+        return super().assinatura(layer)
+
+    # ---------------- escrita ----------------
+
+    def gravar(self, layer, features):
+        tmp = self.path(layer).with_suffix(".colz.tmp")
+        with ColumnarWriter(tmp) as w:
+            for feat in features:
+                w.write(feat)
+        os.replace(tmp, self.path(layer))
+        return w.total
+
+    def promover(self, layer, spool):
+        linha_do_offset = {}
+
+        def features():
+            for offset, feat in read_snapshot(spool["arquivo"]):
+                linha_do_offset[offset] = len(linha_do_offset)
+                yield feat
+
+        self.gravar(layer, features())
+        Path(spool["arquivo"]).unlink()
+
+        return {
+            h: [linha_do_offset[o] for o in offsets]
+            for h, offsets in spool["indice"].items()
+        }
+
+    def promover_sem_indice(self, layer, arquivo, offsets):
+        buffer = array("q")
+
+        with open(offsets, "wb") as saida:
+
+            def features():
+                for offset, feat in read_snapshot(arquivo):
+                    buffer.append(offset)
+                    if len(buffer) >= ROW_GROUP:
+                        buffer.tofile(saida)
+                        del buffer[:]
+                    yield feat
+
+            self.gravar(layer, features())
+            buffer.tofile(saida)
+
+        Path(arquivo).unlink()
+        return True
+
+    # ---------------- leitura ----------------
+
+    def _rodape(self, f) -> Dict[str, Any]:
+        f.seek(-(8 + len(MAGIC)), os.SEEK_END)
+        (n,) = struct.unpack("<Q", f.read(8))
+        f.seek(-(8 + len(MAGIC) + n), os.SEEK_END)
+        return json.loads(zlib.decompress(f.read(n)))
+
+    def _bloco(self, f, grupo, nome) -> bytes:
+        _, offset, tamanho = grupo["colunas"][nome]
+        f.seek(offset)
+        return f.read(tamanho)
+
+    def _coluna(self, f, grupo, nome) -> Optional[List[Any]]:
+        if nome not in grupo["colunas"]:
+            return None
+        encoding = grupo["colunas"][nome][0]
+        blob = self._bloco(f, grupo, nome)
+        if encoding == "wkb":
+            return _decode_geometries(blob)
+        return _decode_column(encoding, blob)
+
+    def _linhas(self, f, grupo, colunas: Optional[List[str]]) -> List[Dict[str, Any]]:
+        n = grupo["linhas"]
+
+        campos = [
+            c[2:] for c in grupo["colunas"]
+            if c.startswith("p:") and (colunas is None or c[2:] in colunas)
+        ]
+
+        ids = self._coluna(f, grupo, "id")
+        props = [{} for _ in range(n)]
+
+        for campo in campos:
+            for i, v in enumerate(self._coluna(f, grupo, f"p:{campo}")):
+                if v is not _AUSENTE:
+                    props[i][campo] = v
+
+        geoms = (
+            self._coluna(f, grupo, "geom")
+            if colunas is None or "geometry" in colunas
+            else [None] * n
+        )
+
+        linhas = []
+        for i in range(n):
+            feat = {"type": "Feature"}
+            if ids[i] is not _AUSENTE:
+                feat["id"] = ids[i]
+            feat["properties"] = props[i]
+            feat["geometry"] = geoms[i]
+            linhas.append(feat)
+
+        return linhas
+
+    def _registros(self, f, grupo, registros: Registros, linhas: List[int]) -> List[Registro]:
+        """Registro das linhas pedidas do grupo: textos do dicionário, geometria em WKB."""
+
+        ids = self._coluna(f, grupo, "id")
+        campos = [c[2:] for c in grupo["colunas"] if c.startswith("p:")]
+        valores = [self._coluna(f, grupo, f"p:{c}") for c in campos]
+        geoms = _split_geometries(self._bloco(f, grupo, "geom"))
+
+        saida = []
+        for i in linhas:
+            presentes = [k for k, col in enumerate(valores) if col[i] is not _AUSENTE]
+            saida.append(Registro(
+                ids[i] if ids[i] is not _AUSENTE else AUSENTE,
+                registros.esquema(tuple(campos[k] for k in presentes)),
+                tuple([registros.texto(valores[k][i]) for k in presentes]),
+                geoms[i],
+            ))
+
+        return saida
+
+    def ler(self, layer, colunas: Optional[List[str]] = None):
+        """
+        Itera (linha, feature). colunas restringe as propriedades lidas
+        ("geometry" inclui a geometria); None lê tudo.
+        """
+        self._migrar(layer)
+        with open(self.path(layer), "rb") as f:
+            base = 0
+            for grupo in self._rodape(f)["grupos"]:
+                for i, feat in enumerate(self._linhas(f, grupo, colunas)):
+                    yield base + i, feat
+                base += grupo["linhas"]
+
+    def contar(self, layer):
+        self._migrar(layer)
+        with open(self.path(layer), "rb") as f:
+            return self._rodape(f)["total"]
+
+    def fatias(self, layer, n):
+        """(primeira linha, grupos) com os grupos de linhas repartidos em n."""
+
+        self._migrar(layer)
+        with open(self.path(layer), "rb") as f:
+            grupos = self._rodape(f)["grupos"]
+
+        fatias = []
+        base = 0
+        por_fatia = max(1, -(-len(grupos) // n))
+
+        for i in range(0, len(grupos), por_fatia):
+            parte = grupos[i:i + por_fatia]
+            fatias.append((base, parte))
+            base += sum(g["linhas"] for g in parte)
+
+        return fatias
+
+    def ler_fatia(self, layer, fatia):
+        base, grupos = fatia
+        with open(self.path(layer), "rb") as f:
+            for grupo in grupos:
+                for i, feat in enumerate(self._linhas(f, grupo, None)):
+                    yield base + i, feat
+                base += grupo["linhas"]
+
+    def ler_em(self, layer, locators, registros=None, colunas: Optional[List[str]] = None):
+        self._migrar(layer)
+        pedidos = sorted(set(locators))
+        saida = {}
+
+        with open(self.path(layer), "rb") as f:
+            base = 0
+            k = 0
+            for grupo in self._rodape(f)["grupos"]:
+                fim = base + grupo["linhas"]
+                j = k
+                while j < len(pedidos) and pedidos[j] < fim:
+                    j += 1
+                if j > k:
+                    if registros:
+                        linhas = self._registros(
+                            f, grupo, registros, [p - base for p in pedidos[k:j]]
+                        )
+                        saida.update(zip(pedidos[k:j], linhas))
+                    else:
+                        linhas = self._linhas(f, grupo, colunas)
+                        for p in pedidos[k:j]:
+                            saida[p] = linhas[p - base]
+                    k = j
+                base = fim
+
+        return saida
+
+
+# --------------------------------------------------
+# Fábrica
+# --------------------------------------------------
+
+STORES = {
+    GeoJSONStore.formato: GeoJSONStore,
+    ColumnarStore.formato: ColumnarStore,
+}
+
+
+def criar_store(formato: str, base_dir: Path) -> SnapshotStore:
+    if formato not in STORES:
+        raise ValueError(f"snapshot_format desconhecido: {formato}")
+    return STORES[formato](base_dir)
@@ -0,0 +1,176 @@
+# ============================================================
+# TESTE DE CARGA – AUDITORIA CONTRA O WFS LOCAL
+# ============================================================
+#
+# Sobe servidor_wfs_local.py em outro processo, roda baixar_geoserver.main()
+# contra ele (numa pasta temporária) e mede cada execução: tempo total,
+# bytes transferidos, requisições por status e o pico de RSS do processo
+# da auditoria (acumulado desde o início do processo, não o da execução).
+# Entre uma execução e a próxima o servidor passa para a versão seguinte
+# das camadas (um passo de add/rem/edit sobre a anterior), então toda
+# execução a partir da 2ª exercita o diff com as taxas pedidas.
+#
+# Ao final confere se o snapshot de cada camada tem o total servido.
+# --saida grava os resultados com as métricas por etapa de cada execução.
+#
+# Uso (mesmas opções do servidor_wfs_local.py, mais --execucoes):
+#   python teste_carga.py --n 100000 --execucoes 2
+#   python teste_carga.py --n 20000 --latencia 0.3 --banda 1024 --erro-5xx 0.1 --truncar 0.05
+#   python teste_carga.py --exigir-sortby --saida carga.json
+#   python teste_carga.py --n 5000 --webhook-erro 0.5 --webhook-limite 28000
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from metricas import rss_pico_mb
+from servidor_wfs_local import parse_args
+
+AQUI = Path(__file__).resolve().parent
+
+
+def subir_servidor(argv):
+
+    proc = subprocess.Popen(
+        [sys.executable, str(AQUI/"servidor_wfs_local.py"), *argv],
+        stdout=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+    )
+
+    for linha in proc.stdout:
+        print(f"  [wfs] {linha.rstrip()}", flush=True)
+        if linha.startswith("WFS local em "):
+            return proc, linha.split()[-1]
+
+    raise RuntimeError(f"servidor WFS local não subiu (código {proc.wait()})")
+
+
+def executar(argv):
+
+    argv = list(argv)
+    execucoes = 2
+    saida = None
+
+    if "--execucoes" in argv:
+        i = argv.index("--execucoes")
+        execucoes = int(argv[i + 1])
+        del argv[i:i + 2]
+
+    if "--saida" in argv:
+        i = argv.index("--saida")
+        saida = argv[i + 1]
+        del argv[i:i + 2]
+
+    opcoes = parse_args(argv)  # valida as opções antes de subir o servidor
+
+    proc, ows = subir_servidor(argv)
+    raiz = ows.split("/geoserver")[0]
+    cwd = os.getcwd()
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="carga_") as pasta:
+
+            # DOWNLOAD_DIR é relativo: import dentro da pasta temporária
+            os.chdir(pasta)
+
+            try:
+                sys.path.insert(0, str(AQUI))
+                import baixar_geoserver as bg
+
+                camadas = requests.get(f"{raiz}/__stats", timeout=10).json()["camadas"]
+
+                bg.BASE_URL = ows
+                bg.TEAMS_WEBHOOK = f"{raiz}/webhook"
+                # catálogo do servidor local, revalidado a cada execução;
+                # camada servida sem job no config.json (--camada) entra também
+                bg.CATALOGO = bg.Catalogo(bg.DOWNLOAD_DIR/"catalogo.json", bg.log, 0)
+                for nome in camadas:
+                    bg.JOBS.setdefault(nome, {"typeNames": nome, "enabled": True})
+
+                resultados = []
+
+                for n in range(execucoes):
+
+                    if n:
+                        requests.post(f"{raiz}/__versao", timeout=600)
+
+                    antes = requests.get(f"{raiz}/__stats", timeout=10).json()
+
+                    t = time.perf_counter()
+                    bg.main()
+                    dt = time.perf_counter() - t
+
+                    depois = requests.get(f"{raiz}/__stats", timeout=10).json()
+
+                    conferencia = {}
+                    for nome, info in depois["camadas"].items():
+                        manifest = bg.carregar_manifest(nome, bg.ignore_fields_de(nome))
+                        conferencia[nome] = {
+                            "servido": info["total"],
+                            "snapshot": manifest["total"] if manifest else None,
+                        }
+
+                    resultados.append({
+                        "execucao": n + 1,
+                        "segundos": round(dt, 2),
+                        "bytes": depois["bytes"] - antes["bytes"],
+                        "requisicoes": depois["requisicoes"] - antes["requisicoes"],
+                        "status": {
+                            k: v - antes["status"].get(k, 0)
+                            for k, v in depois["status"].items()
+                            if v - antes["status"].get(k, 0)
+                        },
+                        "webhooks": depois["webhooks"] - antes["webhooks"],
+                        "webhooks_recusados": depois["webhooks_recusados"] - antes["webhooks_recusados"],
+                        # ru_maxrss: acumulado desde o início do processo
+                        "pico_rss_processo_mb": rss_pico_mb(),
+                        "camadas": conferencia,
+                        "metricas": bg.METRICAS.dados(),
+                    })
+
+            finally:
+                os.chdir(cwd)
+
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print()
+    print(
+        f"Teste de carga: {len(camadas)} camadas, latência {opcoes.latencia}s, "
+        f"banda {opcoes.banda or '∞'} KB/s, 5xx {opcoes.erro_5xx:.0%}, "
+        f"truncado {opcoes.truncar:.0%}, travado {opcoes.travar:.0%}"
+    )
+
+    falhas = 0
+
+    for r in resultados:
+        mb = r["bytes"] / 2**20
+        print(
+            f"  execução {r['execucao']}: {r['segundos']:.1f}s | "
+            f"{mb:,.1f} MB ({mb / max(r['segundos'], 1e-9):,.1f} MB/s) | "
+            f"{r['requisicoes']} req {r['status']} | pico RSS do processo (acumulado) {r['pico_rss_processo_mb']} MB | "
+            f"Teams {r['webhooks']} card(s), {r['webhooks_recusados']} recusa(s)"
+        )
+        for nome, c in r["camadas"].items():
+            if c["servido"] != c["snapshot"]:
+                falhas += 1
+                print(f"    ❌ {nome}: servidas {c['servido']:,}, snapshot {c['snapshot']}")
+
+    if saida:
+        with open(saida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=1)
+
+    return falhas
+
+
+if __name__ == "__main__":
+
+    sys.exit(1 if executar(sys.argv[1:]) else 0)